@@ -0,0 +1,158 @@
+import os
+import time
+import random
+import threading
+from typing import Any, Callable, Dict, Optional
+from dotenv import load_dotenv
+import landingai_ade
+from landingai_ade import LandingAIADE
+
+load_dotenv()
+
+ADE_REQUESTS_PER_SECOND = float(os.getenv("ADE_REQUESTS_PER_SECOND", "2"))
+ADE_BURST = int(os.getenv("ADE_BURST", "4"))
+ADE_MAX_IN_FLIGHT = int(os.getenv("ADE_MAX_IN_FLIGHT", "4"))
+ADE_MAX_RETRIES = int(os.getenv("ADE_MAX_RETRIES", "5"))
+ADE_BACKOFF_BASE_SECONDS = float(os.getenv("ADE_BACKOFF_BASE_SECONDS", "1"))
+ADE_BACKOFF_MAX_SECONDS = float(os.getenv("ADE_BACKOFF_MAX_SECONDS", "60"))
+ADE_TIMEOUT_SECONDS = float(os.getenv("ADE_TIMEOUT_SECONDS", "300"))
+
+
+class TokenBucket:
+    """Thread-safe token bucket. The refill rate adapts: it halves on a 429
+    and creeps back toward the configured rate on every success.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.target_rate = max(0.01, rate)
+        self.rate = self.target_rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def throttle(self) -> None:
+        with self._lock:
+            self._refill()
+            self.rate = max(self.target_rate / 16, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+
+    def recover(self) -> None:
+        with self._lock:
+            if self.rate < self.target_rate:
+                self._refill()
+                self.rate = min(self.target_rate, self.rate + self.target_rate * 0.1)
+
+
+def _status_code(exc: Exception) -> Optional[int]:
+    code = getattr(exc, "status_code", None)
+    return int(code) if isinstance(code, int) else None
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        value = headers.get("retry-after")
+        return float(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+class ADEClient:
+    """One Landing AI client per process: shares the SDK's HTTP connection pool and
+    enforces the requests-per-second and in-flight limits across all callers (OCR
+    workers, batch runs). 429/5xx and connection errors are retried with jittered
+    exponential backoff; the SDK's own retries are disabled so limits stay accurate.
+    """
+
+    def __init__(self):
+        environment = os.getenv("ADE_ENVIRONMENT", "production").lower()
+        kwargs: Dict[str, Any] = {"max_retries": 0, "timeout": ADE_TIMEOUT_SECONDS}
+        if environment == "eu":
+            kwargs["environment"] = "eu"
+        self._client = LandingAIADE(**kwargs)
+        self._bucket = TokenBucket(ADE_REQUESTS_PER_SECOND, ADE_BURST)
+        self._slots = threading.BoundedSemaphore(max(1, ADE_MAX_IN_FLIGHT))
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "retries": 0, "throttled": 0, "failures": 0}
+
+    def _bump(self, key: str) -> None:
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _call(self, fn: Callable[..., Any], **kwargs: Any) -> Any:
+        attempt = 0
+        while True:
+            self._bucket.acquire()
+            with self._slots:
+                self._bump("requests")
+                try:
+                    result = fn(**kwargs)
+                    self._bucket.recover()
+                    return result
+                except Exception as e:
+                    status = _status_code(e)
+                    retryable = (
+                        status == 429
+                        or (status is not None and status >= 500)
+                        or isinstance(e, landingai_ade.APIConnectionError)
+                    )
+                    if not retryable or attempt >= ADE_MAX_RETRIES:
+                        self._bump("failures")
+                        raise
+                    if status == 429:
+                        self._bump("throttled")
+                        self._bucket.throttle()
+                    delay = _retry_after(e)
+            cap = min(ADE_BACKOFF_MAX_SECONDS, ADE_BACKOFF_BASE_SECONDS * (2 ** attempt))
+            if delay is None:
+                delay = random.uniform(cap / 2, cap)
+            self._bump("retries")
+            attempt += 1
+            time.sleep(min(delay, ADE_BACKOFF_MAX_SECONDS))
+
+    def parse(self, **kwargs: Any) -> Any:
+        return self._call(self._client.parse, **kwargs)
+
+    def extract(self, **kwargs: Any) -> Any:
+        return self._call(self._client.extract, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["currentRatePerSecond"] = round(self._bucket.rate, 3)
+        stats["targetRatePerSecond"] = self._bucket.target_rate
+        stats["maxInFlight"] = ADE_MAX_IN_FLIGHT
+        return stats
+
+
+_ade_client: Optional[ADEClient] = None
+_ade_client_lock = threading.Lock()
+
+
+def get_ade_client() -> ADEClient:
+    global _ade_client
+    if _ade_client is not None:
+        return _ade_client
+    with _ade_client_lock:
+        if _ade_client is None:
+            _ade_client = ADEClient()
+    return _ade_client
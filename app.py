@@ -4,21 +4,32 @@ from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
 from email_client import fetch_and_process_invoices
 from storage_local import upload_invoice as save_invoice_file
-from ocr_landingai import ocr_invoice_to_json
-from invoice_db import save_invoice_to_db,get_dashboard_stats,get_graph_data,get_recent_invoices,get_invoice_by_id,get_exception_invoices,get_payable_invoices
-from payments import create_payment_intent_for_invoices, mark_payment_failed_or_canceled, confirm_payment_intent
+from ocr_jobs import enqueue_ocr_job,get_ocr_job,get_ocr_queue_stats,start_ocr_workers
+from ocr_cache import get_ocr_cache_stats,purge_ocr_cache
+from ade_client import get_ade_client
+from po_matching import rematch_unmatched_invoices,start_po_match_worker,REMATCH_INTERVAL_MINUTES
+from line_matching import get_line_match_report
+from po_lookup import lookup_po_number
+from po_allocation import allocate_unmatched_invoices,get_po_allocations
+from invoice_db import get_dashboard_stats,get_graph_data,get_recent_invoices,get_invoice_by_id,get_invoices_by_ids,get_exception_invoices,get_payable_invoices
+from invoice_db import get_recent_invoices_page,get_exception_invoices_page,get_payable_invoices_page
+from payments import create_payment_intent_for_invoices, mark_payment_failed_or_canceled, confirm_payment_intent, release_stale_payment_reservations
 import stripe
-from po_matching import match_invoice
-from vendor_db import get_vendors,get_all_vendors_detailed,get_vendor_stats,get_vendor_by_id_detailed,create_vendor,delete_vendor
+from vendor_db import get_vendors,get_all_vendors_detailed,get_vendor_stats,get_vendor_by_id_detailed,create_vendor,advance_vendor_activity_window
+from vendor_db import VENDOR_PO_MENTIONS_SQL,VENDOR_INVOICE_MENTIONS_SQL
+from vendor_matching import match_vendor,resolve_unassigned_invoices
+from vendor_deletion import enqueue_vendor_deletion,get_vendor_deletion_job,start_vendor_deletion_worker
 from chat_db import create_chat as db_create_chat, list_messages as db_list_messages, add_message as db_add_message, get_chat_vendor, list_chats_for_vendor as db_list_chats
 from chat_llm import generate_vendor_response, generate_chat_title
-from db import get_conn
+from db import get_conn,get_pool_stats
 from flask import Response, stream_with_context
 from po_db import get_po_by_id as get_po_detail
 
 load_dotenv()
 
 CHECK_INTERVAL_SECONDS=int(os.getenv("CHECK_INTERVAL_SECONDS","30"))
+GRAPH_WINDOWS_DAYS=(30,90,365)
+INVOICE_BATCH_MAX_IDS=int(os.getenv("INVOICE_BATCH_MAX_IDS","200"))
 
 app=Flask(__name__)
 app.secret_key=os.getenv("FLASK_SECRET_KEY","change-me")
@@ -190,21 +201,8 @@ def upload_page():
                 full_path,uploaded=save_invoice_file("upload_vendor_"+selected_vendor_id,message_id,file.filename,payload)
                 if uploaded:
                     logs.append(f"Saved upload to {full_path}")
-                    json_path=ocr_invoice_to_json(full_path)
-                    if json_path:
-                        logs.append(f"OCR/parse completed; JSON saved to {json_path}")
-                        invoice_id=save_invoice_to_db(json_path,full_path,None,message_id,selected_vendor_id)
-                        if invoice_id:
-                            logs.append(f"Invoice saved to Supabase with id={invoice_id}")
-                            matched_po_id=match_invoice(invoice_id)
-                            if matched_po_id:
-                                logs.append(f"Invoice {invoice_id} matched to PO {matched_po_id}")
-                            else:
-                                logs.append(f"Invoice {invoice_id} not matched to any PO")
-                        else:
-                            logs.append("Failed to save invoice to Supabase")
-                    else:
-                        logs.append("OCR/parse skipped or failed for uploaded file")
+                    job_id=enqueue_ocr_job(full_path,None,message_id,selected_vendor_id)
+                    logs.append(f"Queued for OCR as job {job_id}; progress at /api/ocr/jobs/{job_id}")
                 else:
                     logs.append("Upload treated as duplicate; file already exists")
             except Exception as e:
@@ -218,6 +216,66 @@ def upload_page():
         selected_vendor_id=selected_vendor_id,
     )
 
+@app.route("/api/db/pool-stats", methods=["GET"])
+def api_db_pool_stats():
+    """Connection pool checkout and wait-time metrics for this process."""
+    try:
+        return jsonify(get_pool_stats())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/ocr/jobs/stats", methods=["GET"])
+def api_ocr_queue_stats():
+    """OCR queue depth by stage and live worker count."""
+    try:
+        return jsonify(get_ocr_queue_stats())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/ocr/cache/stats", methods=["GET"])
+def api_ocr_cache_stats():
+    """OCR result cache hit/miss counters for this process."""
+    try:
+        return jsonify(get_ocr_cache_stats())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/ocr/client/stats", methods=["GET"])
+def api_ocr_client_stats():
+    """Landing AI request, retry and throttling counters for this process."""
+    try:
+        return jsonify(get_ade_client().stats())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/ocr/jobs/<job_id>", methods=["GET"])
+def api_ocr_job_detail(job_id):
+    """Stage and outcome of a single OCR job."""
+    try:
+        job = get_ocr_job(job_id)
+        if job:
+            return jsonify(job)
+        else:
+            return jsonify({"error": "Job not found"}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/matching/rematch",methods=["POST"])
+def api_matching_rematch():
+    """Re-run PO matching for all unmatched invoices now"""
+    try:
+        return jsonify(rematch_unmatched_invoices())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/matching/allocate",methods=["POST"])
+def api_matching_allocate():
+    """Allocate unmatched invoices against open PO balances (split billing) now"""
+    try:
+        return jsonify(allocate_unmatched_invoices())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 # API Routes for Dashboard Frontend
 @app.route("/api/dashboard/stats",methods=["GET"])
 def api_dashboard_stats():
@@ -230,9 +288,12 @@ def api_dashboard_stats():
 
 @app.route("/api/dashboard/graph-data",methods=["GET"])
 def api_graph_data():
-    """Get graph data for last 30 days"""
+    """Get graph data for the last 30, 90 or 365 days"""
     try:
-        data = get_graph_data(30)
+        days = request.args.get("days", default=30, type=int)
+        if days not in GRAPH_WINDOWS_DAYS:
+            return jsonify({"error": f"days must be one of {list(GRAPH_WINDOWS_DAYS)}"}), 400
+        data = get_graph_data(days)
         return jsonify(data)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -242,8 +303,13 @@ def api_recent_invoices():
     """Get recent invoices"""
     try:
         limit = request.args.get("limit", default=10, type=int)
+        # Passing cursor (empty for the first page) opts into {"items", "nextCursor"}
+        if "cursor" in request.args:
+            return jsonify(get_recent_invoices_page(limit, cursor=request.args.get("cursor") or None))
         invoices = get_recent_invoices(limit)
         return jsonify(invoices)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -259,6 +325,28 @@ def api_invoice_detail(invoice_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/invoices/batch",methods=["POST"])
+def api_invoices_batch():
+    """Get details (with lines) for many invoices: {"ids": [...]}"""
+    try:
+        data = request.get_json(force=True) or {}
+        ids = data.get("ids") or []
+        if not isinstance(ids, list):
+            return jsonify({"error": "ids must be a list"}), 400
+        if len(ids) > INVOICE_BATCH_MAX_IDS:
+            return jsonify({"error": f"at most {INVOICE_BATCH_MAX_IDS} ids per request"}), 400
+        return jsonify(get_invoices_by_ids(ids))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/invoices/<invoice_id>/line-matches",methods=["GET"])
+def api_invoice_line_matches(invoice_id):
+    """Per-line PO match report from the last line-level matching run"""
+    try:
+        return jsonify(get_line_match_report(invoice_id))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 # Vendor API Routes
 @app.route("/api/vendors",methods=["GET"])
 def api_vendors_list():
@@ -308,13 +396,46 @@ def api_vendor_create():
 
 @app.route("/api/vendors/<vendor_id>", methods=["DELETE"])
 def api_vendor_delete(vendor_id):
-    """Delete a vendor and related records."""
+    """Queue deletion of a vendor and related records; poll the returned job for progress."""
     try:
-        summary = delete_vendor(vendor_id)
-        return jsonify({"deleted": summary})
+        job = enqueue_vendor_deletion(vendor_id)
+        return jsonify({"job": job}), 202
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@app.route("/api/vendors/match", methods=["GET"])
+def api_vendor_match():
+    """Scored vendor candidates for ?name=&taxId=&address= (fuzzy, legal suffixes ignored)"""
+    try:
+        name = (request.args.get("name") or "").strip() or None
+        tax_id = (request.args.get("taxId") or request.args.get("tax_id") or "").strip() or None
+        address = (request.args.get("address") or "").strip() or None
+        limit = request.args.get("limit", default=5, type=int)
+        return jsonify(match_vendor(tax_id=tax_id, name=name, address=address, limit=max(1, min(limit, 50))))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/vendors/resolve-invoices", methods=["POST"])
+def api_vendor_resolve_invoices():
+    """Assign vendors to every invoice that has none, using the fuzzy matcher"""
+    try:
+        return jsonify(resolve_unassigned_invoices())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/vendors/deletions/<job_id>", methods=["GET"])
+def api_vendor_deletion_status(job_id):
+    """Progress of a vendor deletion job (rows deleted so far per table)"""
+    try:
+        job = get_vendor_deletion_job(job_id)
+        if job:
+            return jsonify(job)
+        return jsonify({"error": "Job not found"}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 # Mentions (typeahead for @)
 @app.route("/api/vendors/<vendor_id>/mentions", methods=["GET"])
 def api_vendor_mentions(vendor_id):
@@ -326,16 +447,7 @@ def api_vendor_mentions(vendor_id):
             with conn.cursor() as cur:
                 items = []
                 if kind == "pos":
-                    cur.execute(
-                        """
-                        SELECT id, po_number, total_amount, currency
-                        FROM purchase_orders
-                        WHERE vendor_id=%s AND (%s='' OR po_number ILIKE %s)
-                        ORDER BY created_at DESC NULLS LAST, id DESC
-                        LIMIT %s
-                        """,
-                        (vendor_id, q, f"%{q}%", limit)
-                    )
+                    cur.execute(VENDOR_PO_MENTIONS_SQL, (vendor_id, q, f"%{q}%", limit))
                     for row in cur.fetchall():
                         items.append({
                             "id": str(row[0]),
@@ -346,16 +458,7 @@ def api_vendor_mentions(vendor_id):
                             }
                         })
                 else:
-                    cur.execute(
-                        """
-                        SELECT id, invoice_number, total_amount, currency, invoice_date
-                        FROM invoices
-                        WHERE vendor_id=%s AND (%s='' OR invoice_number ILIKE %s)
-                        ORDER BY created_at DESC NULLS LAST, id DESC
-                        LIMIT %s
-                        """,
-                        (vendor_id, q, f"%{q}%", limit)
-                    )
+                    cur.execute(VENDOR_INVOICE_MENTIONS_SQL, (vendor_id, q, f"%{q}%", limit))
                     for row in cur.fetchall():
                         items.append({
                             "id": str(row[0]),
@@ -433,28 +536,22 @@ def api_chat_send(vendor_id, chat_id):
                 try:
                     from chat_llm import _get_claude_client, _build_system_prompt, _summarize_invoice as _si, _summarize_po as _sp
                     from vendor_db import get_vendor_by_id_detailed as _get_vendor
-                    from invoice_db import get_invoice_by_id as _get_inv
-                    from po_db import get_po_by_id as _get_po
+                    from invoice_db import get_invoices_by_ids as _get_invs
+                    from po_db import get_pos_by_ids as _get_pos
                     import json as _json
                     vendor = _get_vendor(vendor_id)
                     system_prompt = _build_system_prompt(vendor or {})
                     client = _get_claude_client()
                     if client is not None:
                         ctx = {"vendor": {"id": vendor_id, "name": (vendor or {}).get("name", "")}, "invoices": [], "pos": []}
-                        for _iid in inv_ids or []:
-                            try:
-                                _inv = _get_inv(_iid)
-                                if _inv:
-                                    ctx["invoices"].append(_si(_inv))
-                            except Exception:
-                                pass
-                        for _pid in po_ids or []:
-                            try:
-                                _po = _get_po(_pid)
-                                if _po:
-                                    ctx["pos"].append(_sp(_po))
-                            except Exception:
-                                pass
+                        try:
+                            ctx["invoices"] = [_si(_inv) for _inv in _get_invs(inv_ids)]
+                        except Exception:
+                            pass
+                        try:
+                            ctx["pos"] = [_sp(_po) for _po in _get_pos(po_ids)]
+                        except Exception:
+                            pass
                         user_text = (
                             "Context JSON (use strictly, do not fabricate outside it):\n"
                             + _json.dumps(ctx, ensure_ascii=False)
@@ -526,23 +623,11 @@ def api_chat_send(vendor_id, chat_id):
         # Try to assign a title if missing
         try:
             from vendor_db import get_vendor_by_id_detailed as _get_vendor
-            from invoice_db import get_invoice_by_id as _get_inv
-            from po_db import get_po_by_id as _get_po
+            from invoice_db import get_invoices_by_ids as _get_invs
+            from po_db import get_pos_by_ids as _get_pos
             vendor = _get_vendor(vendor_id) or {}
-            invs = []
-            pos_list = []
-            for _iid in inv_ids:
-                try:
-                    ii = _get_inv(_iid)
-                    if ii: invs.append(ii)
-                except Exception:
-                    pass
-            for _pid in po_ids:
-                try:
-                    pp = _get_po(_pid)
-                    if pp: pos_list.append(pp)
-                except Exception:
-                    pass
+            invs = _get_invs(inv_ids)
+            pos_list = _get_pos(po_ids)
             title = generate_chat_title(vendor, prompt, invs, pos_list)
             from chat_db import update_chat_title
             update_chat_title(chat_id, title)
@@ -580,8 +665,8 @@ def api_chat_stream(vendor_id, chat_id):
             try:
                 from chat_llm import _get_claude_client, _build_system_prompt, _summarize_invoice as _si, _summarize_po as _sp
                 from vendor_db import get_vendor_by_id_detailed as _get_vendor
-                from invoice_db import get_invoice_by_id as _get_inv
-                from po_db import get_po_by_id as _get_po
+                from invoice_db import get_invoices_by_ids as _get_invs
+                from po_db import get_pos_by_ids as _get_pos
                 import json as _json
                 vendor = _get_vendor(vendor_id)
                 if vendor:
@@ -599,20 +684,14 @@ def api_chat_stream(vendor_id, chat_id):
                         "invoices": [],
                         "pos": [],
                     }
-                    for _iid in inv_ids or []:
-                        try:
-                            _inv = _get_inv(_iid)
-                            if _inv:
-                                ctx["invoices"].append(_si(_inv))
-                        except Exception:
-                            pass
-                    for _pid in po_ids or []:
-                        try:
-                            _po = _get_po(_pid)
-                            if _po:
-                                ctx["pos"].append(_sp(_po))
-                        except Exception:
-                            pass
+                    try:
+                        ctx["invoices"] = [_si(_inv) for _inv in _get_invs(inv_ids)]
+                    except Exception:
+                        pass
+                    try:
+                        ctx["pos"] = [_sp(_po) for _po in _get_pos(po_ids)]
+                    except Exception:
+                        pass
                     user_text = (
                         "Context JSON (use strictly, do not fabricate outside it):\n"
                         + _json.dumps(ctx, ensure_ascii=False)
@@ -693,8 +772,30 @@ def api_exception_invoices():
         vendor_id = request.args.get("vendor_id") or request.args.get("vendorId")
         limit = request.args.get("limit", default=100, type=int)
         status = request.args.get("status")
+        if "cursor" in request.args:
+            return jsonify(get_exception_invoices_page(vendor_id=vendor_id, limit=limit, status=status, cursor=request.args.get("cursor") or None))
         items = get_exception_invoices(vendor_id=vendor_id, limit=limit, status=status)
         return jsonify(items)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/purchase-orders/lookup", methods=["GET"])
+def api_purchase_order_lookup():
+    """Open POs whose number matches ?po= exactly or nearly, ranked by confidence"""
+    try:
+        po = (request.args.get("po") or "").strip()
+        limit = request.args.get("limit", default=5, type=int)
+        return jsonify(lookup_po_number(po, limit=max(1, min(limit, 50))))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/purchase-orders/<po_id>/allocations", methods=["GET"])
+def api_purchase_order_allocations(po_id):
+    """Invoice amounts allocated against a PO and its remaining balance"""
+    try:
+        return jsonify(get_po_allocations(po_id))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -718,8 +819,12 @@ def api_invoices_payable():
         vendor_id = request.args.get("vendor_id") or request.args.get("vendorId")
         currency = request.args.get("currency")
         limit = request.args.get("limit", default=200, type=int)
+        if "cursor" in request.args:
+            return jsonify(get_payable_invoices_page(vendor_id=vendor_id, currency=currency, limit=limit, cursor=request.args.get("cursor") or None))
         items = get_payable_invoices(vendor_id=vendor_id, currency=currency, limit=limit)
         return jsonify(items)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -768,8 +873,18 @@ def api_cancel_payment():
 def start_scheduler():
     scheduler=BackgroundScheduler(daemon=True)
     scheduler.add_job(run_job,"interval",seconds=CHECK_INTERVAL_SECONDS)
+    scheduler.add_job(purge_ocr_cache,"interval",hours=24)
+    scheduler.add_job(release_stale_payment_reservations,"interval",minutes=5)
+    scheduler.add_job(rematch_unmatched_invoices,"interval",minutes=REMATCH_INTERVAL_MINUTES)
+    scheduler.add_job(allocate_unmatched_invoices,"interval",minutes=REMATCH_INTERVAL_MINUTES)
+    scheduler.add_job(resolve_unassigned_invoices,"interval",minutes=REMATCH_INTERVAL_MINUTES)
+    # Slide the vendor_activity 30-day window
+    scheduler.add_job(advance_vendor_activity_window,"cron",hour=0,minute=5)
     scheduler.start()
 
 if __name__=="__main__":
     start_scheduler()
+    start_ocr_workers()
+    start_po_match_worker()
+    start_vendor_deletion_worker()
     app.run(host="127.0.0.1",port=int(os.getenv("PORT","5000")),debug=False)
@@ -0,0 +1,77 @@
+"""Benchmark invoice line insertion: per-row execute vs executemany vs COPY.
+
+Runs against DATABASE_URL inside one transaction that is rolled back; lines go
+to a temporary invoice_lines table that shadows the real one for this session:
+    python bench_line_insert.py --repeat 5
+"""
+import argparse
+import time
+import uuid
+from statistics import median
+from db import get_conn
+from invoice_db import _LINE_COLUMNS, _line_rows
+
+SIZES = (10, 100, 2000)
+
+def _sample_lines(n: int):
+    return [
+        {
+            "line_number": i + 1,
+            "description": f"Freight leg {i + 1}",
+            "sku": f"SKU-{i:05d}",
+            "quantity": 1.0 + i % 7,
+            "unit_of_measure": "EA",
+            "unit_price": 12.5,
+            "line_total": 12.5 * (1.0 + i % 7),
+            "tax_rate": 8.25,
+            "tax_code": "STD",
+            "po_number": "4500012345",
+            "po_line_number": str(i % 50 + 1),
+        }
+        for i in range(n)
+    ]
+
+def _insert_loop(cur, rows, sql):
+    for row in rows:
+        cur.execute(sql, row)
+
+def _insert_many(cur, rows, sql):
+    cur.executemany(sql, rows)
+
+def _insert_copy(cur, rows, columns):
+    with cur.copy(f"copy invoice_lines({columns}) from stdin") as copy:
+        for row in rows:
+            copy.write_row(row)
+
+def main(repeat: int) -> None:
+    columns = ",".join(_LINE_COLUMNS)
+    sql = f"insert into invoice_lines({columns}) values({','.join(['%s'] * len(_LINE_COLUMNS))})"
+    methods = {
+        "execute loop": lambda cur, rows: _insert_loop(cur, rows, sql),
+        "executemany": lambda cur, rows: _insert_many(cur, rows, sql),
+        "copy": lambda cur, rows: _insert_copy(cur, rows, columns),
+    }
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("create temp table invoice_lines (like public.invoice_lines including defaults) on commit drop")
+            print(f"{'lines':>6}  {'method':<13} {'median ms':>10} {'speedup':>8}")
+            for n in SIZES:
+                lines = _sample_lines(n)
+                baseline = None
+                for name, fn in methods.items():
+                    timings = []
+                    for _ in range(repeat):
+                        rows = _line_rows(str(uuid.uuid4()), lines)
+                        started = time.perf_counter()
+                        fn(cur, rows)
+                        timings.append((time.perf_counter() - started) * 1000.0)
+                    ms = median(timings)
+                    baseline = baseline or ms
+                    print(f"{n:>6}  {name:<13} {ms:>10.2f} {baseline / ms:>7.1f}x")
+                cur.execute("truncate invoice_lines")
+        conn.rollback()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    main(parser.parse_args().repeat)
@@ -2,8 +2,8 @@ import os
 from typing import Any, Dict, List, Optional
 
 from vendor_db import get_vendor_by_id_detailed
-from invoice_db import get_invoice_by_id
-from po_db import get_po_by_id
+from invoice_db import get_invoices_by_ids
+from po_db import get_pos_by_ids
 
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "claude").lower()
 
@@ -119,21 +119,15 @@ def generate_vendor_response(
     }
 
     if invoice_ids:
-        for iid in invoice_ids:
-            try:
-                inv = get_invoice_by_id(iid)
-                if inv:
-                    context["invoices"].append(_summarize_invoice(inv))
-            except Exception:
-                pass
+        try:
+            context["invoices"] = [_summarize_invoice(inv) for inv in get_invoices_by_ids(invoice_ids)]
+        except Exception:
+            pass
     if po_ids:
-        for pid in po_ids:
-            try:
-                po = get_po_by_id(pid)
-                if po:
-                    context["pos"].append(_summarize_po(po))
-            except Exception:
-                pass
+        try:
+            context["pos"] = [_summarize_po(po) for po in get_pos_by_ids(po_ids)]
+        except Exception:
+            pass
 
     system_prompt = _build_system_prompt(vendor)
 
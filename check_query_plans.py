@@ -0,0 +1,206 @@
+"""Assert that the hot queries plan as index scans at production scale.
+
+Seeds temporary vendors / purchase_orders / invoices / line tables that shadow the
+real ones for this session (same columns and indexes via LIKE ... INCLUDING ALL),
+runs EXPLAIN on each hot query and rolls everything back. Queries are taken from the
+modules that issue them (SQL constants, or the function itself run on an EXPLAIN cursor),
+so the check cannot drift from the code. Exits 1 on any failure:
+    python check_query_plans.py --invoices 1000000
+"""
+import argparse
+import datetime
+import sys
+from typing import Any, Dict, List, Sequence, Tuple
+import psycopg
+from db import get_conn
+from invoice_db import _keyset_rows, encode_invoice_cursor, _DASHBOARD_STATS_SQL, DASHBOARD_EXCEPTION_STATUSES
+from po_lookup import normalize_po_number, find_po_candidates
+from po_matching import _PO_CANDIDATES_SQL
+from line_matching import load_invoice_lines, load_po_lines
+from vendor_db import _VENDOR_DETAIL_SQL, VENDOR_PO_MENTIONS_SQL, VENDOR_INVOICE_MENTIONS_SQL
+from vendor_deletion import _INVOICE_BATCH_SQL, _STAGES, VENDOR_DELETE_BATCH_SIZE
+
+SHADOWED = ("vendors", "purchase_orders", "purchase_order_lines", "invoices", "invoice_lines")
+INDEX_NODES = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+# SELECT used for the keyset listings; the last two columns must be created_at, id
+_LISTING_SELECT = """
+    SELECT i.id, i.total_amount, v.name, i.created_at, i.id
+    FROM invoices i
+    LEFT JOIN vendors v ON i.vendor_id = v.id
+"""
+
+class _ExplainCursor:
+    """Stands in for a cursor: EXPLAINs each statement instead of running it."""
+
+    def __init__(self, cur):
+        self.cur = cur
+        self.plans: List[Dict[str, Any]] = []
+
+    def execute(self, query, params=None):
+        self.cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+        self.plans.append(self.cur.fetchone()[0][0]["Plan"])
+
+    def fetchall(self):
+        return []
+
+def _seed(cur, invoices: int) -> None:
+    vendors = max(10, invoices // 200)
+    pos = max(10, invoices // 5)
+    for table in SHADOWED:
+        cur.execute(f"CREATE TEMP TABLE {table} (LIKE public.{table} INCLUDING ALL) ON COMMIT DROP")
+    cur.execute(
+        "INSERT INTO vendors(name, tax_id) SELECT 'Vendor ' || g, 'TAX' || g FROM generate_series(1, %s) g",
+        (vendors,)
+    )
+    cur.execute(
+        """
+        INSERT INTO purchase_orders(vendor_id, po_number, total_amount, currency, status, created_at)
+        SELECT v.ids[1 + s.g %% v.n], 'PO-' || lpad(s.g::text, 8, '0'), round((s.r * 5000)::numeric, 2), 'USD',
+               CASE WHEN s.r < 0.25 THEN 'open' WHEN s.r < 0.35 THEN 'partially_received' ELSE 'closed' END,
+               now() - s.t * interval '1095 days'
+        FROM (SELECT g, random() AS r, random() AS t FROM generate_series(1, %s) g) s
+        CROSS JOIN (SELECT array_agg(id) AS ids, count(*)::int AS n FROM vendors) v
+        """,
+        (pos,)
+    )
+    cur.execute(
+        """
+        INSERT INTO invoices(vendor_id, supplier_name, invoice_number, po_number, total_amount, currency,
+                             status, invoice_date, created_at)
+        SELECT v.ids[1 + s.g %% v.n], 'Vendor', 'INV-' || s.g, 'PO-' || lpad((1 + s.g %% %s)::text, 8, '0'),
+               round((s.t * 5000)::numeric, 2), 'USD',
+               CASE WHEN s.r < 0.70 THEN 'paid' WHEN s.r < 0.85 THEN 'matched_auto'
+                    WHEN s.r < 0.90 THEN 'ready_for_payment' WHEN s.r < 0.95 THEN 'unmatched'
+                    WHEN s.r < 0.98 THEN 'needs_review' ELSE 'vendor_mismatch' END,
+               (now() - s.t * interval '1095 days')::date, now() - s.t * interval '1095 days'
+        FROM (SELECT g, random() AS r, random() AS t FROM generate_series(1, %s) g) s
+        CROSS JOIN (SELECT array_agg(id) AS ids, count(*)::int AS n FROM vendors) v
+        """,
+        (pos, invoices)
+    )
+    cur.execute(
+        "INSERT INTO invoice_lines(invoice_id, line_number, description) "
+        "SELECT i.id, l, 'Line ' || l FROM invoices i CROSS JOIN generate_series(1, 2) l"
+    )
+    cur.execute(
+        "INSERT INTO purchase_order_lines(po_id, line_number, description) "
+        "SELECT p.id, l, 'Line ' || l FROM purchase_orders p CROSS JOIN generate_series(1, 3) l"
+    )
+    # Autovacuum never analyzes temp tables
+    for table in SHADOWED:
+        cur.execute(f"ANALYZE {table}")
+
+def _walk(plan: Dict[str, Any]):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _walk(child)
+
+def _verdict(plans: Sequence[Dict[str, Any]]) -> Tuple[bool, str]:
+    nodes = [n for p in plans for n in _walk(p)]
+    seq = sorted({n.get("Relation Name") for n in nodes if n["Node Type"] == "Seq Scan" and n.get("Relation Name") in SHADOWED})
+    used = sorted({n.get("Index Name") for n in nodes if n["Node Type"] in INDEX_NODES and n.get("Index Name")})
+    if seq:
+        return False, "seq scan on " + ", ".join(seq)
+    if not used:
+        return False, "no index used"
+    return True, ", ".join(used)
+
+def _samples(cur) -> Dict[str, Any]:
+    cur.execute("SELECT id FROM vendors ORDER BY id LIMIT 1 OFFSET 3")
+    vendor_id = cur.fetchone()[0]
+    cur.execute("SELECT id, po_number FROM purchase_orders LIMIT 1")
+    po_id, po_number = cur.fetchone()
+    cur.execute("SELECT id FROM invoices LIMIT 1")
+    invoice_id = cur.fetchone()[0]
+    cur.execute("SELECT count(*) FROM invoices")
+    cur.execute(
+        "SELECT created_at, id FROM invoices ORDER BY created_at DESC NULLS LAST, id DESC OFFSET %s LIMIT 1",
+        (cur.fetchone()[0] // 2,)
+    )
+    deep = cur.fetchone()
+    return {
+        "vendor_id": vendor_id,
+        "po_id": po_id,
+        "po_number": po_number,
+        "invoice_id": invoice_id,
+        "deep_cursor": encode_invoice_cursor(deep[0], deep[1]),
+    }
+
+def _checks(s: Dict[str, Any]):
+    """(name, where, params, cursor) for keyset listings; (name, run) for the rest, where run(cur)
+    issues the real query text on an _ExplainCursor."""
+    exception_statuses = ["i.status IN (%s,%s,%s)"], ["unmatched", "vendor_mismatch", "needs_review"]
+    payable = ["i.status IN ('matched_auto','partially_matched','ready_for_payment')", "i.status NOT IN ('paid','payment_pending')"]
+    listings = [
+        ("recent invoices, first page", [], [], None),
+        ("recent invoices, deep page", [], [], s["deep_cursor"]),
+        ("exceptions, first page", *exception_statuses, None),
+        ("exceptions, deep page", *exception_statuses, s["deep_cursor"]),
+        ("exceptions, one status", ["i.status = %s"], ["needs_review"], None),
+        ("exceptions, one vendor", exception_statuses[0] + ["i.vendor_id = %s"], exception_statuses[1] + [s["vendor_id"]], None),
+        ("payable, first page", payable, [], None),
+        ("payable, deep page", payable, [], s["deep_cursor"]),
+        ("payable, one vendor", payable + ["i.vendor_id = %s"], [s["vendor_id"]], None),
+    ]
+    today = datetime.date.today()
+    po_norm = normalize_po_number(s["po_number"])
+    mention = (s["vendor_id"], "12", "%12%", 10)
+    queries = [
+        ("dashboard stats window",
+         lambda cur: cur.execute(_DASHBOARD_STATS_SQL, (*DASHBOARD_EXCEPTION_STATUSES, today - datetime.timedelta(days=30), today))),
+        ("match_invoice PO candidates", lambda cur: cur.execute(_PO_CANDIDATES_SQL, (po_norm,))),
+        # No rows come back from an EXPLAIN cursor, so this covers the exact and the near-miss query
+        ("PO number lookup, exact + near miss", lambda cur: find_po_candidates(cur, po_norm[:-1] + "9")),
+        ("invoice lines", lambda cur: load_invoice_lines(cur, [s["invoice_id"]])),
+        ("PO lines", lambda cur: load_po_lines(cur, [s["po_id"]])),
+        ("vendor detail", lambda cur: cur.execute(_VENDOR_DETAIL_SQL, (s["vendor_id"],))),
+        ("mentions: invoices", lambda cur: cur.execute(VENDOR_INVOICE_MENTIONS_SQL, mention)),
+        ("mentions: POs", lambda cur: cur.execute(VENDOR_PO_MENTIONS_SQL, mention)),
+        ("vendor delete: invoice batch", lambda cur: cur.execute(_INVOICE_BATCH_SQL, (s["vendor_id"], VENDOR_DELETE_BATCH_SIZE))),
+    ]
+    for stage, _column, sql in _STAGES:
+        if stage != "invoices":
+            queries.append((f"vendor delete: {stage}",
+                            lambda cur, sql=sql: cur.execute(sql, (s["vendor_id"], VENDOR_DELETE_BATCH_SIZE))))
+    return listings, queries
+
+def main(invoices: int, verbose: bool) -> int:
+    failures = 0
+    results: List[Tuple[str, List[Dict[str, Any]]]] = []
+    with get_conn() as conn:
+        try:
+            with conn.cursor() as cur:
+                print(f"seeding {invoices:,} invoices ...", flush=True)
+                _seed(cur, invoices)
+                samples = _samples(cur)
+            listings, queries = _checks(samples)
+            # Client-side binding so EXPLAIN sees literal values, as a custom plan would
+            with psycopg.ClientCursor(conn) as cur:
+                for name, where, params, cursor in listings:
+                    ex = _ExplainCursor(cur)
+                    _keyset_rows(ex, _LISTING_SELECT, list(where), list(params), 50, cursor)
+                    results.append((name, ex.plans))
+                for name, run in queries:
+                    ex = _ExplainCursor(cur)
+                    run(ex)
+                    results.append((name, ex.plans))
+            for name, plans in results:
+                ok, detail = _verdict(plans)
+                failures += 0 if ok else 1
+                print(f"{'ok' if ok else 'FAIL':<5} {name:<32} {detail}")
+                if verbose and not ok:
+                    for plan in plans:
+                        for node in _walk(plan):
+                            print(f"        {node['Node Type']} {node.get('Relation Name') or node.get('Index Name') or ''}")
+        finally:
+            conn.rollback()
+    print(f"{len(results) - failures}/{len(results)} queries use indexes")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invoices", type=int, default=1_000_000)
+    parser.add_argument("--verbose", action="store_true", help="print plan nodes for failing queries")
+    args = parser.parse_args()
+    sys.exit(main(args.invoices, args.verbose))
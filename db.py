@@ -1,11 +1,107 @@
-import os
+import os,time,atexit,threading,uuid
+from contextlib import contextmanager
+from typing import Any,Dict,List
 from dotenv import load_dotenv
-import psycopg
+from psycopg_pool import ConnectionPool,PoolTimeout
 
 load_dotenv()
 DB_URL=os.getenv("DATABASE_URL")
 
+DB_POOL_MIN_SIZE=int(os.getenv("DB_POOL_MIN_SIZE","1"))
+DB_POOL_MAX_SIZE=int(os.getenv("DB_POOL_MAX_SIZE","10"))
+DB_POOL_TIMEOUT=float(os.getenv("DB_POOL_TIMEOUT","30"))
+DB_POOL_MAX_IDLE=float(os.getenv("DB_POOL_MAX_IDLE","300"))
+DB_POOL_MAX_LIFETIME=float(os.getenv("DB_POOL_MAX_LIFETIME","1800"))
+
+_pool=None
+_pool_lock=threading.Lock()
+_metrics_lock=threading.Lock()
+_metrics={
+    "checkouts":0,
+    "checkoutTimeouts":0,
+    "waitMsTotal":0.0,
+    "waitMsMax":0.0,
+}
+
+def _get_pool()->ConnectionPool:
+    """Create the process-wide pool on first use."""
+    global _pool
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None:
+            if not DB_URL:
+                raise RuntimeError("DATABASE_URL not set")
+            _pool=ConnectionPool(
+                DB_URL,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=max(DB_POOL_MIN_SIZE,DB_POOL_MAX_SIZE),
+                timeout=DB_POOL_TIMEOUT,
+                max_idle=DB_POOL_MAX_IDLE,
+                max_lifetime=DB_POOL_MAX_LIFETIME,
+                check=ConnectionPool.check_connection,
+                name="tmc",
+                open=True,
+            )
+    return _pool
+
+def _record_checkout(wait_ms:float)->None:
+    with _metrics_lock:
+        _metrics["checkouts"]+=1
+        _metrics["waitMsTotal"]+=wait_ms
+        if wait_ms>_metrics["waitMsMax"]:
+            _metrics["waitMsMax"]=wait_ms
+
+@contextmanager
 def get_conn():
-    if not DB_URL:
-        raise RuntimeError("DATABASE_URL not set")
-    return psycopg.connect(DB_URL)
+    """Borrow a pooled connection.
+    Same semantics as `with psycopg.connect(...) as conn`: commit on success,
+    rollback on error; the connection goes back to the pool instead of closing.
+    """
+    pool=_get_pool()
+    started=time.perf_counter()
+    try:
+        conn=pool.getconn()
+    except PoolTimeout:
+        with _metrics_lock:
+            _metrics["checkoutTimeouts"]+=1
+        raise
+    _record_checkout((time.perf_counter()-started)*1000.0)
+    try:
+        with conn:
+            yield conn
+    finally:
+        pool.putconn(conn)
+
+def uuid_list(ids)->List[uuid.UUID]:
+    """Distinct well-formed UUIDs from `ids`, in first-seen order; malformed ids are dropped."""
+    seen:Dict[uuid.UUID,None]={}
+    for value in ids or []:
+        try:
+            seen.setdefault(uuid.UUID(str(value)),None)
+        except (ValueError,TypeError):
+            continue
+    return list(seen)
+
+def get_pool_stats()->Dict[str,Any]:
+    """Checkout/wait metrics for this process plus psycopg_pool's own counters."""
+    with _metrics_lock:
+        checkouts=_metrics["checkouts"]
+        stats:Dict[str,Any]={
+            "checkouts":checkouts,
+            "checkoutTimeouts":_metrics["checkoutTimeouts"],
+            "waitMsAvg":round(_metrics["waitMsTotal"]/checkouts,3) if checkouts else 0.0,
+            "waitMsMax":round(_metrics["waitMsMax"],3),
+        }
+    if _pool is not None:
+        stats["pool"]=_pool.get_stats()
+    return stats
+
+def close_pool()->None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool=None
+
+atexit.register(close_pool)
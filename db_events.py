@@ -0,0 +1,78 @@
+import time
+import threading
+from typing import Callable, Dict, List, Optional
+import psycopg
+from psycopg import sql
+from db import DB_URL
+
+# Channel -> callbacks(payload). A payload of None means "notifications may have been
+# missed" (listener (re)connected) and subscribers should drop whatever they cache.
+_subscribers: Dict[str, List[Callable[[Optional[str]], None]]] = {}
+_subscribers_lock = threading.Lock()
+_listener: Optional[threading.Thread] = None
+_listener_lock = threading.Lock()
+_connected = threading.Event()
+
+LISTEN_POLL_SECONDS = 5.0
+RECONNECT_MAX_SECONDS = 60.0
+
+def subscribe(channel: str, callback: Callable[[Optional[str]], None]) -> None:
+    with _subscribers_lock:
+        _subscribers.setdefault(channel, []).append(callback)
+
+def notify(cur, channel: str, payload: str = "") -> None:
+    """Queue a NOTIFY on the caller's transaction; listeners see it only after commit."""
+    cur.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+
+def is_listening() -> bool:
+    return _connected.is_set()
+
+def _dispatch(channel: str, payload: Optional[str]) -> None:
+    with _subscribers_lock:
+        callbacks = list(_subscribers.get(channel, []))
+    for cb in callbacks:
+        try:
+            cb(payload)
+        except Exception:
+            pass
+
+def _dispatch_all(payload: Optional[str]) -> None:
+    with _subscribers_lock:
+        channels = list(_subscribers)
+    for channel in channels:
+        _dispatch(channel, payload)
+
+def _listen_loop() -> None:
+    delay = 1.0
+    while True:
+        try:
+            with psycopg.connect(DB_URL, autocommit=True) as conn:
+                listening = set()
+                delay = 1.0
+                while True:
+                    with _subscribers_lock:
+                        wanted = set(_subscribers)
+                    for channel in wanted - listening:
+                        conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+                        listening.add(channel)
+                    if not _connected.is_set():
+                        _connected.set()
+                        _dispatch_all(None)
+                    for n in conn.notifies(timeout=LISTEN_POLL_SECONDS):
+                        _dispatch(n.channel, n.payload)
+        except Exception:
+            pass
+        _connected.clear()
+        _dispatch_all(None)
+        time.sleep(delay)
+        delay = min(RECONNECT_MAX_SECONDS, delay * 2)
+
+def start_listener() -> None:
+    """Start the process-wide LISTEN thread (idempotent). One dedicated connection, outside the pool."""
+    global _listener
+    if _listener is not None or not DB_URL:
+        return
+    with _listener_lock:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen_loop, name="db-events", daemon=True)
+            _listener.start()
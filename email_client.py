@@ -4,12 +4,18 @@ import email
 import datetime
 from email.header import decode_header, make_header
 from email.utils import parseaddr
-from ocr_landingai import ocr_invoice_to_json
 from dotenv import load_dotenv
 from invoice_detector import is_invoice_attachment
+from imap_structure import parse_fetch_response, list_parts, estimated_decoded_size, decode_part
 from storage_local import upload_invoice
-from invoice_db import save_invoice_to_db
-from po_matching import match_invoice
+from ocr_jobs import enqueue_ocr_job
+from mailbox_db import (
+    get_mailbox_state,
+    save_mailbox_state,
+    get_retry_uids,
+    record_mailbox_failure,
+    clear_mailbox_failure,
+)
 
 load_dotenv()
 
@@ -26,6 +32,11 @@ TARGET_SENDERS = [
 
 MAX_ATTACHMENT_SIZE_MB = 20
 LOOKBACK_DAYS = 30
+MAILBOX = "INBOX"
+FETCH_BATCH_SIZE = 100
+HEADER_FETCH_ITEMS = "(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (FROM SUBJECT MESSAGE-ID)])"
+# Attempts before a message that keeps failing is left in mailbox_failed_uids for manual attention
+MAILBOX_MAX_RETRIES = int(os.getenv("MAILBOX_MAX_RETRIES", "5"))
 
 
 def _decode_str(value: str) -> str:
@@ -45,6 +56,17 @@ def _connect_imap():
     return imap
 
 
+def _get_uidvalidity(imap):
+    """UIDVALIDITY reported by the last SELECT, or None if the server omitted it."""
+    try:
+        _, data = imap.response("UIDVALIDITY")
+        if data and data[0]:
+            return int(data[0])
+    except Exception:
+        pass
+    return None
+
+
 def fetch_and_process_invoices():
     logs = []
 
@@ -54,17 +76,65 @@ def fetch_and_process_invoices():
         return [f"IMAP connection failed: {e}"]
 
     try:
-        status, _ = imap.select("INBOX")
+        status, _ = imap.select(MAILBOX)
         if status != "OK":
-            return [f"Failed to select INBOX: {status}"]
+            return [f"Failed to select {MAILBOX}: {status}"]
+
+        account = f"{EMAIL_USERNAME}@{IMAP_HOST}".lower()
+        uidvalidity = _get_uidvalidity(imap)
+        state = None
+        if uidvalidity is not None:
+            try:
+                state = get_mailbox_state(account, MAILBOX)
+            except Exception as e:
+                logs.append(f"Could not load sync state for {MAILBOX}: {e}")
 
-        since_date = (datetime.date.today() - datetime.timedelta(days=LOOKBACK_DAYS)).strftime("%d-%b-%Y")
-        status, data = imap.search(None, "SINCE", since_date)
+        if state and state[0] == uidvalidity:
+            last_uid = state[1]
+            status, data = imap.uid("SEARCH", "UID", f"{last_uid + 1}:*")
+            scope = f"after UID {last_uid}"
+        else:
+            # First run or UIDVALIDITY changed: old UIDs are meaningless, bootstrap from the lookback window
+            last_uid = 0
+            since_date = (datetime.date.today() - datetime.timedelta(days=LOOKBACK_DAYS)).strftime("%d-%b-%Y")
+            status, data = imap.uid("SEARCH", "SINCE", since_date)
+            scope = f"since {since_date}"
         if status != "OK":
             return [f"IMAP search failed: {status} {data}"]
 
-        msg_ids = data[0].split()
-        logs.append(f"Found {len(msg_ids)} messages since {since_date} in INBOX.")
+        # "n:*" always returns the highest UID even when it is below n, so filter explicitly
+        uids = sorted(u for u in (int(x) for x in (data[0] or b"").split()) if u > last_uid)
+        logs.append(f"Found {len(uids)} new messages {scope} in {MAILBOX}.")
+
+        # Messages below the high-water mark whose processing raised on an earlier run
+        retry_uids = set()
+        if uidvalidity is not None:
+            try:
+                retry_uids = set(get_retry_uids(account, MAILBOX, uidvalidity, MAILBOX_MAX_RETRIES))
+            except Exception as e:
+                logs.append(f"Could not load failed UIDs for {MAILBOX}: {e}")
+        retry_uids -= set(uids)
+        if retry_uids:
+            logs.append(f"Retrying {len(retry_uids)} previously failed messages in {MAILBOX}.")
+            uids = sorted(retry_uids | set(uids))
+
+        def _record_failure(uid, error):
+            if uidvalidity is None:
+                return True
+            try:
+                record_mailbox_failure(account, MAILBOX, uidvalidity, uid, error)
+                return True
+            except Exception as e:
+                logs.append(f"Could not record failure for UID {uid}: {e}; will retry next run")
+                return False
+
+        def _clear_failure(uid):
+            if uid not in retry_uids:
+                return
+            try:
+                clear_mailbox_failure(account, MAILBOX, uidvalidity, uid)
+            except Exception as e:
+                logs.append(f"Could not clear failure for UID {uid}: {e}")
 
         total_attachments = 0
         uploaded_count = 0
@@ -72,95 +142,152 @@ def fetch_and_process_invoices():
         skipped_non_invoice = 0
         skipped_duplicates = 0
 
-        for msg_id in msg_ids:
-            msg_id_str = msg_id.decode(errors="ignore")
+        high_water = last_uid
+        fetch_failed = False
+        for batch_start in range(0, len(uids), FETCH_BATCH_SIZE):
+            batch = uids[batch_start:batch_start + FETCH_BATCH_SIZE]
+            # Headers and structure only; attachment bodies are fetched per part below
             try:
-                status, msg_data = imap.fetch(msg_id, "(RFC822)")
-                if status != "OK":
-                    logs.append(f"Failed to fetch message {msg_id_str}: {status}")
+                status, meta_data = imap.uid("FETCH", ",".join(str(u) for u in batch), HEADER_FETCH_ITEMS)
+            except Exception as e:
+                status, meta_data = f"error: {e}", None
+            if status != "OK":
+                logs.append(f"Failed to fetch UIDs {batch[0]}-{batch[-1]}: {status}; will retry next run")
+                break
+            meta_by_uid = {}
+            for item in parse_fetch_response(meta_data):
+                try:
+                    meta_by_uid[int(item.get("UID") or 0)] = item
+                except (TypeError, ValueError):
                     continue
 
-                raw_email = msg_data[0][1]
-                msg = email.message_from_bytes(raw_email)
-                message_id = (msg.get("Message-ID") or "").strip()
-                subject = _decode_str(msg.get("Subject"))
-                from_header = _decode_str(msg.get("From"))
-                from_name, from_email = parseaddr(from_header)
-                from_email_lower = (from_email or "").lower()
-
-                if TARGET_SENDERS and from_email_lower not in TARGET_SENDERS:
-                    skipped_non_target_sender += 1
+            for uid in batch:
+                msg_id_str = str(uid)
+                meta = meta_by_uid.get(uid)
+                if meta is None:
+                    # Expunged between SEARCH and FETCH
+                    _clear_failure(uid)
+                    high_water = max(high_water, uid)
                     continue
+                error = None
+                try:
+                    header_bytes = b""
+                    for key, value in meta.items():
+                        if key.startswith("BODY[HEADER") and isinstance(value, bytes):
+                            header_bytes = value
+                    msg = email.message_from_bytes(header_bytes)
+                    message_id = (msg.get("Message-ID") or "").strip()
+                    subject = _decode_str(msg.get("Subject"))
+                    from_header = _decode_str(msg.get("From"))
+                    from_name, from_email = parseaddr(from_header)
+                    from_email_lower = (from_email or "").lower()
 
-                for part in msg.walk():
-                    content_disposition = part.get_content_disposition()
-                    filename = part.get_filename()
-                    if content_disposition not in ("attachment", "inline") and not filename:
+                    if TARGET_SENDERS and from_email_lower not in TARGET_SENDERS:
+                        skipped_non_target_sender += 1
+                        _clear_failure(uid)
+                        high_water = max(high_water, uid)
                         continue
 
-                    filename = _decode_str(filename)
-                    content_type = part.get_content_type()
+                    wanted = []
+                    for part in list_parts(meta.get("BODYSTRUCTURE")):
+                        content_disposition = part["disposition"]
+                        filename = part["filename"]
+                        if content_disposition not in ("attachment", "inline") and not filename:
+                            continue
+                        if part["content_type"].startswith("multipart/"):
+                            continue
 
-                    try:
-                        payload = part.get_payload(decode=True)
-                    except Exception:
-                        payload = None
+                        filename = _decode_str(filename)
+                        if estimated_decoded_size(part) > MAX_ATTACHMENT_SIZE_MB * 1024 * 1024:
+                            logs.append(
+                                f"Skipping large attachment (> {MAX_ATTACHMENT_SIZE_MB}MB) "
+                                f"{filename} from {from_email_lower}"
+                            )
+                            continue
 
-                    if not payload:
-                        continue
+                        total_attachments += 1
 
-                    if len(payload) > MAX_ATTACHMENT_SIZE_MB * 1024 * 1024:
-                        logs.append(
-                            f"Skipping large attachment (> {MAX_ATTACHMENT_SIZE_MB}MB) "
-                            f"{filename} from {from_email_lower}"
-                        )
-                        continue
+                        if not is_invoice_attachment(subject, filename, part["content_type"]):
+                            skipped_non_invoice += 1
+                            continue
+                        wanted.append((part, filename))
 
-                    total_attachments += 1
+                    payloads = {}
+                    if wanted:
+                        body_items = " ".join(f"BODY.PEEK[{p['section']}]" for p, _ in wanted)
+                        try:
+                            status, body_data = imap.uid("FETCH", msg_id_str, f"({body_items})")
+                        except Exception as e:
+                            status, body_data = f"error: {e}", None
+                        if status != "OK":
+                            # Stop here so the high-water mark does not move past this message
+                            logs.append(f"Failed to fetch attachments for UID {msg_id_str}: {status}; will retry next run")
+                            fetch_failed = True
+                            break
+                        for item in parse_fetch_response(body_data):
+                            for key, value in item.items():
+                                if key.startswith("BODY[") and isinstance(value, bytes):
+                                    payloads[key[5:key.index("]")]] = value
 
-                    if not is_invoice_attachment(subject, filename, content_type):
-                        skipped_non_invoice += 1
-                        continue
+                    for part, filename in wanted:
+                        try:
+                            payload = decode_part(payloads.get(part["section"]) or b"", part["encoding"])
+                        except Exception:
+                            payload = None
 
-                    try:
-                        full_path, uploaded = upload_invoice(from_email_lower, message_id, filename, payload)
-                        if uploaded:
-                            uploaded_count += 1
-                            logs.append(f"Saved {filename} from {from_email_lower} to {full_path}")
-                            try:
-                                json_path = ocr_invoice_to_json(full_path)
-                                if json_path:
-                                    logs.append(f"OCR/parse completed for {filename}; JSON saved to {json_path}")
-                                    try:
-                                        invoice_id = save_invoice_to_db(json_path, full_path, from_email_lower, message_id)
-                                        if invoice_id:
-                                            logs.append(f"Invoice saved to Supabase with id={invoice_id}")
-                                            try:
-                                                matched_po_id = match_invoice(invoice_id)
-                                                if matched_po_id:
-                                                    logs.append(f"Invoice {invoice_id} matched to PO {matched_po_id}")
-                                                else:
-                                                    logs.append(f"Invoice {invoice_id} not matched to any PO")
-                                            except Exception as e:
-                                                logs.append(f"PO matching error for invoice {invoice_id}: {e}")
-                                        else:
-                                            logs.append("Failed to save invoice to Supabase")
-                                    except Exception as e:
-                                        logs.append(f"DB persistence error for {filename}: {e}")
-                                else:
-                                    logs.append(
-                                        f"OCR/parse skipped or failed for {filename} (see console for details)."
-                                    )
-                            except Exception as e:
-                                logs.append(f"OCR/parse error for {filename}: {e}")
-                        else:
-                            skipped_duplicates += 1
-
-                    except Exception as e:
-                        logs.append(f"Failed to save {filename} from {from_email_lower}: {e}")
+                        if not payload:
+                            continue
 
+                        if len(payload) > MAX_ATTACHMENT_SIZE_MB * 1024 * 1024:
+                            logs.append(
+                                f"Skipping large attachment (> {MAX_ATTACHMENT_SIZE_MB}MB) "
+                                f"{filename} from {from_email_lower}"
+                            )
+                            continue
+
+                        try:
+                            full_path, uploaded = upload_invoice(from_email_lower, message_id, filename, payload)
+                            if uploaded:
+                                uploaded_count += 1
+                                logs.append(f"Saved {filename} from {from_email_lower} to {full_path}")
+                            else:
+                                skipped_duplicates += 1
+                        except Exception as e:
+                            logs.append(f"Failed to save {filename} from {from_email_lower}: {e}")
+                            error = f"save {filename}: {e}"
+                            continue
+
+                        # Also for files already on disk: an earlier run may have saved the file
+                        # and then failed to queue it. enqueue_ocr_job is idempotent on file_path.
+                        try:
+                            job_id = enqueue_ocr_job(full_path, from_email_lower, message_id)
+                            if uploaded:
+                                logs.append(f"Queued {filename} for OCR as job {job_id}")
+                        except Exception as e:
+                            logs.append(f"Failed to queue {filename} for OCR: {e}")
+                            error = f"enqueue {filename}: {e}"
+
+                except Exception as e:
+                    logs.append(f"Error processing message UID {msg_id_str}: {e}")
+                    error = str(e)
+
+                # The mark moves past failed messages too; they are retried from mailbox_failed_uids
+                if error is None:
+                    _clear_failure(uid)
+                elif not _record_failure(uid, error):
+                    # Nowhere to remember it, so keep the mark below this message instead
+                    fetch_failed = True
+                    break
+                high_water = max(high_water, uid)
+
+            if fetch_failed:
+                break
+
+        if uidvalidity is not None and high_water > last_uid:
+            try:
+                save_mailbox_state(account, MAILBOX, uidvalidity, high_water)
             except Exception as e:
-                logs.append(f"Error processing message {msg_id_str}: {e}")
+                logs.append(f"Could not save sync state for {MAILBOX}: {e}")
 
         logs.append(
             f"Summary: uploaded={uploaded_count}, "
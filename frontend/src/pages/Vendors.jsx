@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { MessageCircle, Search } from 'lucide-react';
 import Sidebar from '../components/Sidebar';
 import StatsCard from '../components/StatsCard';
@@ -8,9 +8,14 @@ import InvoiceDetailModal from '../components/InvoiceDetailModal';
 import PurchaseOrderDetailModal from '../components/PurchaseOrderDetailModal';
 import { Dialog, DialogContent, DialogHeader, DialogTitle } from '../components/ui/dialog';
 import { Input } from '../components/ui/input';
-import { formatNumber, fetchVendors, fetchVendorStats, fetchVendorById, fetchInvoiceById, fetchPurchaseOrderById, createVendor, deleteVendor } from '../services/api';
+import { formatNumber, fetchVendors, fetchVendorStats, fetchVendorById, fetchInvoiceById, fetchPurchaseOrderById, createVendor, deleteVendor, fetchVendorDeletion } from '../services/api';
 import VendorChat from '../components/VendorChat';
 
+// Stop watching a background vendor deletion after this long; the job keeps running server-side
+const DELETION_WATCH_TIMEOUT_MS = 2 * 60 * 1000;
+const DELETION_POLL_INTERVAL_MS = 1000;
+const DELETION_MAX_POLL_ERRORS = 3;
+
 const Vendors = () => {
   const [activeNav] = useState('vendors');
   const [selectedVendor, setSelectedVendor] = useState(null);
@@ -33,6 +38,9 @@ const Vendors = () => {
   const [addOpen, setAddOpen] = useState(false);
   const [newVendor, setNewVendor] = useState({ name: '', taxId: '', contact: '', address: '' });
   const [chatOpen, setChatOpen] = useState(false);
+  // Background deletion being watched: { vendorName, job, message }
+  const [deletion, setDeletion] = useState(null);
+  const deletionWatch = useRef(0);
 
   // Fetch vendors and stats on mount
   useEffect(() => {
@@ -178,13 +186,42 @@ const Vendors = () => {
                 if (!selectedVendor) return;
                 const ok = window.confirm(`Delete vendor "${selectedVendor.name}" and related records?`);
                 if (!ok) return;
+                const vendor = selectedVendor;
+                const watch = ++deletionWatch.current;
+                const watching = () => deletionWatch.current === watch;
                 try {
-                  await deleteVendor(selectedVendor.id);
-                  setSelectedVendor(null);
-                  setSelectedVendorDetails(null);
+                  const { job } = await deleteVendor(vendor.id);
+                  setDeletion({ vendorName: vendor.name, job, message: null });
+                  // Large vendors are deleted in batches in the background; watch the job for a while
+                  const deadline = Date.now() + DELETION_WATCH_TIMEOUT_MS;
+                  let current = job;
+                  let pollErrors = 0;
+                  while (watching() && (current.status === 'queued' || current.status === 'running')) {
+                    if (Date.now() > deadline) {
+                      setDeletion((d) => d && { ...d, message: 'Still deleting in the background. You can close this and check back later.' });
+                      return;
+                    }
+                    await new Promise((resolve) => setTimeout(resolve, DELETION_POLL_INTERVAL_MS));
+                    try {
+                      current = await fetchVendorDeletion(job.id);
+                      pollErrors = 0;
+                    } catch (err) {
+                      if (++pollErrors >= DELETION_MAX_POLL_ERRORS) throw err;
+                      continue;
+                    }
+                    if (watching()) setDeletion((d) => d && { ...d, job: current });
+                  }
+                  if (!watching()) return;
+                  if (current.status === 'failed') {
+                    throw new Error(current.lastError || 'deletion failed');
+                  }
+                  setDeletion(null);
+                  // The user may have moved on to another vendor meanwhile
+                  setSelectedVendor((v) => (v?.id === vendor.id ? null : v));
+                  setSelectedVendorDetails((d) => (d?.id === vendor.id ? null : d));
                   await refreshVendors();
                 } catch (err) {
-                  alert(`Failed to delete vendor: ${err.message}`);
+                  if (watching()) setDeletion((d) => ({ vendorName: vendor.name, job: d?.job || null, message: `Failed to delete vendor: ${err.message}` }));
                 }
               }}
               className="px-4 py-2 border border-red-600 text-red-700 rounded-full text-sm font-medium hover:bg-red-50 transition-colors whitespace-nowrap disabled:opacity-50"
@@ -243,6 +280,50 @@ const Vendors = () => {
       </div>
     </div>
     <VendorChat vendorId={selectedVendor?.id} open={chatOpen && !!selectedVendor} onClose={() => setChatOpen(false)} />
+    {/* Vendor Deletion Progress; closing it stops watching, the deletion continues */}
+    <Dialog
+      open={!!deletion}
+      onOpenChange={(open) => {
+        if (!open) {
+          deletionWatch.current += 1;
+          setDeletion(null);
+          refreshVendors();
+        }
+      }}
+    >
+      <DialogContent className="bg-white border border-gray-200">
+        <DialogHeader>
+          <DialogTitle className="text-xl font-semibold text-black">Deleting {deletion?.vendorName}</DialogTitle>
+        </DialogHeader>
+        <div className="space-y-2 text-sm text-gray-700">
+          {deletion?.job && (
+            <p>
+              Status: {deletion.job.status}
+              {deletion.job.stage ? ` (${deletion.job.stage})` : ''}
+              {deletion.job.deleted ? ` · ${formatNumber(deletion.job.deleted.invoicesDeleted)} invoices, ${formatNumber(deletion.job.deleted.purchaseOrdersDeleted)} purchase orders removed` : ''}
+            </p>
+          )}
+          {deletion?.job?.lastError && !deletion?.message && (
+            <p className="text-amber-700">Retrying after an error: {deletion.job.lastError}</p>
+          )}
+          {deletion?.message && <p>{deletion.message}</p>}
+        </div>
+        <div className="pt-2 flex justify-end">
+          <button
+            type="button"
+            onClick={() => {
+              deletionWatch.current += 1;
+              setDeletion(null);
+              refreshVendors();
+            }}
+            className="px-4 py-2 rounded-lg border border-gray-300 text-sm"
+          >
+            Close
+          </button>
+        </div>
+      </DialogContent>
+    </Dialog>
+
     {/* Add Vendor Dialog */}
     <Dialog open={addOpen} onOpenChange={setAddOpen}>
       <DialogContent className="bg-white border border-gray-200">
@@ -39,15 +39,17 @@ export const fetchDashboardStats = async () => {
   return await handleResponse(response);
 };
 
-// Fetch graph data for last 30 days
-export const fetchGraphData = async () => {
-  const response = await fetch(`${API_BASE_URL}/dashboard/graph-data`);
+// Fetch graph data for the last 30, 90 or 365 days
+export const fetchGraphData = async (days = 30) => {
+  const response = await fetch(`${API_BASE_URL}/dashboard/graph-data?days=${days}`);
   return await handleResponse(response);
 };
 
-// Fetch recent invoices
-export const fetchRecentInvoices = async (limit = 10) => {
-  const response = await fetch(`${API_BASE_URL}/invoices/recent?limit=${limit}`);
+// Fetch recent invoices. Passing a cursor ('' for the first page) returns { items, nextCursor }
+export const fetchRecentInvoices = async (limit = 10, cursor) => {
+  const params = new URLSearchParams({ limit: String(limit) });
+  if (cursor !== undefined) params.set('cursor', cursor || '');
+  const response = await fetch(`${API_BASE_URL}/invoices/recent?${params.toString()}`);
   return await handleResponse(response);
 };
 
@@ -57,6 +59,16 @@ export const fetchInvoiceById = async (invoiceId) => {
   return await handleResponse(response);
 };
 
+// Fetch many invoices by ID in one request (same shape as fetchInvoiceById, in request order)
+export const fetchInvoicesByIds = async (ids) => {
+  const response = await fetch(`${API_BASE_URL}/invoices/batch`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ ids })
+  });
+  return await handleResponse(response);
+};
+
 // Fetch all vendors
 export const fetchVendors = async () => {
   const response = await fetch(`${API_BASE_URL}/vendors`);
@@ -85,12 +97,18 @@ export const createVendor = async ({ name, taxId, contact, address }) => {
   return await handleResponse(response);
 };
 
-// Delete vendor and related records
+// Queue deletion of a vendor and related records; resolves to { job }
 export const deleteVendor = async (vendorId) => {
   const response = await fetch(`${API_BASE_URL}/vendors/${vendorId}`, { method: 'DELETE' });
   return await handleResponse(response);
 };
 
+// Progress of a vendor deletion job: { status: queued|running|done|failed, deleted, lastError, ... }
+export const fetchVendorDeletion = async (jobId) => {
+  const response = await fetch(`${API_BASE_URL}/vendors/deletions/${jobId}`);
+  return await handleResponse(response);
+};
+
 // Mentions typeahead for @
 export const fetchVendorMentions = async ({ vendorId, kind = 'invoices', q = '', limit = 10 }) => {
   const params = new URLSearchParams();
@@ -141,22 +159,30 @@ export const fetchPurchaseOrderById = async (poId) => {
   return await handleResponse(response);
 };
 
-// Fetch exception invoices with optional filters
-export const fetchExceptionInvoices = async ({ vendorId, status, limit = 100 } = {}) => {
+// Invoice amounts allocated against a PO and its remaining balance
+export const fetchPurchaseOrderAllocations = async (poId) => {
+  const response = await fetch(`${API_BASE_URL}/purchase-orders/${poId}/allocations`);
+  return await handleResponse(response);
+};
+
+// Fetch exception invoices with optional filters (cursor opts into { items, nextCursor })
+export const fetchExceptionInvoices = async ({ vendorId, status, limit = 100, cursor } = {}) => {
   const params = new URLSearchParams();
   if (vendorId) params.set('vendor_id', vendorId);
   if (status) params.set('status', status);
   if (limit) params.set('limit', String(limit));
+  if (cursor !== undefined) params.set('cursor', cursor || '');
   const response = await fetch(`${API_BASE_URL}/invoices/exceptions?${params.toString()}`);
   return await handleResponse(response);
 };
 
-// Fetch payable invoices (eligible for payment)
-export const fetchPayableInvoices = async ({ vendorId, currency, limit = 200 } = {}) => {
+// Fetch payable invoices (eligible for payment; cursor opts into { items, nextCursor })
+export const fetchPayableInvoices = async ({ vendorId, currency, limit = 200, cursor } = {}) => {
   const params = new URLSearchParams();
   if (vendorId) params.set('vendor_id', vendorId);
   if (currency) params.set('currency', currency);
   if (limit) params.set('limit', String(limit));
+  if (cursor !== undefined) params.set('cursor', cursor || '');
   const response = await fetch(`${API_BASE_URL}/invoices/payable?${params.toString()}`);
   return await handleResponse(response);
 };
@@ -256,6 +282,7 @@ export const uploadInvoice = async (vendorId, file) => {
 export const getStatusLabel = (status) => {
   const labels = {
     'matched_auto': 'Matched',
+    'partially_matched': 'Partially Matched',
     'unmatched': 'Unmatched',
     'vendor_mismatch': 'Mismatch',
     'needs_review': 'Needs Review'
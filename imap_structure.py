@@ -0,0 +1,232 @@
+import re
+import base64
+import quopri
+from urllib.parse import unquote
+from typing import Any, Dict, List, Optional
+
+_LITERAL_RE = re.compile(rb"\{(\d+)\}\r\n")
+
+
+def _reassemble(fetch_data) -> bytes:
+    """Rebuild the wire form of an imaplib FETCH result.
+    imaplib splits literals out as (prefix, literal) tuples and drops CRLFs;
+    putting them back lets one parser handle quoted strings and literals alike.
+    """
+    chunks = []
+    for item in fetch_data or []:
+        if isinstance(item, tuple):
+            chunks.append(item[0] + b"\r\n" + item[1])
+        elif isinstance(item, bytes):
+            chunks.append(item)
+    return b" ".join(chunks)
+
+
+class _Parser:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def _skip_ws(self) -> None:
+        while self.pos < len(self.data) and self.data[self.pos] in b" \r\n\t":
+            self.pos += 1
+
+    def at_end(self) -> bool:
+        self._skip_ws()
+        return self.pos >= len(self.data)
+
+    def value(self) -> Any:
+        self._skip_ws()
+        ch = self.data[self.pos:self.pos + 1]
+        if ch == b"(":
+            self.pos += 1
+            items = []
+            while True:
+                self._skip_ws()
+                if self.pos >= len(self.data):
+                    return items
+                if self.data[self.pos:self.pos + 1] == b")":
+                    self.pos += 1
+                    return items
+                items.append(self.value())
+        if ch == b'"':
+            return self._quoted()
+        if ch == b"{":
+            m = _LITERAL_RE.match(self.data, self.pos)
+            if m:
+                size = int(m.group(1))
+                start = m.end()
+                self.pos = start + size
+                return self.data[start:start + size]
+        return self._atom()
+
+    def _quoted(self) -> str:
+        self.pos += 1
+        out = bytearray()
+        while self.pos < len(self.data):
+            c = self.data[self.pos]
+            if c == 0x5C and self.pos + 1 < len(self.data):  # backslash
+                out.append(self.data[self.pos + 1])
+                self.pos += 2
+                continue
+            if c == 0x22:  # closing quote
+                self.pos += 1
+                break
+            out.append(c)
+            self.pos += 1
+        return out.decode("utf-8", errors="replace")
+
+    def _atom(self) -> Optional[str]:
+        start = self.pos
+        depth = 0
+        while self.pos < len(self.data):
+            c = self.data[self.pos:self.pos + 1]
+            if c == b"[":
+                depth += 1
+            elif c == b"]":
+                depth -= 1
+            elif depth <= 0 and c in (b" ", b"(", b")", b"\r", b"\n"):
+                break
+            self.pos += 1
+        # Partial-fetch suffix such as BODY[1]<0>
+        if self.data[self.pos:self.pos + 1] == b"<":
+            end = self.data.find(b">", self.pos)
+            if end != -1:
+                self.pos = end + 1
+        atom = self.data[start:self.pos].decode("utf-8", errors="replace")
+        if self.pos == start:
+            self.pos += 1  # never stall on an unexpected byte
+        return None if atom.upper() == "NIL" else atom
+
+
+def parse_fetch_response(fetch_data) -> List[Dict[str, Any]]:
+    """Parse the data returned by imap.uid("FETCH", ...) into one dict per message.
+    Keys are upper-cased item names (UID, BODYSTRUCTURE, BODY[2], ...).
+    """
+    parser = _Parser(_reassemble(fetch_data))
+    messages = []
+    while not parser.at_end():
+        head = parser.value()
+        if isinstance(head, list):
+            items = head
+        else:
+            parser._skip_ws()
+            if parser.data[parser.pos:parser.pos + 1] != b"(":
+                continue
+            items = parser.value()
+        msg: Dict[str, Any] = {}
+        for i in range(0, len(items) - 1, 2):
+            key = items[i]
+            if isinstance(key, str):
+                msg[key.upper()] = items[i + 1]
+        if msg:
+            messages.append(msg)
+    return messages
+
+
+def _text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return str(value)
+
+
+def _params(value: Any) -> Dict[str, str]:
+    params: Dict[str, str] = {}
+    if isinstance(value, list):
+        for i in range(0, len(value) - 1, 2):
+            params[_text(value[i]).lower()] = _text(value[i + 1])
+    return params
+
+
+def _param_filename(params: Dict[str, str], key: str) -> str:
+    extended = params.get(f"{key}*")
+    if extended:
+        # RFC 2231: charset'language'percent-encoded-value
+        parts = extended.split("'", 2)
+        if len(parts) == 3:
+            try:
+                return unquote(parts[2], encoding=parts[0] or "utf-8", errors="replace")
+            except LookupError:
+                return unquote(parts[2])
+        return unquote(extended)
+    return params.get(key, "")
+
+
+def _walk(bs: List[Any], section: str, nested: bool, out: List[Dict[str, Any]]) -> None:
+    if not bs:
+        return
+    if isinstance(bs[0], list):
+        index = 0
+        for child in bs:
+            if not isinstance(child, list):
+                break
+            index += 1
+            _walk(child, f"{section}.{index}" if section else str(index), False, out)
+        return
+
+    if nested:
+        section = f"{section}.1"
+    elif not section:
+        section = "1"
+    maintype = _text(bs[0]).lower()
+    subtype = _text(bs[1] if len(bs) > 1 else "").lower()
+    params = _params(bs[2] if len(bs) > 2 else None)
+    encoding = _text(bs[5] if len(bs) > 5 else "").lower()
+    try:
+        size = int(bs[6]) if len(bs) > 6 and bs[6] is not None else 0
+    except (TypeError, ValueError):
+        size = 0
+
+    if maintype == "message" and subtype == "rfc822":
+        # Attached messages: descend like email.Message.walk() does; the
+        # container itself has no decodable payload of its own
+        if len(bs) > 8 and isinstance(bs[8], list) and bs[8]:
+            _walk(bs[8], section, not isinstance(bs[8][0], list), out)
+        return
+    if maintype == "text":
+        disp_index = 9
+    else:
+        disp_index = 8
+
+    disposition = None
+    disp_params: Dict[str, str] = {}
+    disp = bs[disp_index] if len(bs) > disp_index else None
+    if isinstance(disp, list) and disp:
+        disposition = _text(disp[0]).lower() or None
+        disp_params = _params(disp[1] if len(disp) > 1 else None)
+
+    filename = _param_filename(disp_params, "filename") or _param_filename(params, "name")
+    out.append({
+        "section": section,
+        "content_type": f"{maintype}/{subtype}",
+        "disposition": disposition,
+        "filename": filename or None,
+        "encoding": encoding,
+        "size": size,
+    })
+
+
+def list_parts(bodystructure: Any) -> List[Dict[str, Any]]:
+    """Flatten a parsed BODYSTRUCTURE into leaf parts with their BODY[] section numbers."""
+    out: List[Dict[str, Any]] = []
+    if isinstance(bodystructure, list):
+        _walk(bodystructure, "", False, out)
+    return out
+
+
+def estimated_decoded_size(part: Dict[str, Any]) -> int:
+    """BODYSTRUCTURE reports encoded octets; base64 inflates by about 4/3."""
+    size = int(part.get("size") or 0)
+    if part.get("encoding") == "base64":
+        return size * 3 // 4
+    return size
+
+
+def decode_part(payload: bytes, encoding: str) -> bytes:
+    encoding = (encoding or "").lower()
+    if encoding == "base64":
+        return base64.b64decode(payload, validate=False)
+    if encoding == "quoted-printable":
+        return quopri.decodestring(payload)
+    return payload
@@ -1,6 +1,17 @@
-import os,json,datetime
-from typing import Any,Dict,Optional
-from db import get_conn
+import os,json,uuid,base64,datetime
+from typing import Any,Dict,List,Optional,Tuple
+from db import get_conn,uuid_list
+from vendor_index import resolve_vendor_id,get_vendor_identity
+from db_events import subscribe,notify,start_listener
+from ttl_cache import TTLCache
+from invoice_fingerprint import fingerprint_invoice
+from vendor_matching import auto_match_vendor_id
+
+INVOICES_CHANNEL="invoices_changed"
+DASHBOARD_CACHE_TTL_SECONDS=float(os.getenv("DASHBOARD_CACHE_TTL_SECONDS","30"))
+
+_dashboard_cache=TTLCache(DASHBOARD_CACHE_TTL_SECONDS,maxsize=64)
+subscribe(INVOICES_CHANNEL,lambda _payload:_dashboard_cache.invalidate())
 
 def _parse_date(value:Any):
     if not value:
@@ -12,6 +23,42 @@ def _parse_date(value:Any):
     except Exception:
         return None
 
+# At or above this many lines, COPY beats a pipelined executemany
+LINE_COPY_THRESHOLD=int(os.getenv("LINE_COPY_THRESHOLD","200"))
+
+_LINE_COLUMNS=(
+    "invoice_id","line_number","description","sku","quantity",
+    "unit_of_measure","unit_price","line_total","tax_rate","tax_code",
+    "po_number","po_line_number",
+)
+
+def _line_rows(invoice_id,lines):
+    rows=[]
+    for line in lines:
+        rows.append((
+            invoice_id,line.get("line_number"),line.get("description"),line.get("sku"),line.get("quantity"),
+            line.get("unit_of_measure"),line.get("unit_price"),line.get("line_total"),line.get("tax_rate"),line.get("tax_code"),
+            line.get("po_number"),line.get("po_line_number"),
+        ))
+    return rows
+
+def _insert_invoice_lines(cur,invoice_id,lines)->None:
+    """Insert all lines on the caller's cursor (same transaction as the header).
+    Small invoices use executemany, which psycopg pipelines into a single round trip;
+    large ones stream through COPY.
+    """
+    rows=_line_rows(invoice_id,lines)
+    if not rows:
+        return
+    columns=",".join(_LINE_COLUMNS)
+    if len(rows)>=LINE_COPY_THRESHOLD:
+        with cur.copy(f"copy invoice_lines({columns}) from stdin") as copy:
+            for row in rows:
+                copy.write_row(row)
+    else:
+        placeholders=",".join(["%s"]*len(_LINE_COLUMNS))
+        cur.executemany(f"insert into invoice_lines({columns}) values({placeholders})",rows)
+
 def save_invoice_to_db(fields_json_path:str,file_path:str,from_email:Optional[str],message_id:str,vendor_id_override:Optional[str]=None)->Optional[str]:
     with open(fields_json_path,"r",encoding="utf-8") as f:
         data:Dict[str,Any]=json.load(f)
@@ -43,8 +90,11 @@ def save_invoice_to_db(fields_json_path:str,file_path:str,from_email:Optional[st
         with conn.cursor() as cur:
             if vendor_id_override:
                 vendor_id=vendor_id_override
-                cur.execute("select name,tax_id from vendors where id=%s limit 1",(vendor_id_override,))
-                vrow=cur.fetchone()
+                vrow=get_vendor_identity(vendor_id_override)
+                if vrow is None:
+                    # Not in the index yet (created moments ago in another process)
+                    cur.execute("select name,tax_id from vendors where id=%s limit 1",(vendor_id_override,))
+                    vrow=cur.fetchone()
                 if vrow:
                     vname,vtax=vrow
                     mismatch=False
@@ -55,16 +105,11 @@ def save_invoice_to_db(fields_json_path:str,file_path:str,from_email:Optional[st
                     if mismatch:
                         status="vendor_mismatch"
             else:
-                if supplier_tax_id:
-                    cur.execute("select id from vendors where tax_id=%s limit 1",(supplier_tax_id,))
-                    row=cur.fetchone()
-                    if row:
-                        vendor_id=row[0]
-                if not vendor_id and supplier_name:
-                    cur.execute("select id from vendors where lower(name)=lower(%s) limit 1",(supplier_name,))
-                    row=cur.fetchone()
-                    if row:
-                        vendor_id=row[0]
+                # Normalized tax ID, then normalized name, from the in-process vendor index
+                vendor_id=resolve_vendor_id(supplier_tax_id,supplier_name)
+                if vendor_id is None:
+                    # Tax ID formatted differently, or the name carries another legal suffix
+                    vendor_id=auto_match_vendor_id(supplier_tax_id,supplier_name,supplier_address)
                 # Do not auto-create vendors on ingest; leave vendor_id as None
             cur.execute(
                 """
@@ -98,38 +143,63 @@ def save_invoice_to_db(fields_json_path:str,file_path:str,from_email:Optional[st
                 )
             )
             invoice_id=cur.fetchone()[0]
-            for line in lines:
-                line_number=line.get("line_number")
-                description=line.get("description")
-                sku=line.get("sku")
-                quantity=line.get("quantity")
-                unit_of_measure=line.get("unit_of_measure")
-                unit_price=line.get("unit_price")
-                line_total=line.get("line_total")
-                tax_rate=line.get("tax_rate")
-                tax_code=line.get("tax_code")
-                line_po_number=line.get("po_number")
-                po_line_number=line.get("po_line_number")
-                cur.execute(
-                    """
-                    insert into invoice_lines(
-                      invoice_id,line_number,description,sku,quantity,
-                      unit_of_measure,unit_price,line_total,tax_rate,tax_code,
-                      po_number,po_line_number
-                    ) values(
-                      %s,%s,%s,%s,%s,
-                      %s,%s,%s,%s,%s,
-                      %s,%s
-                    )
-                    """,
-                    (
-                      invoice_id,line_number,description,sku,quantity,
-                      unit_of_measure,unit_price,line_total,tax_rate,tax_code,
-                      line_po_number,po_line_number
-                    )
-                )
+            _insert_invoice_lines(cur,invoice_id,lines)
+            # Same invoice ingested twice (other filename / message-id) goes to needs_review
+            fingerprint_invoice(cur,invoice_id,lines)
+            notify(cur,INVOICES_CHANNEL,str(invoice_id))
+    _dashboard_cache.invalidate()
     return str(invoice_id)
 
+# Extracted header columns that a re-extraction may overwrite; vendor, status and provenance stay as-is
+_EXTRACTED_HEADER_FIELDS=(
+    "supplier_name","supplier_tax_id","supplier_address",
+    "buyer_name","company_code","cost_center",
+    "invoice_number","invoice_date","due_date",
+    "currency","payment_terms",
+    "subtotal_amount","tax_amount","shipping_amount","discount_amount","total_amount",
+    "po_number","bank_account","swift_bic","remittance_reference","invoice_type",
+)
+
+# Only exception-queue invoices may be re-extracted; matched, payable, pending and paid ones keep
+# the amounts and lines they were matched / paid on
+REEXTRACTABLE_STATUSES=("unmatched","vendor_mismatch","needs_review")
+
+def refresh_invoice_fields(invoice_id:str,fields_json_path:str)->bool:
+    """Overwrite an existing invoice's extracted header fields and lines from a new .fields.json.
+    Returns False (and changes nothing) unless the invoice is in REEXTRACTABLE_STATUSES."""
+    with open(fields_json_path,"r",encoding="utf-8") as f:
+        data:Dict[str,Any]=json.load(f)
+    values=[]
+    for name in _EXTRACTED_HEADER_FIELDS:
+        value=data.get(name)
+        if name in ("invoice_date","due_date"):
+            value=_parse_date(value)
+        values.append(value)
+    assignments=",".join(f"{name}=%s" for name in _EXTRACTED_HEADER_FIELDS)
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"update invoices set {assignments},fields_json_path=%s where id=%s and status=any(%s)",
+                (*values,fields_json_path,invoice_id,list(REEXTRACTABLE_STATUSES))
+            )
+            if not cur.rowcount:
+                return False
+            cur.execute("delete from invoice_lines where invoice_id=%s",(invoice_id,))
+            _insert_invoice_lines(cur,invoice_id,data.get("lines") or [])
+            fingerprint_invoice(cur,invoice_id,data.get("lines") or [])
+    return True
+
+# Count, amount and exception count in one pass over the window (also EXPLAINed by check_query_plans.py)
+_DASHBOARD_STATS_SQL="""
+    SELECT
+        COUNT(*),
+        COALESCE(SUM(total_amount), 0),
+        COUNT(*) FILTER (WHERE status IN (%s,%s,%s))
+    FROM invoices
+    WHERE created_at >= %s AND created_at < %s
+"""
+DASHBOARD_EXCEPTION_STATUSES=("unmatched","vendor_mismatch","needs_review")
+
 def get_dashboard_stats(days:int=30)->Dict[str,Any]:
     """Get dashboard statistics for the last N days.
     Includes:
@@ -138,68 +208,51 @@ def get_dashboard_stats(days:int=30)->Dict[str,Any]:
       - avgDaysSavedPerInvoice: configured avg days saved per invoice
       - exceptionInvoices: count of invoices in exception statuses in window
       - exceptionTimeSavedHours: derived from exceptionInvoices * configured per-exception savings (hours)
+    Served from a short-TTL cache; every process drops it when an invoice is ingested.
     """
+    # Calculate date range
+    end_date = datetime.date.today()
+    start_date = end_date - datetime.timedelta(days=days)
+
+    start_listener()
+    cache_key = (days, end_date)
+    cached = _dashboard_cache.get(cache_key)
+    if cached is not None:
+        return dict(cached)
+
     with get_conn() as conn:
         with conn.cursor() as cur:
-            # Calculate date range
-            end_date = datetime.date.today()
-            start_date = end_date - datetime.timedelta(days=days)
-
-            # Get invoice count
-            cur.execute("""
-                SELECT COUNT(*)
-                FROM invoices
-                WHERE created_at >= %s AND created_at < %s
-            """, (start_date, end_date))
-            count_result = cur.fetchone()
-            invoices_processed = count_result[0] if count_result else 0
+            cur.execute(_DASHBOARD_STATS_SQL, (*DASHBOARD_EXCEPTION_STATUSES, start_date, end_date))
+            row = cur.fetchone()
+            invoices_processed = row[0] if row else 0
+            amount_processed = float(row[1]) if row else 0.0
+            exception_invoices = row[2] if row else 0
 
-            # Get total amount
-            cur.execute("""
-                SELECT COALESCE(SUM(total_amount), 0)
-                FROM invoices
-                WHERE created_at >= %s AND created_at < %s
-            """, (start_date, end_date))
-            amount_result = cur.fetchone()
-            amount_processed = float(amount_result[0]) if amount_result else 0.0
+    # Configurable productivity assumptions
+    try:
+        avg_days_saved_per_invoice = float(os.getenv("AVG_DAYS_SAVED_PER_INVOICE", "8.5"))
+    except Exception:
+        avg_days_saved_per_invoice = 8.5
 
-            # Configurable productivity assumptions
-            try:
-                avg_days_saved_per_invoice = float(os.getenv("AVG_DAYS_SAVED_PER_INVOICE", "8.5"))
-            except Exception:
-                avg_days_saved_per_invoice = 8.5
+    # Per-exception savings (hours), configurable
+    try:
+        per_exception_hours = float(os.getenv("EXCEPTION_TIME_SAVED_HOURS_PER_INVOICE", "1.0"))
+    except Exception:
+        per_exception_hours = 1.0
+    exception_time_saved_hours = round(exception_invoices * per_exception_hours, 2)
 
-            # Exception invoices in window
-            allowed_statuses = ("unmatched", "vendor_mismatch", "needs_review")
-            cur.execute(
-                """
-                SELECT COUNT(*)
-                FROM invoices
-                WHERE created_at >= %s AND created_at < %s
-                  AND status IN (%s,%s,%s)
-                """,
-                (start_date, end_date, *allowed_statuses)
-            )
-            ex_row = cur.fetchone()
-            exception_invoices = ex_row[0] if ex_row else 0
-
-            # Per-exception savings (hours), configurable
-            try:
-                per_exception_hours = float(os.getenv("EXCEPTION_TIME_SAVED_HOURS_PER_INVOICE", "1.0"))
-            except Exception:
-                per_exception_hours = 1.0
-            exception_time_saved_hours = round(exception_invoices * per_exception_hours, 2)
-
-            return {
-                "invoicesProcessed": invoices_processed,
-                "amountProcessed": amount_processed,
-                "avgDaysSavedPerInvoice": avg_days_saved_per_invoice,
-                "exceptionInvoices": exception_invoices,
-                "exceptionTimeSavedHours": exception_time_saved_hours,
-            }
+    stats = {
+        "invoicesProcessed": invoices_processed,
+        "amountProcessed": amount_processed,
+        "avgDaysSavedPerInvoice": avg_days_saved_per_invoice,
+        "exceptionInvoices": exception_invoices,
+        "exceptionTimeSavedHours": exception_time_saved_hours,
+    }
+    _dashboard_cache.set(cache_key, stats)
+    return dict(stats)
 
 def get_graph_data(days:int=30):
-    """Get daily metrics for the last N days.
+    """Get daily metrics for the last N days, read from invoice_daily_rollup.
     Returns a list of objects per day with:
       - date, displayDate
       - count: number of invoices created that day
@@ -211,16 +264,17 @@ def get_graph_data(days:int=30):
             end_date = datetime.date.today()
             start_date = end_date - datetime.timedelta(days=days-1)
 
+            # One pre-aggregated row per (day, vendor), maintained by triggers on invoices
             cur.execute("""
                 SELECT
-                    DATE(created_at) AS d,
-                    COUNT(*) AS c,
-                    COALESCE(SUM(total_amount), 0) AS amt,
-                    SUM(CASE WHEN status = 'matched_auto' THEN 1 ELSE 0 END) AS matched
-                FROM invoices
-                WHERE DATE(created_at) >= %s AND DATE(created_at) <= %s
-                GROUP BY DATE(created_at)
-                ORDER BY DATE(created_at)
+                    day AS d,
+                    SUM(invoice_count) AS c,
+                    SUM(total_amount) AS amt,
+                    SUM(matched_count) AS matched
+                FROM invoice_daily_rollup
+                WHERE day >= %s AND day <= %s
+                GROUP BY day
+                ORDER BY day
             """, (start_date, end_date))
 
             rows = cur.fetchall()
@@ -252,13 +306,68 @@ def get_graph_data(days:int=30):
 
             return graph_data
 
+def encode_invoice_cursor(created_at:Optional[datetime.datetime],invoice_id:Any)->str:
+    """Opaque page token for the (created_at, id) position of the last row returned."""
+    raw=json.dumps([created_at.isoformat() if created_at else None,str(invoice_id)])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_invoice_cursor(cursor:str)->Tuple[Optional[datetime.datetime],str]:
+    """Inverse of encode_invoice_cursor. Raises ValueError on a malformed token."""
+    try:
+        raw=base64.urlsafe_b64decode(cursor+"="*(-len(cursor)%4))
+        created_at,invoice_id=json.loads(raw)
+        return (datetime.datetime.fromisoformat(created_at) if created_at else None,str(uuid.UUID(invoice_id)))
+    except Exception:
+        raise ValueError("invalid cursor")
+
+def _keyset_rows(cur,select_sql:str,where:List[str],params:List[Any],limit:int,cursor:Optional[str]):
+    """Fetch one page in (created_at DESC NULLS LAST, id DESC) order, starting after `cursor`.
+    select_sql is "SELECT ... FROM ..." whose last two columns are i.created_at, i.id.
+    Seeks with a row comparison on the (created_at, id) indexes, so deep pages cost the same
+    as the first. Rows without created_at sort last and are paged by id alone.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    after=decode_invoice_cursor(cursor) if cursor else None
+    limit=max(1,limit)
+    rows:List[tuple]=[]
+    if after is None or after[0] is not None:
+        clauses=where+["i.created_at IS NOT NULL"]
+        args=list(params)
+        if after:
+            clauses.append("(i.created_at, i.id) < (%s, %s)")
+            args.extend(after)
+        cur.execute(
+            f"{select_sql} WHERE {' AND '.join(clauses)} ORDER BY i.created_at DESC NULLS LAST, i.id DESC LIMIT %s",
+            (*args,limit+1)
+        )
+        rows=cur.fetchall()
+    if len(rows)<=limit:
+        clauses=where+["i.created_at IS NULL"]
+        args=list(params)
+        if after and after[0] is None:
+            clauses.append("i.id < %s")
+            args.append(after[1])
+        cur.execute(
+            f"{select_sql} WHERE {' AND '.join(clauses)} ORDER BY i.id DESC LIMIT %s",
+            (*args,limit+1-len(rows))
+        )
+        rows+=cur.fetchall()
+    next_cursor=None
+    if len(rows)>limit:
+        rows=rows[:limit]
+        next_cursor=encode_invoice_cursor(rows[-1][-2],rows[-1][-1])
+    return rows,next_cursor
+
 def get_recent_invoices(limit:int=10):
     """Get recent invoices with vendor info"""
+    return get_recent_invoices_page(limit)["items"]
+
+def get_recent_invoices_page(limit:int=10,cursor:Optional[str]=None)->Dict[str,Any]:
+    """Get recent invoices with vendor info, one keyset page: {"items", "nextCursor"}"""
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
+            rows,next_cursor=_keyset_rows(cur,"""
                 SELECT
-                    i.id,
                     i.invoice_date,
                     i.supplier_name,
                     i.total_amount,
@@ -266,36 +375,45 @@ def get_recent_invoices(limit:int=10):
                     i.invoice_number,
                     i.po_number,
                     i.due_date,
-                    v.name as vendor_name
+                    v.name as vendor_name,
+                    i.created_at,
+                    i.id
                 FROM invoices i
                 LEFT JOIN vendors v ON i.vendor_id = v.id
-                ORDER BY i.created_at DESC
-                LIMIT %s
-            """, (limit,))
+            """,[],[],limit,cursor)
 
-            rows = cur.fetchall()
             invoices = []
             for row in rows:
-                invoice_date = row[1] if row[1] else datetime.date.today()
-                due_date = row[7] if row[7] else invoice_date
+                invoice_date = row[0] if row[0] else datetime.date.today()
+                due_date = row[6] if row[6] else invoice_date
 
                 invoices.append({
-                    "id": str(row[0]),
+                    "id": str(row[9]),
                     "date": invoice_date.isoformat(),
                     "displayDate": invoice_date.strftime("%d %b"),
-                    "vendorName": row[8] or row[2] or "Unknown Vendor",
-                    "amount": float(row[3]) if row[3] else 0.0,
-                    "status": row[4] or "unmatched",
-                    "invoiceNumber": row[5] or "",
+                    "vendorName": row[7] or row[1] or "Unknown Vendor",
+                    "amount": float(row[2]) if row[2] else 0.0,
+                    "status": row[3] or "unmatched",
+                    "invoiceNumber": row[4] or "",
                     "description": "",  # Not stored in current schema
-                    "poNumber": row[6],
+                    "poNumber": row[5],
                     "dueDate": due_date.isoformat()
                 })
 
-            return invoices
+            return {"items": invoices, "nextCursor": next_cursor}
 
 def get_invoice_by_id(invoice_id:str)->Optional[Dict[str,Any]]:
     """Get detailed invoice information by ID"""
+    invoices=get_invoices_by_ids([invoice_id])
+    return invoices[0] if invoices else None
+
+def get_invoices_by_ids(invoice_ids:List[str])->List[Dict[str,Any]]:
+    """Detailed invoices (with lines) for many ids in two queries.
+    Returned in the order requested; unknown or malformed ids are skipped.
+    """
+    ids=uuid_list(invoice_ids)
+    if not ids:
+        return []
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
@@ -311,67 +429,72 @@ def get_invoice_by_id(invoice_id:str)->Optional[Dict[str,Any]]:
                     v.name as vendor_name,
                     i.currency,
                     i.subtotal_amount,
-                    i.tax_amount
+                    i.tax_amount,
+                    i.duplicate_of
                 FROM invoices i
                 LEFT JOIN vendors v ON i.vendor_id = v.id
-                WHERE i.id = %s
-                LIMIT 1
-            """, (invoice_id,))
-
-            row = cur.fetchone()
-            if not row:
-                return None
-
-            invoice_date = row[1] if row[1] else datetime.date.today()
-            due_date = row[7] if row[7] else invoice_date
+                WHERE i.id = ANY(%s)
+            """, (ids,))
+            rows = cur.fetchall()
+            if not rows:
+                return []
 
-            # Fetch line items
+            # Fetch line items for every invoice at once
             cur.execute("""
-                SELECT line_number, description, sku, quantity, unit_of_measure,
+                SELECT invoice_id, line_number, description, sku, quantity, unit_of_measure,
                        unit_price, line_total, tax_rate, tax_code, po_number, po_line_number
                 FROM invoice_lines
-                WHERE invoice_id = %s
-                ORDER BY COALESCE(line_number, 0), po_line_number NULLS LAST
-            """, (invoice_id,))
-            line_rows = cur.fetchall()
-            lines = []
-            for lr in line_rows:
-                lines.append({
-                    "line_number": lr[0],
-                    "description": lr[1],
-                    "sku": lr[2],
-                    "quantity": float(lr[3]) if lr[3] is not None else None,
-                    "unit_of_measure": lr[4],
-                    "unit_price": float(lr[5]) if lr[5] is not None else None,
-                    "line_total": float(lr[6]) if lr[6] is not None else None,
-                    "tax_rate": float(lr[7]) if lr[7] is not None else None,
-                    "tax_code": lr[8],
-                    "po_number": lr[9],
-                    "po_line_number": lr[10],
+                WHERE invoice_id = ANY(%s)
+                ORDER BY invoice_id, COALESCE(line_number, 0), po_line_number NULLS LAST
+            """, ([r[0] for r in rows],))
+            lines_by_invoice: Dict[str, List[Dict[str, Any]]] = {}
+            for lr in cur.fetchall():
+                lines_by_invoice.setdefault(str(lr[0]), []).append({
+                    "line_number": lr[1],
+                    "description": lr[2],
+                    "sku": lr[3],
+                    "quantity": float(lr[4]) if lr[4] is not None else None,
+                    "unit_of_measure": lr[5],
+                    "unit_price": float(lr[6]) if lr[6] is not None else None,
+                    "line_total": float(lr[7]) if lr[7] is not None else None,
+                    "tax_rate": float(lr[8]) if lr[8] is not None else None,
+                    "tax_code": lr[9],
+                    "po_number": lr[10],
+                    "po_line_number": lr[11],
                 })
 
-            return {
-                "id": str(row[0]),
-                "date": invoice_date.isoformat(),
-                "displayDate": invoice_date.strftime("%d %b"),
-                "vendorName": row[8] or row[2] or "Unknown Vendor",
-                "amount": float(row[3]) if row[3] else 0.0,
-                "status": row[4] or "unmatched",
-                "invoiceNumber": row[5] or "",
-                "description": f"Invoice from {row[8] or row[2] or 'Unknown Vendor'}",
-                "poNumber": row[6],
-                "dueDate": due_date.isoformat(),
-                "currency": row[9] or "USD",
-                "subtotal": float(row[10]) if row[10] else 0.0,
-                "tax": float(row[11]) if row[11] else 0.0,
-                "lines": lines
-            }
+    by_id: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        invoice_date = row[1] if row[1] else datetime.date.today()
+        due_date = row[7] if row[7] else invoice_date
+        by_id[str(row[0])] = {
+            "id": str(row[0]),
+            "date": invoice_date.isoformat(),
+            "displayDate": invoice_date.strftime("%d %b"),
+            "vendorName": row[8] or row[2] or "Unknown Vendor",
+            "amount": float(row[3]) if row[3] else 0.0,
+            "status": row[4] or "unmatched",
+            "invoiceNumber": row[5] or "",
+            "description": f"Invoice from {row[8] or row[2] or 'Unknown Vendor'}",
+            "poNumber": row[6],
+            "dueDate": due_date.isoformat(),
+            "currency": row[9] or "USD",
+            "subtotal": float(row[10]) if row[10] else 0.0,
+            "tax": float(row[11]) if row[11] else 0.0,
+            "duplicateOf": str(row[12]) if row[12] else None,
+            "lines": lines_by_invoice.get(str(row[0]), [])
+        }
+    return [by_id[str(i)] for i in ids if str(i) in by_id]
 
 
 def get_exception_invoices(vendor_id:Optional[str]=None, limit:int=100, status:Optional[str]=None):
     """Get invoices considered exceptions: unmatched, vendor_mismatch, needs_review.
        Optional filter by vendor_id or a specific status.
     """
+    return get_exception_invoices_page(vendor_id=vendor_id, limit=limit, status=status)["items"]
+
+def get_exception_invoices_page(vendor_id:Optional[str]=None, limit:int=100, status:Optional[str]=None, cursor:Optional[str]=None)->Dict[str,Any]:
+    """One keyset page of exception invoices: {"items", "nextCursor"}"""
     allowed_statuses = ("unmatched", "vendor_mismatch", "needs_review")
     params: list[Any] = []
     where_clauses = ["i.status IS NOT NULL"]
@@ -384,13 +507,11 @@ def get_exception_invoices(vendor_id:Optional[str]=None, limit:int=100, status:O
     if vendor_id:
         where_clauses.append("i.vendor_id = %s")
         params.append(vendor_id)
-    where_sql = " AND ".join(where_clauses)
 
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute(f"""
+            rows,next_cursor=_keyset_rows(cur,"""
                 SELECT
-                    i.id,
                     i.invoice_date,
                     i.supplier_name,
                     i.total_amount,
@@ -398,38 +519,40 @@ def get_exception_invoices(vendor_id:Optional[str]=None, limit:int=100, status:O
                     i.invoice_number,
                     i.po_number,
                     i.due_date,
-                    v.name as vendor_name
+                    v.name as vendor_name,
+                    i.created_at,
+                    i.id
                 FROM invoices i
                 LEFT JOIN vendors v ON i.vendor_id = v.id
-                WHERE {where_sql}
-                ORDER BY i.created_at DESC NULLS LAST, i.invoice_date DESC NULLS LAST, i.id DESC
-                LIMIT %s
-            """, (*params, limit))
+            """,where_clauses,params,limit,cursor)
 
-            rows = cur.fetchall()
             invoices = []
             for row in rows:
-                invoice_date = row[1] if row[1] else datetime.date.today()
-                due_date = row[7] if row[7] else invoice_date
+                invoice_date = row[0] if row[0] else datetime.date.today()
+                due_date = row[6] if row[6] else invoice_date
                 invoices.append({
-                    "id": str(row[0]),
+                    "id": str(row[9]),
                     "date": invoice_date.isoformat(),
                     "displayDate": invoice_date.strftime("%d %b"),
-                    "vendorName": row[8] or row[2] or "Unknown Vendor",
-                    "amount": float(row[3]) if row[3] else 0.0,
-                    "status": row[4] or "unmatched",
-                    "invoiceNumber": row[5] or "",
+                    "vendorName": row[7] or row[1] or "Unknown Vendor",
+                    "amount": float(row[2]) if row[2] else 0.0,
+                    "status": row[3] or "unmatched",
+                    "invoiceNumber": row[4] or "",
                     "description": "",
-                    "poNumber": row[6],
+                    "poNumber": row[5],
                     "dueDate": due_date.isoformat(),
                 })
-            return invoices
+            return {"items": invoices, "nextCursor": next_cursor}
 
 def get_payable_invoices(vendor_id:Optional[str]=None, currency:Optional[str]=None, limit:int=200):
-    """Return invoices that are eligible for payment: matched or ready_for_payment, not already paid or pending."""
+    """Return invoices that are eligible for payment: matched, partially matched or ready_for_payment, not already paid or pending."""
+    return get_payable_invoices_page(vendor_id=vendor_id, currency=currency, limit=limit)["items"]
+
+def get_payable_invoices_page(vendor_id:Optional[str]=None, currency:Optional[str]=None, limit:int=200, cursor:Optional[str]=None)->Dict[str,Any]:
+    """One keyset page of payable invoices: {"items", "nextCursor"}"""
     with get_conn() as conn:
         with conn.cursor() as cur:
-            where = ["i.status IN ('matched_auto','ready_for_payment')", "i.status NOT IN ('paid','payment_pending')"]
+            where = ["i.status IN ('matched_auto','partially_matched','ready_for_payment')", "i.status NOT IN ('paid','payment_pending')"]
             params: list[Any] = []
             if vendor_id:
                 where.append("i.vendor_id = %s")
@@ -437,10 +560,8 @@ def get_payable_invoices(vendor_id:Optional[str]=None, currency:Optional[str]=No
             if currency:
                 where.append("i.currency = %s")
                 params.append(currency)
-            where_sql = " AND ".join(where)
-            cur.execute(f"""
+            rows,next_cursor=_keyset_rows(cur,"""
                 SELECT
-                    i.id,
                     i.invoice_date,
                     i.supplier_name,
                     i.total_amount,
@@ -450,30 +571,28 @@ def get_payable_invoices(vendor_id:Optional[str]=None, currency:Optional[str]=No
                     i.due_date,
                     v.name as vendor_name,
                     i.currency,
-                    i.vendor_id
+                    i.vendor_id,
+                    i.created_at,
+                    i.id
                 FROM invoices i
                 LEFT JOIN vendors v ON i.vendor_id = v.id
-                WHERE {where_sql}
-                ORDER BY i.created_at DESC NULLS LAST, i.invoice_date DESC NULLS LAST, i.id DESC
-                LIMIT %s
-            """, (*params, limit))
+            """,where,params,limit,cursor)
 
-            rows = cur.fetchall()
             invoices = []
             for row in rows:
-                invoice_date = row[1] if row[1] else datetime.date.today()
-                due_date = row[7] if row[7] else invoice_date
+                invoice_date = row[0] if row[0] else datetime.date.today()
+                due_date = row[6] if row[6] else invoice_date
                 invoices.append({
-                    "id": str(row[0]),
+                    "id": str(row[11]),
                     "date": invoice_date.isoformat(),
                     "displayDate": invoice_date.strftime("%d %b"),
-                    "vendorName": row[8] or row[2] or "Unknown Vendor",
-                    "vendorId": str(row[10]) if row[10] else None,
-                    "amount": float(row[3]) if row[3] else 0.0,
-                    "status": row[4] or "matched_auto",
-                    "invoiceNumber": row[5] or "",
-                    "poNumber": row[6],
+                    "vendorName": row[7] or row[1] or "Unknown Vendor",
+                    "vendorId": str(row[9]) if row[9] else None,
+                    "amount": float(row[2]) if row[2] else 0.0,
+                    "status": row[3] or "matched_auto",
+                    "invoiceNumber": row[4] or "",
+                    "poNumber": row[5],
                     "dueDate": due_date.isoformat(),
-                    "currency": row[9] or "USD",
+                    "currency": row[8] or "USD",
                 })
-            return invoices
+            return {"items": invoices, "nextCursor": next_cursor}
@@ -0,0 +1,240 @@
+"""Duplicate invoice detection.
+
+Each invoice carries an exact fingerprint (generated column over vendor, normalized
+invoice number, total and date; see the add_invoice_fingerprints migration) and a
+64-bit SimHash over its line items, split into 4 bands of 16 bits. Each band is hashed
+with the vendor into a bucket in invoice_simhash_buckets, so near-duplicate lookup is
+four primary-key probes into that vendor's buckets, not a scan.
+
+    python invoice_fingerprint.py --backfill     # SimHash existing invoices
+"""
+import argparse
+import hashlib
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+from db import get_conn
+
+# 4 bands: any pair within distance 3 shares a band; larger values miss some pairs
+DUPLICATE_SIMHASH_MAX_DISTANCE = int(os.getenv("DUPLICATE_SIMHASH_MAX_DISTANCE", "3"))
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+_BAND_BITS = SIMHASH_BITS // SIMHASH_BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+# Statuses a duplicate is pulled back from; paid / payment_pending are left for a human
+_FLAGGABLE_STATUSES = ["unmatched", "matched_auto", "partially_matched", "ready_for_payment"]
+
+_WORD = re.compile(r"[a-z0-9]{2,}")
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+def _amount(value) -> str:
+    try:
+        return f"{float(value):.2f}"
+    except (TypeError, ValueError):
+        return ""
+
+def _line_features(line: Dict[str, Any]) -> Iterable[str]:
+    for word in _WORD.findall(str(line.get("description") or "").lower()):
+        yield "w:" + word
+    if line.get("sku"):
+        yield "s:" + str(line["sku"]).strip().upper()
+    for key in ("quantity", "unit_price", "line_total"):
+        value = _amount(line.get(key))
+        if value:
+            yield key[0] + ":" + value
+
+def line_simhash(lines: Iterable[Dict[str, Any]]) -> Optional[int]:
+    """Unsigned 64-bit SimHash over the line items' words, SKUs and amounts; None without features."""
+    weights = [0] * SIMHASH_BITS
+    seen = False
+    for line in lines or []:
+        for feature in _line_features(line):
+            seen = True
+            h = _feature_hash(feature)
+            for bit in range(SIMHASH_BITS):
+                weights[bit] += 1 if (h >> bit) & 1 else -1
+    if not seen:
+        return None
+    return sum(1 << bit for bit in range(SIMHASH_BITS) if weights[bit] > 0)
+
+def simhash_bands(value: int) -> List[int]:
+    return [(value >> (band * _BAND_BITS)) & _BAND_MASK for band in range(SIMHASH_BANDS)]
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin((a ^ b) & ((1 << SIMHASH_BITS) - 1)).count("1")
+
+def _to_bigint(value: Optional[int]) -> Optional[int]:
+    if value is None:
+        return None
+    return value - (1 << SIMHASH_BITS) if value >= 1 << (SIMHASH_BITS - 1) else value
+
+def simhash_buckets(vendor_key: str, value: int) -> List[int]:
+    """Signed 64-bit bucket keys, one per band, scoped to the vendor."""
+    return [
+        _to_bigint(_feature_hash(f"{vendor_key}|{band}|{band_value}"))
+        for band, band_value in enumerate(simhash_bands(value))
+    ]
+
+# Same key as the fingerprint's vendor part
+_VENDOR_KEY_SQL = "coalesce(vendor_id::text, lower(btrim(supplier_name)), '')"
+
+def _store_simhash(cur, invoice_id, vendor_key: str, simhash: Optional[int]) -> None:
+    cur.execute("UPDATE invoices SET line_simhash = %s WHERE id = %s", (_to_bigint(simhash), invoice_id))
+    cur.execute("DELETE FROM invoice_simhash_buckets WHERE invoice_id = %s", (invoice_id,))
+    if simhash is not None:
+        cur.executemany(
+            "INSERT INTO invoice_simhash_buckets(bucket, invoice_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+            [(bucket, invoice_id) for bucket in simhash_buckets(vendor_key, simhash)]
+        )
+
+def find_duplicate(cur, invoice_id, vendor_key: str, simhash: Optional[int]) -> Optional[str]:
+    """Oldest invoice created before invoice_id that is an exact or near duplicate of it.
+    Exact: same fingerprint (one probe of idx_invoices_fingerprint). Near: same vendor, line SimHash
+    within DUPLICATE_SIMHASH_MAX_DISTANCE, and at least two of invoice number / total / date agree
+    (OCR misread one of them). Recurring invoices with identical lines differ in both number and
+    date, so they do not match. Only older invoices count, so a re-extracted original is never
+    pointed at its own copy.
+    """
+    cur.execute(
+        """
+        SELECT o.id
+        FROM invoices me
+        JOIN invoices o ON o.fingerprint = me.fingerprint
+        WHERE me.id = %s
+          AND (o.created_at, o.id) < (me.created_at, me.id)
+        ORDER BY o.created_at, o.id
+        LIMIT 1
+        """,
+        (invoice_id,)
+    )
+    row = cur.fetchone()
+    if row:
+        return str(row[0])
+    if simhash is None:
+        return None
+    # Every filter runs before the oldest is picked; random 16-bit band collisions are rare
+    cur.execute(
+        """
+        SELECT o.id, o.line_simhash
+        FROM invoices me
+        JOIN invoices o ON o.id IN (
+            SELECT invoice_id FROM invoice_simhash_buckets WHERE bucket = ANY(%s)
+        )
+        WHERE me.id = %s
+          AND (o.created_at, o.id) < (me.created_at, me.id)
+          AND o.line_simhash IS NOT NULL
+          AND coalesce(o.vendor_id::text, lower(btrim(o.supplier_name)))
+                = coalesce(me.vendor_id::text, lower(btrim(me.supplier_name)))
+          AND coalesce(regexp_replace(upper(o.invoice_number), '[^A-Z0-9]', '', 'g')
+                         = regexp_replace(upper(me.invoice_number), '[^A-Z0-9]', '', 'g'), false)::int
+            + coalesce(round(o.total_amount, 2) = round(me.total_amount, 2), false)::int
+            + coalesce(o.invoice_date = me.invoice_date, false)::int >= 2
+        ORDER BY o.created_at, o.id
+        """,
+        (simhash_buckets(vendor_key, simhash), invoice_id)
+    )
+    for other_id, other_simhash in cur.fetchall():
+        if hamming_distance(simhash, other_simhash) <= DUPLICATE_SIMHASH_MAX_DISTANCE:
+            return str(other_id)
+    return None
+
+def _flag_duplicate(cur, invoice_id, vendor_key: str, simhash: Optional[int]) -> Optional[str]:
+    duplicate_of = find_duplicate(cur, invoice_id, vendor_key, simhash)
+    cur.execute(
+        """
+        UPDATE invoices
+        SET duplicate_of = %s,
+            status = CASE WHEN %s::uuid IS NOT NULL AND status = ANY(%s) THEN 'needs_review' ELSE status END
+        WHERE id = %s
+        """,
+        (duplicate_of, duplicate_of, _FLAGGABLE_STATUSES, invoice_id)
+    )
+    return duplicate_of
+
+def fingerprint_invoice(cur, invoice_id, lines: Iterable[Dict[str, Any]]) -> Optional[str]:
+    """Store the line SimHash for invoice_id and flag it needs_review if it duplicates another invoice.
+    Runs on the caller's cursor, after the header and lines are written. Returns the duplicate's id.
+    """
+    # Serialize same-vendor ingests so two copies arriving together still see each other
+    cur.execute(f"SELECT {_VENDOR_KEY_SQL} FROM invoices WHERE id = %s", (invoice_id,))
+    vendor_key = cur.fetchone()[0]
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (vendor_key,))
+    simhash = line_simhash(lines)
+    _store_simhash(cur, invoice_id, vendor_key, simhash)
+    return _flag_duplicate(cur, invoice_id, vendor_key, simhash)
+
+def refingerprint_invoices(cur, invoice_ids: Sequence[Any]) -> List[str]:
+    """After invoices were assigned to another vendor: re-key their SimHash buckets and check them
+    for duplicates again, now among the new vendor's invoices. Returns the ids flagged as duplicates.
+    """
+    if not invoice_ids:
+        return []
+    cur.execute(
+        f"SELECT id, {_VENDOR_KEY_SQL}, line_simhash FROM invoices WHERE id = ANY(%s) ORDER BY 2, id",
+        (list(invoice_ids),)
+    )
+    flagged = []
+    locked = set()
+    for invoice_id, vendor_key, simhash in cur.fetchall():
+        # Same lock as ingest, taken in vendor key order
+        if vendor_key not in locked:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (vendor_key,))
+            locked.add(vendor_key)
+        simhash = None if simhash is None else simhash & ((1 << SIMHASH_BITS) - 1)
+        _store_simhash(cur, invoice_id, vendor_key, simhash)
+        if _flag_duplicate(cur, invoice_id, vendor_key, simhash):
+            flagged.append(str(invoice_id))
+    return flagged
+
+def backfill_line_simhashes(batch_size: int = 1000) -> Dict[str, int]:
+    """SimHash invoices that predate fingerprints. Only stores hashes; existing invoices are not flagged."""
+    processed = 0
+    last_id = None
+    while True:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    SELECT id, {_VENDOR_KEY_SQL} FROM invoices
+                    WHERE line_simhash IS NULL AND (%s::uuid IS NULL OR id > %s::uuid)
+                    ORDER BY id
+                    LIMIT %s
+                    """,
+                    (last_id, last_id, batch_size)
+                )
+                vendor_keys = dict(cur.fetchall())
+                ids = list(vendor_keys)
+                if not ids:
+                    break
+                cur.execute(
+                    """
+                    SELECT invoice_id, description, sku, quantity, unit_price, line_total
+                    FROM invoice_lines
+                    WHERE invoice_id = ANY(%s)
+                    """,
+                    (ids,)
+                )
+                lines: Dict[str, List[Dict[str, Any]]] = {}
+                for r in cur.fetchall():
+                    lines.setdefault(str(r[0]), []).append(
+                        {"description": r[1], "sku": r[2], "quantity": r[3], "unit_price": r[4], "line_total": r[5]}
+                    )
+                for invoice_id in ids:
+                    _store_simhash(cur, invoice_id, vendor_keys[invoice_id], line_simhash(lines.get(str(invoice_id), [])))
+                processed += len(ids)
+                last_id = ids[-1]
+    return {"invoices": processed}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backfill", action="store_true", help="SimHash invoices that have none yet")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    if args.backfill:
+        print(backfill_line_simhashes(args.batch_size))
+    else:
+        parser.print_help()
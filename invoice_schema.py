@@ -1,3 +1,4 @@
+import json,hashlib
 from typing import List,Optional
 from pydantic import BaseModel,Field
 
@@ -37,3 +38,10 @@ class InvoiceExtract(BaseModel):
     remittance_reference: Optional[str] = Field(default=None,description="Reference to include with the payment")
     invoice_type: Optional[str] = Field(default=None,description="Type of invoice such as invoice or credit note")
     lines: List[InvoiceLine] = Field(default_factory=list,description="Line items on the invoice")
+
+def _schema_version()->str:
+    schema=json.dumps(InvoiceExtract.model_json_schema(),sort_keys=True)
+    return hashlib.sha256(schema.encode("utf-8")).hexdigest()[:12]
+
+# Changes whenever InvoiceExtract changes; keys cached extractions so they are not reused across schemas
+INVOICE_SCHEMA_VERSION=_schema_version()
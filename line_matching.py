@@ -0,0 +1,368 @@
+"""Line-level three-way matching: invoice lines against purchase order lines.
+
+Lines are aligned by PO line number, then SKU, then description similarity; quantity
+and unit price tolerances are checked with NumPy over the whole aligned set.
+"""
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from db import get_conn
+from po_lookup import normalize_po_number
+
+LINE_QTY_TOLERANCE = float(os.getenv("LINE_QTY_TOLERANCE", "0.0"))
+LINE_PRICE_TOLERANCE_PCT = float(os.getenv("LINE_PRICE_TOLERANCE_PCT", "0.02"))
+LINE_PRICE_TOLERANCE_ABS = float(os.getenv("LINE_PRICE_TOLERANCE_ABS", "0.01"))
+LINE_MIN_DESCRIPTION_SIMILARITY = float(os.getenv("LINE_MIN_DESCRIPTION_SIMILARITY", "0.6"))
+
+# Per-line outcomes; only "matched" lines count towards a match
+LINE_MATCHED = "matched"
+LINE_UNMATCHED = "unmatched"
+LINE_PRICE_MISMATCH = "price_mismatch"
+LINE_QUANTITY_EXCEEDED = "quantity_exceeded"
+LINE_INCOMPLETE = "incomplete"
+
+# Invoices in these statuses have billed the PO lines their matched lines point at
+BILLED_STATUSES = ["matched_auto", "partially_matched", "ready_for_payment", "payment_pending", "paid"]
+
+_INVOICE_LINE_COLUMNS = "invoice_id, line_number, description, sku, quantity, unit_price, line_total, po_number, po_line_number"
+_PO_LINE_COLUMNS = "pl.po_id, p.po_number, pl.line_number, pl.sku, pl.description, pl.quantity_ordered, pl.unit_price, pl.line_total"
+
+def _key(value) -> Optional[str]:
+    text = str(value).strip() if value is not None else ""
+    return text or None
+
+def _line_key(value) -> Optional[str]:
+    """PO line identifiers arrive as "10", "010" or 10; compare them as trimmed integers when possible."""
+    text = _key(value)
+    if text is None:
+        return None
+    return (text.lstrip("0") or "0") if text.isdigit() else text.upper()
+
+def _sku_key(value) -> Optional[str]:
+    text = _key(value)
+    return re.sub(r"\s+", "", text).upper() if text else None
+
+def _tokens(text) -> List[str]:
+    return re.findall(r"[a-z0-9]+", str(text or "").lower())
+
+def po_line_key(pl: Dict[str, Any]) -> str:
+    """Identifies a PO line within its PO across runs: line number, else SKU, else description."""
+    ln = _line_key(pl.get("line_number"))
+    if ln is not None:
+        return ln
+    sku = _sku_key(pl.get("sku"))
+    return f"sku:{sku}" if sku else "desc:" + " ".join(_tokens(pl.get("description")))
+
+def _floats(values: Iterable[Any]) -> np.ndarray:
+    return np.array([float(v) if v is not None else np.nan for v in values], dtype=float)
+
+def description_similarity(left: Sequence[Any], right: Sequence[Any]) -> np.ndarray:
+    """Token Jaccard similarity for every (left, right) pair, as a len(left) x len(right) matrix."""
+    vocab: Dict[str, int] = {}
+    left_sets = [{vocab.setdefault(t, len(vocab)) for t in _tokens(d)} for d in left]
+    right_sets = [{vocab.setdefault(t, len(vocab)) for t in _tokens(d)} for d in right]
+    a = np.zeros((len(left_sets), len(vocab)), dtype=np.float32)
+    b = np.zeros((len(right_sets), len(vocab)), dtype=np.float32)
+    for i, toks in enumerate(left_sets):
+        a[i, list(toks)] = 1.0
+    for j, toks in enumerate(right_sets):
+        b[j, list(toks)] = 1.0
+    inter = a @ b.T
+    union = a.sum(axis=1)[:, None] + b.sum(axis=1)[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+def _align(inv_lines: List[Dict[str, Any]], po_lines: List[Dict[str, Any]]) -> Tuple[np.ndarray, List[Optional[str]], np.ndarray]:
+    """Index of the PO line each invoice line bills (-1 if none), how it was found, and similarity."""
+    by_po_line: Dict[Tuple[Optional[str], str], int] = {}
+    by_line_only: Dict[str, List[int]] = {}
+    by_sku: Dict[str, List[int]] = {}
+    for j, pl in enumerate(po_lines):
+        ln = _line_key(pl.get("line_number"))
+        if ln is not None:
+            by_po_line.setdefault((normalize_po_number(pl.get("po_number")), ln), j)
+            by_line_only.setdefault(ln, []).append(j)
+        sku = _sku_key(pl.get("sku"))
+        if sku:
+            by_sku.setdefault(sku, []).append(j)
+
+    n = len(inv_lines)
+    po_idx = np.full(n, -1, dtype=np.int64)
+    matched_by: List[Optional[str]] = [None] * n
+    similarity = np.zeros(n, dtype=float)
+    pending: List[int] = []
+    for i, line in enumerate(inv_lines):
+        po_number = normalize_po_number(line.get("po_number"))
+        ln = _line_key(line.get("po_line_number"))
+        if ln is not None:
+            j = by_po_line.get((po_number, ln))
+            if j is None and len(by_line_only.get(ln, ())) == 1:
+                j = by_line_only[ln][0]
+            if j is not None:
+                po_idx[i], matched_by[i], similarity[i] = j, "po_line_number", 1.0
+                continue
+        sku = _sku_key(line.get("sku"))
+        if sku and sku in by_sku:
+            same_po = [j for j in by_sku[sku] if normalize_po_number(po_lines[j].get("po_number")) == po_number]
+            po_idx[i], matched_by[i], similarity[i] = (same_po or by_sku[sku])[0], "sku", 1.0
+            continue
+        pending.append(i)
+
+    if pending and po_lines:
+        sim = description_similarity([inv_lines[i].get("description") for i in pending],
+                                     [pl.get("description") for pl in po_lines])
+        best = sim.argmax(axis=1)
+        best_sim = sim[np.arange(len(pending)), best]
+        for k, i in enumerate(pending):
+            if best_sim[k] >= LINE_MIN_DESCRIPTION_SIMILARITY:
+                po_idx[i], matched_by[i], similarity[i] = int(best[k]), "description", float(best_sim[k])
+    return po_idx, matched_by, similarity
+
+def _unit_prices(prices: np.ndarray, totals: np.ndarray, quantities: np.ndarray) -> np.ndarray:
+    derived = np.divide(totals, quantities, out=np.full_like(totals, np.nan), where=(quantities != 0) & ~np.isnan(quantities))
+    return np.where(np.isnan(prices), derived, prices)
+
+def match_lines(inv_lines: List[Dict[str, Any]], po_lines: List[Dict[str, Any]],
+                billed_before: Optional[Dict[Tuple[str, str], float]] = None) -> Dict[str, Any]:
+    """Align and check invoice lines against candidate PO lines.
+
+    inv_lines: dicts with line_number, description, sku, quantity, unit_price, line_total,
+    po_number, po_line_number. po_lines: dicts with po_id, po_number, line_number, sku,
+    description, quantity_ordered, unit_price, line_total. billed_before: quantity other
+    invoices already billed per (po_id, po_line_key), see load_billed_quantities; it counts
+    towards both the over-billing and the fully-billed check.
+    Returns {"lines": per-line report, "allMatched", "coversPo", "poId", "confidence"}.
+    """
+    n = len(inv_lines)
+    po_idx, matched_by, similarity = _align(inv_lines, po_lines)
+    has = po_idx >= 0
+    safe = np.where(has, po_idx, 0)
+
+    inv_qty = _floats(l.get("quantity") for l in inv_lines)
+    inv_total = _floats(l.get("line_total") for l in inv_lines)
+    inv_price = _unit_prices(_floats(l.get("unit_price") for l in inv_lines), inv_total, inv_qty)
+    inv_qty = np.where(np.isnan(inv_qty), np.divide(inv_total, inv_price, out=np.full(n, np.nan), where=inv_price != 0), inv_qty)
+
+    if po_lines:
+        po_qty = _floats(pl.get("quantity_ordered") for pl in po_lines)
+        po_price = _unit_prices(_floats(pl.get("unit_price") for pl in po_lines), _floats(pl.get("line_total") for pl in po_lines), po_qty)
+    else:
+        po_qty = po_price = np.full(1, np.nan)
+
+    ref_price = po_price[safe]
+    ref_qty = po_qty[safe]
+    incomplete = has & (np.isnan(inv_price) | np.isnan(ref_price) | np.isnan(inv_qty) | np.isnan(ref_qty))
+    price_tol = np.maximum(LINE_PRICE_TOLERANCE_ABS, LINE_PRICE_TOLERANCE_PCT * np.abs(np.nan_to_num(ref_price)))
+    price_ok = np.abs(np.nan_to_num(inv_price) - np.nan_to_num(ref_price)) <= price_tol
+    # Several invoice lines (and earlier invoices) may bill one PO line (split deliveries); check their sum
+    keys = [po_line_key(pl) for pl in po_lines]
+    prior = _floats((billed_before or {}).get((str(pl["po_id"]), keys[j]), 0.0) for j, pl in enumerate(po_lines))
+    billed = np.bincount(safe[has], weights=np.nan_to_num(inv_qty[has]), minlength=len(po_qty))
+    if po_lines:
+        billed = billed + prior
+    over = billed > np.nan_to_num(po_qty) * (1.0 + LINE_QTY_TOLERANCE) + 1e-9
+    qty_ok = ~over[safe]
+
+    status = np.select(
+        [~has, incomplete, ~price_ok, ~qty_ok],
+        [LINE_UNMATCHED, LINE_INCOMPLETE, LINE_PRICE_MISMATCH, LINE_QUANTITY_EXCEEDED],
+        default=LINE_MATCHED,
+    )
+    matched = status == LINE_MATCHED
+
+    report: List[Dict[str, Any]] = []
+    for i, line in enumerate(inv_lines):
+        pl = po_lines[int(po_idx[i])] if has[i] else None
+        report.append({
+            "position": i,
+            "lineNumber": line.get("line_number"),
+            "poId": str(pl["po_id"]) if pl else None,
+            "poLineNumber": pl.get("line_number") if pl else None,
+            "poLineKey": keys[int(po_idx[i])] if pl else None,
+            "matchedBy": matched_by[i],
+            "similarity": round(float(similarity[i]), 3),
+            "quantity": None if np.isnan(inv_qty[i]) else float(inv_qty[i]),
+            "poQuantity": None if not pl or np.isnan(ref_qty[i]) else float(ref_qty[i]),
+            "unitPrice": None if np.isnan(inv_price[i]) else float(inv_price[i]),
+            "poUnitPrice": None if not pl or np.isnan(ref_price[i]) else float(ref_price[i]),
+            "status": str(status[i]),
+        })
+
+    all_matched = bool(n) and bool(matched.all())
+    po_id = None
+    covers_po = False
+    confidence = 0.0
+    if all_matched:
+        amounts = np.nan_to_num(inv_qty * inv_price)
+        po_ids = np.array([str(po_lines[j]["po_id"]) for j in po_idx], dtype=object)
+        unique_ids = sorted(set(po_ids))
+        po_id = max(unique_ids, key=lambda p: float(amounts[po_ids == p].sum()))
+        # Fully billed: every line of every PO involved reached its ordered quantity
+        involved = np.array([str(pl["po_id"]) in unique_ids for pl in po_lines])
+        covers_po = bool((billed[involved] >= np.nan_to_num(po_qty[involved]) * (1.0 - LINE_QTY_TOLERANCE) - 1e-9).all())
+        rel_diff = np.abs(inv_price - ref_price) / np.maximum(1.0, np.abs(ref_price))
+        confidence = max(0.0, 1.0 - min(1.0, float(rel_diff.mean())))
+    return {"lines": report, "allMatched": all_matched, "coversPo": covers_po, "poId": po_id, "confidence": confidence}
+
+def line_match_status(result: Dict[str, Any]) -> Optional[str]:
+    """Invoice status implied by a match_lines result, or None to leave the invoice unmatched."""
+    if not result["allMatched"]:
+        return None
+    return "matched_auto" if result["coversPo"] else "partially_matched"
+
+def load_billed_quantities(cur, po_ids: Sequence[Any], exclude_invoice_ids: Sequence[Any] = ()) -> Dict[Tuple[str, str], float]:
+    """Quantity per (po_id, po_line_key) billed by matched lines of invoices in BILLED_STATUSES."""
+    cur.execute(
+        """
+        SELECT m.po_id, m.po_line_key, SUM(m.quantity)
+        FROM invoice_line_matches m
+        JOIN invoices i ON i.id = m.invoice_id
+        WHERE m.po_id = ANY(%s)
+          AND m.status = 'matched'
+          AND m.po_line_key IS NOT NULL
+          AND i.status = ANY(%s)
+          AND NOT (m.invoice_id = ANY(%s))
+        GROUP BY m.po_id, m.po_line_key
+        """,
+        (list(po_ids), BILLED_STATUSES, list(exclude_invoice_ids))
+    )
+    return {(str(r[0]), r[1]): float(r[2] or 0) for r in cur.fetchall()}
+
+def record_billed(billed: Dict[Tuple[str, str], float], report: List[Dict[str, Any]]) -> None:
+    """Add an invoice's matched lines to billed, for batches that match several invoices before writing."""
+    for l in report:
+        if l["status"] == LINE_MATCHED and l["poLineKey"] is not None:
+            key = (l["poId"], l["poLineKey"])
+            billed[key] = billed.get(key, 0.0) + (l["quantity"] or 0.0)
+
+def load_invoice_lines(cur, invoice_ids: Sequence[Any]) -> Dict[str, List[Dict[str, Any]]]:
+    cur.execute(
+        f"""
+        SELECT {_INVOICE_LINE_COLUMNS}
+        FROM invoice_lines
+        WHERE invoice_id = ANY(%s)
+        ORDER BY invoice_id, COALESCE(line_number, 0), po_line_number NULLS LAST
+        """,
+        (list(invoice_ids),)
+    )
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    for r in cur.fetchall():
+        out.setdefault(str(r[0]), []).append({
+            "line_number": r[1], "description": r[2], "sku": r[3], "quantity": r[4],
+            "unit_price": r[5], "line_total": r[6], "po_number": r[7], "po_line_number": r[8],
+        })
+    return out
+
+def load_po_lines(cur, po_ids: Sequence[Any]) -> Dict[str, List[Dict[str, Any]]]:
+    cur.execute(
+        f"""
+        SELECT {_PO_LINE_COLUMNS}
+        FROM purchase_order_lines pl
+        JOIN purchase_orders p ON p.id = pl.po_id
+        WHERE pl.po_id = ANY(%s)
+        ORDER BY pl.po_id, COALESCE(pl.line_number, 0)
+        """,
+        (list(po_ids),)
+    )
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    for r in cur.fetchall():
+        out.setdefault(str(r[0]), []).append({
+            "po_id": r[0], "po_number": r[1], "line_number": r[2], "sku": r[3], "description": r[4],
+            "quantity_ordered": r[5], "unit_price": r[6], "line_total": r[7],
+        })
+    return out
+
+def save_line_reports(cur, reports: Dict[str, List[Dict[str, Any]]]) -> None:
+    """Replace the stored per-line report of each invoice in `reports`."""
+    if not reports:
+        return
+    cur.execute("DELETE FROM invoice_line_matches WHERE invoice_id = ANY(%s)", (list(reports),))
+    cur.executemany(
+        """
+        INSERT INTO invoice_line_matches(invoice_id, position, line_number, po_id, po_line_number,
+                                         po_line_key, matched_by, similarity, quantity, po_quantity,
+                                         unit_price, po_unit_price, status)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """,
+        [
+            (invoice_id, l["position"], l["lineNumber"], l["poId"],
+             str(l["poLineNumber"]) if l["poLineNumber"] is not None else None,
+             l["poLineKey"], l["matchedBy"], l["similarity"], l["quantity"], l["poQuantity"], l["unitPrice"],
+             l["poUnitPrice"], l["status"])
+            for invoice_id, lines in reports.items()
+            for l in lines
+        ]
+    )
+
+def candidate_po_ids(cur, po_numbers: Iterable[str], inv_currency, inv_vendor_id) -> List[Any]:
+    """Open/partially_received POs for any of the PO numbers (compared normalized), compatible in currency and vendor."""
+    numbers = sorted({normalize_po_number(n) for n in po_numbers} - {None})
+    if not numbers:
+        return []
+    cur.execute(
+        """
+        SELECT id
+        FROM purchase_orders
+        WHERE po_number_norm = ANY(%s)
+          AND status IN ('open','partially_received')
+          AND (%s::text IS NULL OR currency IS NULL OR currency = %s)
+          AND (%s::uuid IS NULL OR vendor_id IS NULL OR vendor_id = %s)
+        ORDER BY id
+        """,
+        (numbers, inv_currency, inv_currency, inv_vendor_id, inv_vendor_id)
+    )
+    return [r[0] for r in cur.fetchall()]
+
+def match_invoice_lines(cur, invoice_id, inv_po_number, inv_currency, inv_vendor_id) -> Optional[Tuple[str, str, float]]:
+    """Run line matching for one invoice inside the caller's transaction and store its report.
+    Returns (po_id, status, confidence) when the invoice should leave the exception queue.
+    """
+    lines = load_invoice_lines(cur, [invoice_id]).get(str(invoice_id), [])
+    if not lines:
+        return None
+    for line in lines:
+        line["po_number"] = line.get("po_number") or inv_po_number
+    po_ids = candidate_po_ids(cur, [l["po_number"] for l in lines], inv_currency, inv_vendor_id)
+    if not po_ids:
+        return None
+    po_lines = [pl for lines_ in load_po_lines(cur, po_ids).values() for pl in lines_]
+    if not po_lines:
+        return None
+    result = match_lines(lines, po_lines, load_billed_quantities(cur, po_ids, [invoice_id]))
+    save_line_reports(cur, {str(invoice_id): result["lines"]})
+    status = line_match_status(result)
+    if status is None:
+        return None
+    return result["poId"], status, result["confidence"]
+
+def get_line_match_report(invoice_id: str) -> List[Dict[str, Any]]:
+    """Stored per-line match report for an invoice, in invoice line order."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT position, line_number, po_id, po_line_number, matched_by, similarity,
+                       quantity, po_quantity, unit_price, po_unit_price, status
+                FROM invoice_line_matches
+                WHERE invoice_id = %s
+                ORDER BY position
+                """,
+                (invoice_id,)
+            )
+            rows = cur.fetchall()
+    return [
+        {
+            "position": r[0],
+            "lineNumber": r[1],
+            "poId": str(r[2]) if r[2] else None,
+            "poLineNumber": r[3],
+            "matchedBy": r[4],
+            "similarity": float(r[5]) if r[5] is not None else None,
+            "quantity": float(r[6]) if r[6] is not None else None,
+            "poQuantity": float(r[7]) if r[7] is not None else None,
+            "unitPrice": float(r[8]) if r[8] is not None else None,
+            "poUnitPrice": float(r[9]) if r[9] is not None else None,
+            "status": r[10],
+        }
+        for r in rows
+    ]
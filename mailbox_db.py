@@ -0,0 +1,122 @@
+from typing import List, Optional, Tuple
+from db import get_conn
+
+_tables_ready = False
+
+def _ensure_mailbox_tables(cur) -> None:
+    global _tables_ready
+    if _tables_ready:
+        return
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS public.mailbox_sync_state (
+      account text NOT NULL,
+      mailbox text NOT NULL,
+      uidvalidity bigint NOT NULL,
+      last_uid bigint NOT NULL DEFAULT 0,
+      updated_at timestamptz DEFAULT now(),
+      PRIMARY KEY (account, mailbox)
+    );
+    CREATE TABLE IF NOT EXISTS public.mailbox_failed_uids (
+      account text NOT NULL,
+      mailbox text NOT NULL,
+      uidvalidity bigint NOT NULL,
+      uid bigint NOT NULL,
+      attempts int NOT NULL DEFAULT 1,
+      last_error text,
+      updated_at timestamptz DEFAULT now(),
+      PRIMARY KEY (account, mailbox, uidvalidity, uid)
+    );
+    """)
+    _tables_ready = True
+
+def get_mailbox_state(account: str, mailbox: str) -> Optional[Tuple[int, int]]:
+    """Return (uidvalidity, last_uid) for a mailbox, or None if never synced."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _ensure_mailbox_tables(cur)
+            cur.execute(
+                """
+                SELECT uidvalidity, last_uid
+                FROM mailbox_sync_state
+                WHERE account = %s AND mailbox = %s
+                """,
+                (account, mailbox)
+            )
+            row = cur.fetchone()
+            return (int(row[0]), int(row[1])) if row else None
+
+def save_mailbox_state(account: str, mailbox: str, uidvalidity: int, last_uid: int) -> None:
+    """Persist the high-water mark. A new UIDVALIDITY replaces the old mark outright."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _ensure_mailbox_tables(cur)
+            cur.execute(
+                """
+                INSERT INTO mailbox_sync_state(account, mailbox, uidvalidity, last_uid, updated_at)
+                VALUES (%s, %s, %s, %s, now())
+                ON CONFLICT (account, mailbox) DO UPDATE
+                SET uidvalidity = EXCLUDED.uidvalidity,
+                    last_uid = CASE
+                        WHEN mailbox_sync_state.uidvalidity = EXCLUDED.uidvalidity
+                        THEN GREATEST(mailbox_sync_state.last_uid, EXCLUDED.last_uid)
+                        ELSE EXCLUDED.last_uid
+                    END,
+                    updated_at = now()
+                """,
+                (account, mailbox, uidvalidity, last_uid)
+            )
+
+def get_retry_uids(account: str, mailbox: str, uidvalidity: int, max_attempts: int) -> List[int]:
+    """UIDs below the high-water mark whose processing failed and should be tried again.
+
+    Failures recorded under an older UIDVALIDITY refer to UIDs that no longer exist and are dropped.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _ensure_mailbox_tables(cur)
+            cur.execute(
+                """
+                DELETE FROM mailbox_failed_uids
+                WHERE account = %s AND mailbox = %s AND uidvalidity <> %s
+                """,
+                (account, mailbox, uidvalidity)
+            )
+            cur.execute(
+                """
+                SELECT uid
+                FROM mailbox_failed_uids
+                WHERE account = %s AND mailbox = %s AND uidvalidity = %s AND attempts < %s
+                ORDER BY uid
+                """,
+                (account, mailbox, uidvalidity, max_attempts)
+            )
+            return [int(r[0]) for r in cur.fetchall()]
+
+def record_mailbox_failure(account: str, mailbox: str, uidvalidity: int, uid: int, error: str) -> None:
+    """Remember a message that could not be processed so a later sync retries it."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _ensure_mailbox_tables(cur)
+            cur.execute(
+                """
+                INSERT INTO mailbox_failed_uids(account, mailbox, uidvalidity, uid, last_error, updated_at)
+                VALUES (%s, %s, %s, %s, %s, now())
+                ON CONFLICT (account, mailbox, uidvalidity, uid) DO UPDATE
+                SET attempts = mailbox_failed_uids.attempts + 1,
+                    last_error = EXCLUDED.last_error,
+                    updated_at = now()
+                """,
+                (account, mailbox, uidvalidity, uid, error)
+            )
+
+def clear_mailbox_failure(account: str, mailbox: str, uidvalidity: int, uid: int) -> None:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _ensure_mailbox_tables(cur)
+            cur.execute(
+                """
+                DELETE FROM mailbox_failed_uids
+                WHERE account = %s AND mailbox = %s AND uidvalidity = %s AND uid = %s
+                """,
+                (account, mailbox, uidvalidity, uid)
+            )
@@ -0,0 +1,76 @@
+-- Per-day, per-vendor invoice totals for the dashboard graph.
+-- Kept current by row triggers on invoices (ingest, matching, payment status changes);
+-- rebuild_invoice_rollup.py recomputes it from invoices for backfill or repair.
+CREATE TABLE IF NOT EXISTS public.invoice_daily_rollup (
+  day date NOT NULL,
+  vendor_id uuid,
+  invoice_count int NOT NULL DEFAULT 0,
+  total_amount numeric NOT NULL DEFAULT 0,
+  matched_count int NOT NULL DEFAULT 0
+);
+
+-- vendor_id is NULL for unresolved vendors, so the key coalesces it to a sentinel
+CREATE UNIQUE INDEX IF NOT EXISTS uq_invoice_daily_rollup_day_vendor
+  ON public.invoice_daily_rollup(day, (COALESCE(vendor_id, '00000000-0000-0000-0000-000000000000'::uuid)));
+
+CREATE OR REPLACE FUNCTION public.invoice_daily_rollup_apply(
+  p_day date, p_vendor_id uuid, p_count int, p_amount numeric, p_matched int
+) RETURNS void AS $$
+BEGIN
+  INSERT INTO public.invoice_daily_rollup(day, vendor_id, invoice_count, total_amount, matched_count)
+  VALUES (p_day, p_vendor_id, p_count, p_amount, p_matched)
+  ON CONFLICT (day, (COALESCE(vendor_id, '00000000-0000-0000-0000-000000000000'::uuid)))
+  DO UPDATE SET
+    invoice_count = invoice_daily_rollup.invoice_count + EXCLUDED.invoice_count,
+    total_amount = invoice_daily_rollup.total_amount + EXCLUDED.total_amount,
+    matched_count = invoice_daily_rollup.matched_count + EXCLUDED.matched_count;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.invoices_rollup_changed() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.created_at IS NOT NULL THEN
+    PERFORM public.invoice_daily_rollup_apply(
+      OLD.created_at::date, OLD.vendor_id, -1, -COALESCE(OLD.total_amount, 0),
+      -(CASE WHEN OLD.status = 'matched_auto' THEN 1 ELSE 0 END));
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.created_at IS NOT NULL THEN
+    PERFORM public.invoice_daily_rollup_apply(
+      NEW.created_at::date, NEW.vendor_id, 1, COALESCE(NEW.total_amount, 0),
+      CASE WHEN NEW.status = 'matched_auto' THEN 1 ELSE 0 END);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Triggers and backfill in one transaction: no delta can land between the two,
+-- and LOCK TABLE is only valid inside a transaction block
+BEGIN;
+
+DROP TRIGGER IF EXISTS trg_invoices_rollup_insert_delete ON public.invoices;
+CREATE TRIGGER trg_invoices_rollup_insert_delete
+  AFTER INSERT OR DELETE ON public.invoices
+  FOR EACH ROW EXECUTE FUNCTION public.invoices_rollup_changed();
+
+-- Only updates that move an invoice between buckets touch the rollup
+DROP TRIGGER IF EXISTS trg_invoices_rollup_update ON public.invoices;
+CREATE TRIGGER trg_invoices_rollup_update
+  AFTER UPDATE OF created_at, vendor_id, total_amount, status ON public.invoices
+  FOR EACH ROW
+  WHEN (OLD.created_at IS DISTINCT FROM NEW.created_at
+     OR OLD.vendor_id IS DISTINCT FROM NEW.vendor_id
+     OR OLD.total_amount IS DISTINCT FROM NEW.total_amount
+     OR OLD.status IS DISTINCT FROM NEW.status)
+  EXECUTE FUNCTION public.invoices_rollup_changed();
+
+-- Backfill; SHARE mode holds off invoice writes until the initial rows are in
+LOCK TABLE public.invoices IN SHARE MODE;
+TRUNCATE public.invoice_daily_rollup;
+INSERT INTO public.invoice_daily_rollup(day, vendor_id, invoice_count, total_amount, matched_count)
+SELECT created_at::date, vendor_id, COUNT(*), COALESCE(SUM(total_amount), 0),
+       COUNT(*) FILTER (WHERE status = 'matched_auto')
+FROM public.invoices
+WHERE created_at IS NOT NULL
+GROUP BY created_at::date, vendor_id;
+
+COMMIT;
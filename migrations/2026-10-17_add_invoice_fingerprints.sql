@@ -0,0 +1,30 @@
+-- Duplicate invoice detection (invoice_fingerprint.py).
+-- fingerprint: exact key over vendor, normalized invoice number, total and date.
+-- Built from immutable pieces only (no concat_ws / date::text, which depend on settings).
+ALTER TABLE public.invoices
+  ADD COLUMN IF NOT EXISTS fingerprint text GENERATED ALWAYS AS (
+    CASE WHEN invoice_number IS NULL AND total_amount IS NULL THEN NULL ELSE md5(
+      coalesce(vendor_id::text, lower(btrim(supplier_name)), '') || '|' ||
+      coalesce(regexp_replace(upper(invoice_number), '[^A-Z0-9]', '', 'g'), '') || '|' ||
+      coalesce(round(total_amount, 2)::text, '') || '|' ||
+      coalesce((invoice_date - DATE '2000-01-01')::text, '')
+    ) END
+  ) STORED;
+
+-- 64-bit SimHash over the line items, written at ingest / re-extraction
+ALTER TABLE public.invoices ADD COLUMN IF NOT EXISTS line_simhash bigint;
+ALTER TABLE public.invoices
+  ADD COLUMN IF NOT EXISTS duplicate_of uuid REFERENCES public.invoices(id) ON DELETE SET NULL;
+
+CREATE INDEX IF NOT EXISTS idx_invoices_fingerprint ON public.invoices(fingerprint);
+
+-- The SimHash split into 4 bands of 16 bits, each hashed together with the vendor key
+-- into a bucket. Hashes within Hamming distance 3 share at least one band, so near-duplicate
+-- lookup is four bucket probes on the primary key, limited to the same vendor.
+CREATE TABLE IF NOT EXISTS public.invoice_simhash_buckets (
+  bucket bigint NOT NULL,
+  invoice_id uuid NOT NULL REFERENCES public.invoices(id) ON DELETE CASCADE,
+  PRIMARY KEY (bucket, invoice_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_invoice_simhash_buckets_invoice_id ON public.invoice_simhash_buckets(invoice_id);
@@ -0,0 +1,23 @@
+-- Keyset pagination for invoice listings: ORDER BY created_at DESC NULLS LAST, id DESC
+-- seeking with (created_at, id) < (cursor). One index per listing shape, in that exact
+-- ordering (a plain DESC index sorts NULLs first and cannot serve NULLS LAST without a sort).
+CREATE INDEX IF NOT EXISTS idx_invoices_created_desc
+  ON public.invoices(created_at DESC NULLS LAST, id DESC);
+
+-- Exceptions page, all exception statuses
+CREATE INDEX IF NOT EXISTS idx_invoices_exceptions_created_desc
+  ON public.invoices(created_at DESC NULLS LAST, id DESC)
+  WHERE status IN ('unmatched','vendor_mismatch','needs_review');
+
+-- Exceptions page filtered to one status
+CREATE INDEX IF NOT EXISTS idx_invoices_status_created_desc
+  ON public.invoices(status, created_at DESC NULLS LAST, id DESC);
+
+-- Payments page (every payable status, including partially_matched from line-level matching)
+CREATE INDEX IF NOT EXISTS idx_invoices_payable_created_desc
+  ON public.invoices(created_at DESC NULLS LAST, id DESC)
+  WHERE status IN ('matched_auto','partially_matched','ready_for_payment');
+
+-- Either page filtered to one vendor
+CREATE INDEX IF NOT EXISTS idx_invoices_vendor_created_desc
+  ON public.invoices(vendor_id, created_at DESC NULLS LAST, id DESC);
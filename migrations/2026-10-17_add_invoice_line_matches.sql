@@ -0,0 +1,26 @@
+-- Per-line three-way match report written by line_matching.py
+CREATE TABLE IF NOT EXISTS public.invoice_line_matches (
+  invoice_id uuid NOT NULL REFERENCES public.invoices(id) ON DELETE CASCADE,
+  position int NOT NULL,
+  line_number int,
+  po_id uuid REFERENCES public.purchase_orders(id) ON DELETE SET NULL,
+  po_line_number text,
+  -- line_matching.po_line_key: sums quantities earlier invoices billed per PO line
+  po_line_key text,
+  matched_by text CHECK (matched_by IN ('po_line_number','sku','description')),
+  similarity numeric,
+  quantity numeric,
+  po_quantity numeric,
+  unit_price numeric,
+  po_unit_price numeric,
+  status text NOT NULL CHECK (status IN ('matched','unmatched','price_mismatch','quantity_exceeded','incomplete')),
+  created_at timestamptz DEFAULT now(),
+  PRIMARY KEY (invoice_id, position)
+);
+
+ALTER TABLE public.invoice_line_matches ADD COLUMN IF NOT EXISTS po_line_key text;
+
+CREATE INDEX IF NOT EXISTS idx_invoice_line_matches_po_id ON public.invoice_line_matches(po_id);
+
+-- partially_matched (every invoice line reconciles to a PO line, PO not fully billed) is payable;
+-- idx_invoices_payable_created_desc (add_invoice_keyset_indexes) already covers it
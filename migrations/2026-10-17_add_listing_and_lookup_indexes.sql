@@ -0,0 +1,23 @@
+-- Indexes for the hot read paths in invoice_db.py, vendor_db.py, po_matching.py and
+-- the /api/vendors/<id>/mentions route. check_query_plans.py asserts that each of
+-- those queries plans as an index scan against 1M seeded invoices.
+--
+-- The keyset listing indexes (add_invoice_keyset_indexes) already use "created_at DESC
+-- NULLS LAST, id DESC"; the dashboard window, vendor and mentions queries share them.
+-- PO number lookups go through po_number_norm (add_po_number_norm), open-PO counts
+-- through vendor_activity, and vendor names through the in-process vendor index, so
+-- none of those get an index here.
+
+-- Vendor detail invoice list
+CREATE INDEX IF NOT EXISTS idx_invoices_vendor_invoice_date_desc
+  ON public.invoices(vendor_id, invoice_date DESC NULLS LAST, id DESC);
+
+-- Vendor detail PO list, mentions search, vendor delete
+CREATE INDEX IF NOT EXISTS idx_purchase_orders_vendor_created_desc
+  ON public.purchase_orders(vendor_id, created_at DESC NULLS LAST, id DESC);
+
+-- Line items by parent, in display order
+CREATE INDEX IF NOT EXISTS idx_invoice_lines_invoice_id
+  ON public.invoice_lines(invoice_id, line_number);
+CREATE INDEX IF NOT EXISTS idx_purchase_order_lines_po_id
+  ON public.purchase_order_lines(po_id, line_number);
@@ -0,0 +1,21 @@
+-- IMAP incremental sync: UIDVALIDITY and last processed UID per mailbox
+CREATE TABLE IF NOT EXISTS public.mailbox_sync_state (
+  account text NOT NULL,
+  mailbox text NOT NULL,
+  uidvalidity bigint NOT NULL,
+  last_uid bigint NOT NULL DEFAULT 0,
+  updated_at timestamptz DEFAULT now(),
+  PRIMARY KEY (account, mailbox)
+);
+
+-- Messages whose processing raised; retried on later syncs until attempts runs out
+CREATE TABLE IF NOT EXISTS public.mailbox_failed_uids (
+  account text NOT NULL,
+  mailbox text NOT NULL,
+  uidvalidity bigint NOT NULL,
+  uid bigint NOT NULL,
+  attempts int NOT NULL DEFAULT 1,
+  last_error text,
+  updated_at timestamptz DEFAULT now(),
+  PRIMARY KEY (account, mailbox, uidvalidity, uid)
+);
@@ -0,0 +1,16 @@
+-- OCR results cached per stage.
+-- parse: keyed by document content hash + model; extract: keyed by parse-markdown hash + model + schema version.
+CREATE TABLE IF NOT EXISTS public.ocr_cache (
+  stage text NOT NULL CHECK (stage IN ('parse','extract')),
+  content_hash text NOT NULL,
+  model text NOT NULL,
+  schema_version text NOT NULL DEFAULT '',
+  result jsonb NOT NULL,
+  hit_count bigint NOT NULL DEFAULT 0,
+  created_at timestamptz DEFAULT now(),
+  last_hit_at timestamptz DEFAULT now(),
+  PRIMARY KEY (stage, content_hash, model, schema_version)
+);
+
+-- Eviction scans by recency
+CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_hit_at ON public.ocr_cache(last_hit_at);
@@ -0,0 +1,27 @@
+-- OCR job queue: intake enqueues, OCR workers claim with SKIP LOCKED.
+-- status is the last completed stage: saved -> ocr -> persisted -> matched (or failed)
+CREATE TABLE IF NOT EXISTS public.ocr_jobs (
+  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  file_path text NOT NULL,
+  from_email text,
+  message_id text,
+  vendor_id uuid,
+  status text NOT NULL DEFAULT 'saved' CHECK (status IN ('saved','ocr','persisted','matched','failed')),
+  fields_json_path text,
+  invoice_id uuid,
+  matched_po_id uuid,
+  attempts int NOT NULL DEFAULT 0,
+  last_error text,
+  locked_by text,
+  locked_at timestamptz,
+  available_at timestamptz NOT NULL DEFAULT now(),
+  created_at timestamptz DEFAULT now(),
+  updated_at timestamptz DEFAULT now()
+);
+
+-- Claim path: only pending stages, oldest first
+CREATE INDEX IF NOT EXISTS idx_ocr_jobs_pending ON public.ocr_jobs(created_at)
+  WHERE status IN ('saved','ocr','persisted');
+
+-- One job per saved file, so re-queueing after a failed enqueue is safe
+CREATE UNIQUE INDEX IF NOT EXISTS idx_ocr_jobs_file_path ON public.ocr_jobs(file_path);
@@ -0,0 +1,17 @@
+-- Invoice amounts allocated against PO balances by po_allocation.py.
+-- A PO's remaining balance is total_amount minus its allocations (and minus header
+-- matches that have no allocation rows). Suggested rows (subset-sum or partial-bill proposals on
+-- needs_review invoices) are shown to reviewers but do not consume balance.
+CREATE TABLE IF NOT EXISTS public.po_allocations (
+  invoice_id uuid NOT NULL REFERENCES public.invoices(id) ON DELETE CASCADE,
+  po_id uuid NOT NULL REFERENCES public.purchase_orders(id) ON DELETE CASCADE,
+  amount numeric NOT NULL CHECK (amount > 0),
+  suggested boolean NOT NULL DEFAULT false,
+  created_at timestamptz DEFAULT now(),
+  PRIMARY KEY (invoice_id, po_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_po_allocations_po_id ON public.po_allocations(po_id);
+
+-- Databases that created po_allocations before suggestions existed
+ALTER TABLE public.po_allocations ADD COLUMN IF NOT EXISTS suggested boolean NOT NULL DEFAULT false;
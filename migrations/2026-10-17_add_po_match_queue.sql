@@ -0,0 +1,43 @@
+-- Purchase orders arrive from outside the app. Queue every matchable PO change for
+-- po_matching.process_po_match_queue and wake listeners; the queue survives restarts
+-- and missed notifications, the NOTIFY only makes pickup immediate.
+CREATE TABLE IF NOT EXISTS public.po_match_queue (
+  po_id uuid PRIMARY KEY REFERENCES public.purchase_orders(id) ON DELETE CASCADE,
+  enqueued_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION public.enqueue_po_match(p_po_id uuid) RETURNS void AS $$
+BEGIN
+  INSERT INTO public.po_match_queue(po_id) VALUES (p_po_id)
+  ON CONFLICT (po_id) DO UPDATE SET enqueued_at = now();
+  -- Same payload collapses to one notification per transaction, even for bulk loads
+  PERFORM pg_notify('purchase_orders_changed', '');
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.purchase_orders_enqueue_match() RETURNS trigger AS $$
+BEGIN
+  IF NEW.status IN ('open','partially_received') THEN
+    PERFORM public.enqueue_po_match(NEW.id);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_purchase_orders_enqueue_match ON public.purchase_orders;
+CREATE TRIGGER trg_purchase_orders_enqueue_match
+  AFTER INSERT OR UPDATE OF po_number, vendor_id, total_amount, currency, status ON public.purchase_orders
+  FOR EACH ROW EXECUTE FUNCTION public.purchase_orders_enqueue_match();
+
+-- New or corrected PO lines can make line-level matching succeed
+CREATE OR REPLACE FUNCTION public.purchase_order_lines_enqueue_match() RETURNS trigger AS $$
+BEGIN
+  PERFORM public.enqueue_po_match(NEW.po_id);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_purchase_order_lines_enqueue_match ON public.purchase_order_lines;
+CREATE TRIGGER trg_purchase_order_lines_enqueue_match
+  AFTER INSERT OR UPDATE ON public.purchase_order_lines
+  FOR EACH ROW EXECUTE FUNCTION public.purchase_order_lines_enqueue_match();
@@ -0,0 +1,34 @@
+-- Normalized PO numbers: "PO# 4500-1234", "4500 1234" and "po45001234" all become 45001234.
+-- po_lookup.normalize_po_number in Python must stay identical to this function.
+-- The prefix is only stripped before a digit, so "NOV2025-01" and "POL-001" keep their letters.
+CREATE OR REPLACE FUNCTION public.normalize_po_number(value text) RETURNS text AS $$
+  SELECT NULLIF(
+    regexp_replace(
+      upper(regexp_replace(coalesce(value, ''), '[^A-Za-z0-9]', '', 'g')),
+      '^(PURCHASEORDER|PO)?(NUMBER|NO|NR)?(?=[0-9])', ''),
+    '')
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- Stored generated columns (adding them rewrites each table once)
+ALTER TABLE public.purchase_orders
+  ADD COLUMN IF NOT EXISTS po_number_norm text GENERATED ALWAYS AS (public.normalize_po_number(po_number)) STORED;
+ALTER TABLE public.invoices
+  ADD COLUMN IF NOT EXISTS po_number_norm text GENERATED ALWAYS AS (public.normalize_po_number(po_number)) STORED;
+
+-- Exact lookups (match_invoice, bulk rematch, line matching)
+CREATE INDEX IF NOT EXISTS idx_purchase_orders_po_number_norm_status
+  ON public.purchase_orders(po_number_norm, status);
+CREATE INDEX IF NOT EXISTS idx_invoices_po_number_norm
+  ON public.invoices(po_number_norm)
+  WHERE po_number_norm IS NOT NULL;
+
+-- Near misses: trigram KNN (ORDER BY po_number_norm <-> ?) over matchable POs
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_purchase_orders_po_number_norm_trgm
+  ON public.purchase_orders USING gist (po_number_norm gist_trgm_ops)
+  WHERE status IN ('open','partially_received');
+
+-- Unmatched invoices whose PO number is a near miss of a changed PO (po_matching.process_po_match_queue)
+CREATE INDEX IF NOT EXISTS idx_invoices_unmatched_po_number_norm_trgm
+  ON public.invoices USING gin (po_number_norm gin_trgm_ops)
+  WHERE status = 'unmatched' AND po_number_norm IS NOT NULL;
@@ -0,0 +1,167 @@
+-- Per-vendor counters for the Vendors page and vendor detail, so neither scans invoices
+-- or purchase_orders. Row triggers apply deltas on every write (ingest, matching, payments,
+-- PO loads); vendor_activity_advance_window() slides the 30-day window forward (nightly
+-- job in app.py) and vendor_activity_recompute() rebuilds the table (backfill, manual repair).
+CREATE TABLE IF NOT EXISTS public.vendor_activity (
+  vendor_id uuid PRIMARY KEY REFERENCES public.vendors(id) ON DELETE CASCADE,
+  open_po_count int NOT NULL DEFAULT 0,
+  invoices_30d int NOT NULL DEFAULT 0,
+  amount_30d numeric NOT NULL DEFAULT 0,
+  last_invoice_at timestamptz,
+  -- Invoices created on or after this date count toward the 30-day columns
+  window_start date NOT NULL DEFAULT (CURRENT_DATE - 30),
+  updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION public.vendor_activity_apply(
+  p_vendor_id uuid, p_open_pos int, p_invoices int, p_amount numeric, p_created_at timestamptz
+) RETURNS void AS $$
+BEGIN
+  IF p_vendor_id IS NULL THEN
+    RETURN;
+  END IF;
+  INSERT INTO public.vendor_activity AS va(vendor_id, open_po_count, invoices_30d, amount_30d, last_invoice_at)
+  VALUES (
+    p_vendor_id,
+    GREATEST(p_open_pos, 0),
+    CASE WHEN p_invoices > 0 AND p_created_at >= CURRENT_DATE - 30 THEN p_invoices ELSE 0 END,
+    CASE WHEN p_invoices > 0 AND p_created_at >= CURRENT_DATE - 30 THEN p_amount ELSE 0 END,
+    CASE WHEN p_invoices > 0 THEN p_created_at END
+  )
+  ON CONFLICT (vendor_id) DO UPDATE SET
+    open_po_count = va.open_po_count + p_open_pos,
+    invoices_30d = va.invoices_30d + CASE WHEN p_created_at >= va.window_start THEN p_invoices ELSE 0 END,
+    amount_30d = va.amount_30d + CASE WHEN p_created_at >= va.window_start THEN p_amount ELSE 0 END,
+    -- Only ever moves forward; a deleted latest invoice is corrected by vendor_activity_recompute()
+    last_invoice_at = CASE WHEN p_invoices > 0 THEN GREATEST(va.last_invoice_at, p_created_at) ELSE va.last_invoice_at END,
+    updated_at = now();
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.invoices_vendor_activity_changed() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM public.vendor_activity_apply(OLD.vendor_id, 0, -1, -COALESCE(OLD.total_amount, 0), OLD.created_at);
+  END IF;
+  IF TG_OP IN ('UPDATE', 'INSERT') THEN
+    PERFORM public.vendor_activity_apply(NEW.vendor_id, 0, 1, COALESCE(NEW.total_amount, 0), NEW.created_at);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Triggers and backfill in one transaction: no delta can land between the two,
+-- and LOCK TABLE is only valid inside a transaction block
+BEGIN;
+
+DROP TRIGGER IF EXISTS trg_invoices_vendor_activity_insert_delete ON public.invoices;
+CREATE TRIGGER trg_invoices_vendor_activity_insert_delete
+  AFTER INSERT OR DELETE ON public.invoices
+  FOR EACH ROW EXECUTE FUNCTION public.invoices_vendor_activity_changed();
+
+DROP TRIGGER IF EXISTS trg_invoices_vendor_activity_update ON public.invoices;
+CREATE TRIGGER trg_invoices_vendor_activity_update
+  AFTER UPDATE OF vendor_id, total_amount, created_at ON public.invoices
+  FOR EACH ROW
+  WHEN (OLD.vendor_id IS DISTINCT FROM NEW.vendor_id
+     OR OLD.total_amount IS DISTINCT FROM NEW.total_amount
+     OR OLD.created_at IS DISTINCT FROM NEW.created_at)
+  EXECUTE FUNCTION public.invoices_vendor_activity_changed();
+
+CREATE OR REPLACE FUNCTION public.purchase_orders_vendor_activity_changed() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status IN ('open', 'partially_received') THEN
+    PERFORM public.vendor_activity_apply(OLD.vendor_id, -1, 0, 0, NULL);
+  END IF;
+  IF TG_OP IN ('UPDATE', 'INSERT') AND NEW.status IN ('open', 'partially_received') THEN
+    PERFORM public.vendor_activity_apply(NEW.vendor_id, 1, 0, 0, NULL);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_purchase_orders_vendor_activity_insert_delete ON public.purchase_orders;
+CREATE TRIGGER trg_purchase_orders_vendor_activity_insert_delete
+  AFTER INSERT OR DELETE ON public.purchase_orders
+  FOR EACH ROW EXECUTE FUNCTION public.purchase_orders_vendor_activity_changed();
+
+DROP TRIGGER IF EXISTS trg_purchase_orders_vendor_activity_update ON public.purchase_orders;
+CREATE TRIGGER trg_purchase_orders_vendor_activity_update
+  AFTER UPDATE OF vendor_id, status ON public.purchase_orders
+  FOR EACH ROW
+  WHEN (OLD.vendor_id IS DISTINCT FROM NEW.vendor_id OR OLD.status IS DISTINCT FROM NEW.status)
+  EXECUTE FUNCTION public.purchase_orders_vendor_activity_changed();
+
+-- Full rebuild with the window starting 30 days before today. Callers hold an EXCLUSIVE lock on
+-- vendor_activity so trigger deltas from in-flight writes land on top of the rebuilt rows.
+CREATE OR REPLACE FUNCTION public.vendor_activity_recompute() RETURNS int AS $$
+DECLARE
+  n int;
+BEGIN
+  INSERT INTO public.vendor_activity AS va(vendor_id, open_po_count, invoices_30d, amount_30d,
+                                           last_invoice_at, window_start, updated_at)
+  SELECT v.id, COALESCE(po.n, 0), COALESCE(inv.n, 0), COALESCE(inv.amount, 0), last.at, CURRENT_DATE - 30, now()
+  FROM public.vendors v
+  LEFT JOIN (
+    SELECT vendor_id, COUNT(*) AS n
+    FROM public.purchase_orders
+    WHERE status IN ('open', 'partially_received')
+    GROUP BY vendor_id
+  ) po ON po.vendor_id = v.id
+  LEFT JOIN (
+    SELECT vendor_id, COUNT(*) AS n, COALESCE(SUM(total_amount), 0) AS amount
+    FROM public.invoices
+    WHERE created_at >= CURRENT_DATE - 30
+    GROUP BY vendor_id
+  ) inv ON inv.vendor_id = v.id
+  LEFT JOIN (
+    SELECT vendor_id, MAX(created_at) AS at
+    FROM public.invoices
+    GROUP BY vendor_id
+  ) last ON last.vendor_id = v.id
+  ON CONFLICT (vendor_id) DO UPDATE SET
+    open_po_count = EXCLUDED.open_po_count,
+    invoices_30d = EXCLUDED.invoices_30d,
+    amount_30d = EXCLUDED.amount_30d,
+    last_invoice_at = EXCLUDED.last_invoice_at,
+    window_start = EXCLUDED.window_start,
+    updated_at = EXCLUDED.updated_at;
+  GET DIAGNOSTICS n = ROW_COUNT;
+  RETURN n;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Slide every row's window to CURRENT_DATE - 30 by subtracting the invoices that fell out of it,
+-- created_at in [old window_start, CURRENT_DATE - 30): an index range scan per vendor rather
+-- than full scans of invoices and purchase_orders, so the EXCLUSIVE lock callers hold on
+-- vendor_activity (the same one recompute needs) stalls writers only briefly.
+CREATE OR REPLACE FUNCTION public.vendor_activity_advance_window() RETURNS int AS $$
+DECLARE
+  n int;
+BEGIN
+  UPDATE public.vendor_activity va
+  SET invoices_30d = va.invoices_30d - e.n,
+      amount_30d = va.amount_30d - e.amount,
+      window_start = CURRENT_DATE - 30,
+      updated_at = now()
+  FROM (
+    SELECT a.vendor_id, COUNT(i.id) AS n, COALESCE(SUM(i.total_amount), 0) AS amount
+    FROM public.vendor_activity a
+    LEFT JOIN public.invoices i
+      ON i.vendor_id = a.vendor_id
+     AND i.created_at >= a.window_start
+     AND i.created_at < CURRENT_DATE - 30
+    WHERE a.window_start < CURRENT_DATE - 30
+    GROUP BY a.vendor_id
+  ) e
+  WHERE va.vendor_id = e.vendor_id;
+  GET DIAGNOSTICS n = ROW_COUNT;
+  RETURN n;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Backfill; SHARE mode holds off invoice and PO writes until the initial rows are in
+LOCK TABLE public.invoices, public.purchase_orders IN SHARE MODE;
+SELECT public.vendor_activity_recompute();
+
+COMMIT;
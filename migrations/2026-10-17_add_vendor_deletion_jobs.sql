@@ -0,0 +1,27 @@
+-- Background vendor deletion (vendor_deletion.py). Each batch commits on its own and bumps
+-- the counters in the same transaction, so progress is exact and a crashed job resumes
+-- where it stopped once its lease expires.
+CREATE TABLE IF NOT EXISTS public.vendor_deletion_jobs (
+  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  vendor_id uuid NOT NULL,
+  status text NOT NULL DEFAULT 'queued' CHECK (status IN ('queued','running','done','failed')),
+  stage text,
+  payment_links_deleted int NOT NULL DEFAULT 0,
+  invoice_lines_deleted int NOT NULL DEFAULT 0,
+  invoices_deleted int NOT NULL DEFAULT 0,
+  po_lines_deleted int NOT NULL DEFAULT 0,
+  purchase_orders_deleted int NOT NULL DEFAULT 0,
+  vendors_deleted int NOT NULL DEFAULT 0,
+  attempts int NOT NULL DEFAULT 0,
+  last_error text,
+  locked_by text,
+  locked_at timestamptz,
+  created_at timestamptz DEFAULT now(),
+  updated_at timestamptz DEFAULT now(),
+  finished_at timestamptz
+);
+
+-- One live job per vendor; a repeated DELETE returns the existing job
+CREATE UNIQUE INDEX IF NOT EXISTS uq_vendor_deletion_jobs_active
+  ON public.vendor_deletion_jobs(vendor_id) WHERE status IN ('queued','running');
+
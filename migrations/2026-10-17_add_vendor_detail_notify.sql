@@ -0,0 +1,50 @@
+-- Tell every process which vendor's detail payload changed (vendor_db per-vendor cache).
+-- Row-level so the payload can carry the vendor id; identical payloads are folded into one
+-- notification per transaction, so bulk writes notify once per vendor.
+CREATE OR REPLACE FUNCTION public.notify_vendor_detail_changed() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP <> 'INSERT' AND OLD.vendor_id IS NOT NULL THEN
+    PERFORM pg_notify('vendor_detail_changed', OLD.vendor_id::text);
+  END IF;
+  IF TG_OP <> 'DELETE' AND NEW.vendor_id IS NOT NULL THEN
+    PERFORM pg_notify('vendor_detail_changed', NEW.vendor_id::text);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Invoices: ingest, matching and payments (which move invoice status) all land here
+DROP TRIGGER IF EXISTS trg_invoices_vendor_detail_insert_delete ON public.invoices;
+CREATE TRIGGER trg_invoices_vendor_detail_insert_delete
+  AFTER INSERT OR DELETE ON public.invoices
+  FOR EACH ROW EXECUTE FUNCTION public.notify_vendor_detail_changed();
+
+DROP TRIGGER IF EXISTS trg_invoices_vendor_detail_update ON public.invoices;
+CREATE TRIGGER trg_invoices_vendor_detail_update
+  AFTER UPDATE ON public.invoices
+  FOR EACH ROW
+  WHEN (OLD.vendor_id IS DISTINCT FROM NEW.vendor_id
+     OR OLD.status IS DISTINCT FROM NEW.status
+     OR OLD.total_amount IS DISTINCT FROM NEW.total_amount
+     OR OLD.invoice_date IS DISTINCT FROM NEW.invoice_date
+     OR OLD.invoice_number IS DISTINCT FROM NEW.invoice_number
+     OR OLD.po_number IS DISTINCT FROM NEW.po_number
+     OR OLD.created_at IS DISTINCT FROM NEW.created_at)
+  EXECUTE FUNCTION public.notify_vendor_detail_changed();
+
+DROP TRIGGER IF EXISTS trg_purchase_orders_vendor_detail_insert_delete ON public.purchase_orders;
+CREATE TRIGGER trg_purchase_orders_vendor_detail_insert_delete
+  AFTER INSERT OR DELETE ON public.purchase_orders
+  FOR EACH ROW EXECUTE FUNCTION public.notify_vendor_detail_changed();
+
+DROP TRIGGER IF EXISTS trg_purchase_orders_vendor_detail_update ON public.purchase_orders;
+CREATE TRIGGER trg_purchase_orders_vendor_detail_update
+  AFTER UPDATE ON public.purchase_orders
+  FOR EACH ROW
+  WHEN (OLD.vendor_id IS DISTINCT FROM NEW.vendor_id
+     OR OLD.status IS DISTINCT FROM NEW.status
+     OR OLD.total_amount IS DISTINCT FROM NEW.total_amount
+     OR OLD.currency IS DISTINCT FROM NEW.currency
+     OR OLD.po_number IS DISTINCT FROM NEW.po_number
+     OR OLD.created_at IS DISTINCT FROM NEW.created_at)
+  EXECUTE FUNCTION public.notify_vendor_detail_changed();
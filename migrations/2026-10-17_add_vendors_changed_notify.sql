@@ -0,0 +1,13 @@
+-- Broadcast vendor table changes so each process can drop its in-memory vendor index.
+-- Covers writes made outside the app (imports, SQL console) as well.
+CREATE OR REPLACE FUNCTION public.notify_vendors_changed() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('vendors_changed', '');
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_vendors_changed ON public.vendors;
+CREATE TRIGGER trg_vendors_changed
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.vendors
+  FOR EACH STATEMENT EXECUTE FUNCTION public.notify_vendors_changed();
@@ -0,0 +1,138 @@
+import os
+import json
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+from dotenv import load_dotenv
+from db import get_conn
+
+load_dotenv()
+
+OCR_CACHE_TTL_DAYS = int(os.getenv("OCR_CACHE_TTL_DAYS", "90"))
+OCR_CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "50000"))
+
+STAGES = ("parse", "extract")
+
+_tables_ready = False
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, int]] = {
+    stage: {"hits": 0, "misses": 0, "stores": 0, "errors": 0} for stage in STAGES
+}
+_evictions = 0
+
+def _ensure_ocr_cache_tables(cur) -> None:
+    global _tables_ready
+    if _tables_ready:
+        return
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS public.ocr_cache (
+      stage text NOT NULL CHECK (stage IN ('parse','extract')),
+      content_hash text NOT NULL,
+      model text NOT NULL,
+      schema_version text NOT NULL DEFAULT '',
+      result jsonb NOT NULL,
+      hit_count bigint NOT NULL DEFAULT 0,
+      created_at timestamptz DEFAULT now(),
+      last_hit_at timestamptz DEFAULT now(),
+      PRIMARY KEY (stage, content_hash, model, schema_version)
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_hit_at ON public.ocr_cache(last_hit_at);")
+    _tables_ready = True
+
+def _bump(stage: str, key: str) -> None:
+    with _stats_lock:
+        _stats[stage][key] += 1
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+def get_cached_stage(stage: str, digest: str, model: str, schema_version: str = "") -> Optional[Any]:
+    """Return the stored result of a pipeline stage, or None.
+    parse is keyed by document hash and model; extract by parse-markdown hash, model and
+    schema version, so a schema change only invalidates extract results.
+    Entries past the TTL count as misses even before purge_ocr_cache removes them.
+    """
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                _ensure_ocr_cache_tables(cur)
+                cur.execute(
+                    """
+                    UPDATE ocr_cache
+                    SET hit_count = hit_count + 1, last_hit_at = now()
+                    WHERE stage = %s AND content_hash = %s AND model = %s AND schema_version = %s
+                      AND created_at >= now() - make_interval(days => %s)
+                    RETURNING result
+                    """,
+                    (stage, digest, model, schema_version, OCR_CACHE_TTL_DAYS)
+                )
+                row = cur.fetchone()
+    except Exception:
+        _bump(stage, "errors")
+        return None
+    if not row:
+        _bump(stage, "misses")
+        return None
+    _bump(stage, "hits")
+    result = row[0]
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result
+
+def store_cached_stage(stage: str, digest: str, model: str, result: Any, schema_version: str = "") -> None:
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                _ensure_ocr_cache_tables(cur)
+                cur.execute(
+                    """
+                    INSERT INTO ocr_cache(stage, content_hash, model, schema_version, result)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (stage, content_hash, model, schema_version) DO UPDATE
+                    SET result = EXCLUDED.result,
+                        created_at = now(),
+                        last_hit_at = now()
+                    """,
+                    (stage, digest, model, schema_version, json.dumps(result, ensure_ascii=False))
+                )
+        _bump(stage, "stores")
+    except Exception:
+        _bump(stage, "errors")
+
+def purge_ocr_cache() -> int:
+    """Drop expired entries, then trim least-recently-hit rows above OCR_CACHE_MAX_ENTRIES."""
+    global _evictions
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _ensure_ocr_cache_tables(cur)
+            cur.execute(
+                "DELETE FROM ocr_cache WHERE created_at < now() - make_interval(days => %s)",
+                (OCR_CACHE_TTL_DAYS,)
+            )
+            removed = cur.rowcount or 0
+            cur.execute(
+                """
+                DELETE FROM ocr_cache
+                WHERE (stage, content_hash, model, schema_version) IN (
+                    SELECT stage, content_hash, model, schema_version
+                    FROM ocr_cache
+                    ORDER BY last_hit_at DESC
+                    OFFSET %s
+                )
+                """,
+                (OCR_CACHE_MAX_ENTRIES,)
+            )
+            removed += cur.rowcount or 0
+    with _stats_lock:
+        _evictions += removed
+    return removed
+
+def get_ocr_cache_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats: Dict[str, Any] = {stage: dict(counts) for stage, counts in _stats.items()}
+        stats["evictions"] = _evictions
+    for stage in STAGES:
+        lookups = stats[stage]["hits"] + stats[stage]["misses"]
+        stats[stage]["hitRate"] = round(stats[stage]["hits"] / lookups, 4) if lookups else 0.0
+    return stats
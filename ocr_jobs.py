@@ -0,0 +1,275 @@
+import os
+import socket
+import threading
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+from db import get_conn
+from ocr_landingai import ocr_invoice_to_json
+from invoice_db import save_invoice_to_db
+from po_matching import match_invoice
+
+load_dotenv()
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "2"))
+OCR_WORKER_POLL_SECONDS = float(os.getenv("OCR_WORKER_POLL_SECONDS", "5"))
+OCR_JOB_LEASE_SECONDS = int(os.getenv("OCR_JOB_LEASE_SECONDS", "600"))
+OCR_JOB_MAX_ATTEMPTS = int(os.getenv("OCR_JOB_MAX_ATTEMPTS", "5"))
+OCR_JOB_RETRY_BASE_SECONDS = int(os.getenv("OCR_JOB_RETRY_BASE_SECONDS", "30"))
+
+PENDING_STATUSES = ("saved", "ocr", "persisted")
+
+_tables_ready = False
+_wakeup = threading.Event()
+_workers: List[threading.Thread] = []
+_workers_lock = threading.Lock()
+
+def _ensure_ocr_job_tables(cur) -> None:
+    global _tables_ready
+    if _tables_ready:
+        return
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS public.ocr_jobs (
+      id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+      file_path text NOT NULL,
+      from_email text,
+      message_id text,
+      vendor_id uuid,
+      status text NOT NULL DEFAULT 'saved' CHECK (status IN ('saved','ocr','persisted','matched','failed')),
+      fields_json_path text,
+      invoice_id uuid,
+      matched_po_id uuid,
+      attempts int NOT NULL DEFAULT 0,
+      last_error text,
+      locked_by text,
+      locked_at timestamptz,
+      available_at timestamptz NOT NULL DEFAULT now(),
+      created_at timestamptz DEFAULT now(),
+      updated_at timestamptz DEFAULT now()
+    );
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_ocr_jobs_pending ON public.ocr_jobs(created_at)
+      WHERE status IN ('saved','ocr','persisted');
+    """)
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_ocr_jobs_file_path ON public.ocr_jobs(file_path);")
+    _tables_ready = True
+
+def enqueue_ocr_job(file_path: str, from_email: Optional[str], message_id: str, vendor_id: Optional[str] = None) -> str:
+    """Queue a saved invoice file for OCR, persistence and matching. Returns the job id.
+
+    Idempotent on file_path: if the file already has a job, that job's id is returned.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _ensure_ocr_job_tables(cur)
+            cur.execute(
+                """
+                INSERT INTO ocr_jobs(file_path, from_email, message_id, vendor_id)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (file_path) DO NOTHING
+                RETURNING id
+                """,
+                (file_path, from_email, message_id, vendor_id)
+            )
+            row = cur.fetchone()
+            if row is None:
+                cur.execute("SELECT id FROM ocr_jobs WHERE file_path = %s", (file_path,))
+                return str(cur.fetchone()[0])
+            job_id = str(row[0])
+    _wakeup.set()
+    return job_id
+
+def claim_ocr_job(worker_name: str) -> Optional[Dict[str, Any]]:
+    """Lease the oldest runnable job. SKIP LOCKED keeps concurrent workers off the same row;
+    the lease (locked_at) lets another worker pick the job up if this one dies mid-OCR.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _ensure_ocr_job_tables(cur)
+            cur.execute(
+                """
+                UPDATE ocr_jobs
+                SET locked_by = %s, locked_at = now(), attempts = attempts + 1, updated_at = now()
+                WHERE id = (
+                    SELECT id FROM ocr_jobs
+                    WHERE status IN ('saved','ocr','persisted')
+                      AND available_at <= now()
+                      AND (locked_at IS NULL OR locked_at < now() - make_interval(secs => %s))
+                    ORDER BY created_at
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING id, file_path, from_email, message_id, vendor_id, status,
+                          fields_json_path, invoice_id, attempts
+                """,
+                (worker_name, OCR_JOB_LEASE_SECONDS)
+            )
+            row = cur.fetchone()
+            if not row:
+                return None
+            return {
+                "id": str(row[0]),
+                "filePath": row[1],
+                "fromEmail": row[2],
+                "messageId": row[3],
+                "vendorId": str(row[4]) if row[4] else None,
+                "status": row[5],
+                "fieldsJsonPath": row[6],
+                "invoiceId": str(row[7]) if row[7] else None,
+                "attempts": row[8],
+                "lockedBy": worker_name,
+            }
+
+class LeaseLost(Exception):
+    """The job's lease expired and another worker claimed it; this worker must stop."""
+
+def _advance(job_id: str, worker_name: str, status: str, **fields: Any) -> None:
+    """Record a finished stage and renew the lease, only while this worker still holds it."""
+    columns = {"fields_json_path", "invoice_id", "matched_po_id"}
+    sets = ["status = %s", "updated_at = now()", "last_error = NULL"]
+    params: List[Any] = [status]
+    for key, value in fields.items():
+        if key in columns:
+            sets.append(f"{key} = %s")
+            params.append(value)
+    if status not in PENDING_STATUSES:
+        sets.extend(["locked_by = NULL", "locked_at = NULL"])
+    else:
+        sets.append("locked_at = now()")
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"UPDATE ocr_jobs SET {', '.join(sets)} WHERE id = %s AND locked_by = %s",
+                (*params, job_id, worker_name)
+            )
+            if not cur.rowcount:
+                raise LeaseLost(job_id)
+
+def _renew_lease(job_id: str, worker_name: str) -> None:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE ocr_jobs SET locked_at = now(), updated_at = now() WHERE id = %s AND locked_by = %s",
+                (job_id, worker_name)
+            )
+            if not cur.rowcount:
+                raise LeaseLost(job_id)
+
+def _fail(job_id: str, worker_name: str, attempts: int, error: str) -> None:
+    """Release the lease and back off exponentially; give up after OCR_JOB_MAX_ATTEMPTS.
+    A job another worker has claimed meanwhile is left alone."""
+    delay = OCR_JOB_RETRY_BASE_SECONDS * (2 ** max(0, attempts - 1))
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE ocr_jobs
+                SET status = CASE WHEN %s >= %s THEN 'failed' ELSE status END,
+                    last_error = %s,
+                    locked_by = NULL,
+                    locked_at = NULL,
+                    available_at = now() + make_interval(secs => %s),
+                    updated_at = now()
+                WHERE id = %s AND locked_by = %s
+                """,
+                (attempts, OCR_JOB_MAX_ATTEMPTS, error[:2000], delay, job_id, worker_name)
+            )
+
+def process_ocr_job(job: Dict[str, Any]) -> None:
+    """Run a claimed job from its current stage to completion, recording each stage as it lands.
+    Stops as soon as the lease turns out to be lost, so two workers never both persist an invoice.
+    """
+    job_id = job["id"]
+    worker_name = job["lockedBy"]
+    status = job["status"]
+    fields_json_path = job.get("fieldsJsonPath")
+    invoice_id = job.get("invoiceId")
+    try:
+        if status == "saved":
+            fields_json_path = ocr_invoice_to_json(job["filePath"])
+            if not fields_json_path:
+                raise RuntimeError("OCR/parse skipped or failed (check VISION_AGENT_API_KEY and file)")
+            _advance(job_id, worker_name, "ocr", fields_json_path=fields_json_path)
+            status = "ocr"
+        if status == "ocr":
+            # OCR may have outlived the lease; check and renew it before writing the invoice
+            _renew_lease(job_id, worker_name)
+            invoice_id = save_invoice_to_db(fields_json_path, job["filePath"], job.get("fromEmail"), job.get("messageId") or "", job.get("vendorId"))
+            if not invoice_id:
+                raise RuntimeError("Failed to save invoice")
+            _advance(job_id, worker_name, "persisted", invoice_id=invoice_id)
+            status = "persisted"
+        if status == "persisted":
+            matched_po_id = match_invoice(invoice_id)
+            _advance(job_id, worker_name, "matched", matched_po_id=matched_po_id)
+    except LeaseLost:
+        return
+    except Exception as e:
+        _fail(job_id, worker_name, int(job.get("attempts") or 1), f"{status}: {e}")
+
+def get_ocr_job(job_id: str) -> Optional[Dict[str, Any]]:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _ensure_ocr_job_tables(cur)
+            cur.execute(
+                """
+                SELECT id, file_path, status, invoice_id, matched_po_id, attempts, last_error, created_at, updated_at
+                FROM ocr_jobs
+                WHERE id = %s
+                """,
+                (job_id,)
+            )
+            row = cur.fetchone()
+            if not row:
+                return None
+            return {
+                "id": str(row[0]),
+                "filePath": row[1],
+                "status": row[2],
+                "invoiceId": str(row[3]) if row[3] else None,
+                "matchedPoId": str(row[4]) if row[4] else None,
+                "attempts": row[5],
+                "lastError": row[6],
+                "createdAt": row[7].isoformat() if row[7] else None,
+                "updatedAt": row[8].isoformat() if row[8] else None,
+            }
+
+def get_ocr_queue_stats() -> Dict[str, Any]:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _ensure_ocr_job_tables(cur)
+            cur.execute("SELECT status, COUNT(*) FROM ocr_jobs GROUP BY status")
+            counts = {status: count for status, count in cur.fetchall()}
+    return {
+        "workers": sum(1 for t in _workers if t.is_alive()),
+        "byStatus": counts,
+        "pending": sum(counts.get(s, 0) for s in PENDING_STATUSES),
+    }
+
+def _worker_loop(worker_name: str) -> None:
+    while True:
+        try:
+            job = claim_ocr_job(worker_name)
+        except Exception:
+            job = None
+        if job is None:
+            _wakeup.wait(OCR_WORKER_POLL_SECONDS)
+            _wakeup.clear()
+            continue
+        try:
+            process_ocr_job(job)
+        except Exception:
+            # Failure handling itself hit the DB error; the lease expires and the job is retried
+            pass
+
+def start_ocr_workers(count: Optional[int] = None) -> int:
+    """Start the OCR worker threads for this process (idempotent). Returns the number running."""
+    count = OCR_WORKERS if count is None else count
+    with _workers_lock:
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        while len(_workers) < count:
+            name = f"{prefix}:ocr-{len(_workers) + 1}"
+            t = threading.Thread(target=_worker_loop, args=(name,), name=name, daemon=True)
+            t.start()
+            _workers.append(t)
+        return len(_workers)
@@ -1,33 +1,88 @@
 import os,json
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any,Dict,List,Optional
 from dotenv import load_dotenv
-from landingai_ade import LandingAIADE
 from landingai_ade.lib import pydantic_to_json_schema
-from invoice_schema import InvoiceExtract
+from invoice_schema import InvoiceExtract,INVOICE_SCHEMA_VERSION
+from ocr_cache import content_hash,get_cached_stage,store_cached_stage
+from ade_client import get_ade_client,ADE_MAX_IN_FLIGHT
 
 load_dotenv()
 
-def ocr_invoice_to_json(invoice_path:str)->str|None:
-    api_key=os.getenv("VISION_AGENT_API_KEY")
-    if not api_key:
-        return None
+def _write_json(path:Path,data)->None:
+    with open(path,"w",encoding="utf-8") as f:
+        json.dump(data,f,ensure_ascii=False,indent=2)
+
+def _model_name()->str:
+    return os.getenv("ADE_MODEL","dpt-2-latest")
+
+def parse_sidecar_path(invoice_path:str)->Path:
+    return Path(invoice_path).with_suffix(".parse.json")
+
+def fields_sidecar_path(invoice_path:str)->Path:
+    return Path(invoice_path).with_suffix(".fields.json")
+
+def parse_invoice(invoice_path:str)->str|None:
+    """Parse stage: document -> .parse.json sidecar (markdown + layout). Cached by file hash and model."""
     path=Path(invoice_path)
     if not path.exists():
         return None
-    model_name=os.getenv("ADE_MODEL","dpt-2-latest")
-    environment=os.getenv("ADE_ENVIRONMENT","production")
-    if environment.lower()=="eu":
-        client=LandingAIADE()
-    else:
-        client=LandingAIADE()
-    parse_response=client.parse(document=path,model=model_name)
-    parse_json_path=path.with_suffix(".parse.json")
-    with open(parse_json_path,"w",encoding="utf-8") as f:
-        json.dump(parse_response.to_dict(),f,ensure_ascii=False,indent=2)
-    schema=pydantic_to_json_schema(InvoiceExtract)
-    extract_response=client.extract(schema=schema,markdown=parse_response.markdown)
-    extract_data=extract_response.extraction
-    extract_json_path=path.with_suffix(".fields.json")
-    with open(extract_json_path,"w",encoding="utf-8") as f:
-        json.dump(extract_data,f,ensure_ascii=False,indent=2)
+    model_name=_model_name()
+    parse_json_path=parse_sidecar_path(invoice_path)
+    digest=content_hash(path.read_bytes())
+    parse_data=get_cached_stage("parse",digest,model_name)
+    if parse_data is None:
+        if not os.getenv("VISION_AGENT_API_KEY"):
+            return None
+        parse_response=get_ade_client().parse(document=path,model=model_name)
+        parse_data=parse_response.to_dict()
+        store_cached_stage("parse",digest,model_name,parse_data)
+    _write_json(parse_json_path,parse_data)
+    return str(parse_json_path)
+
+def _load_markdown(parse_json_path:str)->Optional[str]:
+    with open(parse_json_path,"r",encoding="utf-8") as f:
+        data:Dict[str,Any]=json.load(f)
+    markdown=data.get("markdown")
+    return markdown if isinstance(markdown,str) and markdown else None
+
+def extract_invoice_fields(parse_json_path:str,invoice_path:str)->str|None:
+    """Extract stage: stored parse markdown -> .fields.json with the current InvoiceExtract schema.
+    Never re-parses; cached by markdown hash, model and schema version.
+    """
+    markdown=_load_markdown(parse_json_path)
+    if not markdown:
+        return None
+    model_name=_model_name()
+    digest=content_hash(markdown.encode("utf-8"))
+    extract_data=get_cached_stage("extract",digest,model_name,INVOICE_SCHEMA_VERSION)
+    if extract_data is None:
+        if not os.getenv("VISION_AGENT_API_KEY"):
+            return None
+        schema=pydantic_to_json_schema(InvoiceExtract)
+        extract_response=get_ade_client().extract(schema=schema,markdown=markdown)
+        extract_data=extract_response.extraction
+        store_cached_stage("extract",digest,model_name,extract_data,INVOICE_SCHEMA_VERSION)
+    extract_json_path=fields_sidecar_path(invoice_path)
+    _write_json(extract_json_path,extract_data)
     return str(extract_json_path)
+
+def ocr_invoice_to_json(invoice_path:str)->str|None:
+    parse_json_path=parse_invoice(invoice_path)
+    if not parse_json_path:
+        return None
+    return extract_invoice_fields(parse_json_path,invoice_path)
+
+def ocr_invoices_to_json(invoice_paths:List[str],max_workers:Optional[int]=None)->Dict[str,Optional[str]]:
+    """OCR many files concurrently through the shared rate-limited client.
+    Returns {invoice_path: fields_json_path or None}; one failure does not stop the batch.
+    """
+    def _one(p:str)->Optional[str]:
+        try:
+            return ocr_invoice_to_json(p)
+        except Exception:
+            return None
+    workers=max(1,max_workers or ADE_MAX_IN_FLIGHT)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(invoice_paths,pool.map(_one,invoice_paths)))
@@ -8,6 +8,8 @@ import stripe
 load_dotenv()
 
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
+# A reservation (invoices payment_pending, no intent attached yet) older than this is released
+PAYMENT_RESERVATION_TIMEOUT_SECONDS = int(os.getenv("PAYMENT_RESERVATION_TIMEOUT_SECONDS", "600"))
 
 if STRIPE_SECRET_KEY:
     stripe.api_key = STRIPE_SECRET_KEY
@@ -43,6 +45,8 @@ def create_payment_intent_for_invoices(
     name = (customer.get("name") or "").strip()
     address = customer.get("address") or {}
 
+    # Phase 1: reserve the invoices (payment_pending) and record the payment in a short transaction.
+    # The row locks end at commit; the reservation itself keeps other payments off these invoices.
     with get_conn() as conn:
         with conn.cursor() as cur:
             _assert_payment_tables(cur)
@@ -63,7 +67,7 @@ def create_payment_intent_for_invoices(
 
             total = 0.0
             currencies = set()
-            allowed_status = {"matched_auto", "ready_for_payment"}
+            allowed_status = {"matched_auto", "partially_matched", "ready_for_payment"}
             for rid, amount, curr, status, vendor_id in rows:
                 if status in ("paid", "payment_pending"):
                     raise ValueError("One or more invoices are already paid or pending")
@@ -81,68 +85,121 @@ def create_payment_intent_for_invoices(
                 raise ValueError("Mixed currency selection is not allowed")
             final_currency = (list(currencies)[0] if currencies else (currency or "USD")).lower()
 
-            # Insert payment record
+            # Insert payment record; it has no intent yet
             cur.execute(
                 """
                 INSERT INTO payments(amount, currency, customer_email, status)
                 VALUES (%s, %s, %s, %s)
                 RETURNING id
                 """,
-                (total, final_currency, email or None, "requires_confirmation"),
+                (total, final_currency, email or None, "creating_intent"),
             )
             payment_id = cur.fetchone()[0]
 
             # Insert link rows, and set invoices to payment_pending
-            for rid, amount, curr, status, vendor_id in rows:
-                cur.execute(
-                    """
-                    INSERT INTO payment_invoices(payment_id, invoice_id, amount_applied, previous_status)
-                    VALUES (%s, %s, %s, %s)
-                    """,
-                    (payment_id, rid, amount, status),
-                )
-            # Update invoices only if still in allowed statuses
+            cur.executemany(
+                """
+                INSERT INTO payment_invoices(payment_id, invoice_id, amount_applied, previous_status)
+                VALUES (%s, %s, %s, %s)
+                """,
+                [(payment_id, rid, amount, status) for rid, amount, curr, status, vendor_id in rows],
+            )
             cur.execute(
                 """
                 UPDATE invoices
                 SET status = 'payment_pending'
-                WHERE id = ANY(%s) AND status IN ('matched_auto','ready_for_payment')
+                WHERE id = ANY(%s) AND status IN ('matched_auto','partially_matched','ready_for_payment')
                 """,
                 (invoice_ids,),
             )
 
-            # Prepare PaymentIntent
-            idemp_key = hashlib.sha256(("|".join(sorted(invoice_ids)) + "|" + (email or "") + f"|{total:.2f}|{final_currency}").encode()).hexdigest()
-            intent = stripe.PaymentIntent.create(
-                amount=_minor_units(total, final_currency),
-                currency=final_currency,
-                metadata={
-                    "invoice_ids": ",".join(invoice_ids),
-                    "payment_id": str(payment_id),
-                    "customer_email": email or "",
-                },
-                receipt_email=email or None,
-                setup_future_usage=("off_session" if save_method else None),
-                automatic_payment_methods={"enabled": True},
-                idempotency_key=idemp_key,
-            )
+    # Phase 2: create the PaymentIntent with no transaction open. The key is per reservation, so
+    # the client's own retries reuse one intent while a new attempt after a failure gets a new one.
+    idemp_key = hashlib.sha256((f"{payment_id}|" + "|".join(sorted(invoice_ids)) + "|" + (email or "") + f"|{total:.2f}|{final_currency}").encode()).hexdigest()
+    try:
+        intent = stripe.PaymentIntent.create(
+            amount=_minor_units(total, final_currency),
+            currency=final_currency,
+            metadata={
+                "invoice_ids": ",".join(invoice_ids),
+                "payment_id": str(payment_id),
+                "customer_email": email or "",
+            },
+            receipt_email=email or None,
+            setup_future_usage=("off_session" if save_method else None),
+            automatic_payment_methods={"enabled": True},
+            idempotency_key=idemp_key,
+        )
+    except Exception:
+        # Compensate: give the invoices back and close the payment
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                _release_payment(cur, payment_id, "failed")
+        raise
 
-            # Store intent id
+    # Phase 3: attach the intent id in a second short transaction
+    with get_conn() as conn:
+        with conn.cursor() as cur:
             cur.execute(
                 """
-                UPDATE payments SET stripe_payment_intent_id=%s WHERE id=%s
+                UPDATE payments SET stripe_payment_intent_id=%s, status=%s
+                WHERE id=%s AND status='creating_intent'
                 """,
-                (intent.id, payment_id),
+                (intent.id, "requires_confirmation", payment_id),
             )
+            attached = bool(cur.rowcount)
+    if not attached:
+        # The reservation was released meanwhile (timed out); do not hand out the intent
+        try:
+            stripe.PaymentIntent.cancel(intent.id)
+        except Exception:
+            pass
+        raise RuntimeError("Payment reservation expired; please retry")
+
+    return {
+        "paymentId": str(payment_id),
+        "clientSecret": intent.client_secret,
+        "paymentIntentId": intent.id,
+        "amount": total,
+        "currency": final_currency,
+        "invoiceIds": invoice_ids,
+    }
+
 
-            return {
-                "paymentId": str(payment_id),
-                "clientSecret": intent.client_secret,
-                "paymentIntentId": intent.id,
-                "amount": total,
-                "currency": final_currency,
-                "invoiceIds": invoice_ids,
-            }
+def _release_payment(cur, payment_id, status: str) -> None:
+    """Restore the invoices' pre-payment statuses (those still payment_pending) and set the payment status."""
+    cur.execute(
+        """
+        UPDATE invoices i
+        SET status = COALESCE(pi.previous_status, 'ready_for_payment')
+        FROM payment_invoices pi
+        WHERE pi.payment_id = %s AND i.id = pi.invoice_id AND i.status = 'payment_pending'
+        """,
+        (payment_id,),
+    )
+    cur.execute("UPDATE payments SET status=%s WHERE id=%s", (status, payment_id))
+
+
+def release_stale_payment_reservations(max_age_seconds: int = PAYMENT_RESERVATION_TIMEOUT_SECONDS) -> int:
+    """Release reservations whose intent was never attached (process died between the phases).
+    Any intent Stripe created for them was never handed to a client, so it cannot be confirmed.
+    """
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _assert_payment_tables(cur)
+            cur.execute(
+                """
+                SELECT id FROM payments
+                WHERE status = 'creating_intent'
+                  AND created_at < now() - make_interval(secs => %s)
+                FOR UPDATE SKIP LOCKED
+                """,
+                (max_age_seconds,),
+            )
+            stale = [r[0] for r in cur.fetchall()]
+            for payment_id in stale:
+                _release_payment(cur, payment_id, "failed")
+    return len(stale)
 
 
 def mark_payment_succeeded(payment_intent_id: str) -> None:
@@ -170,12 +227,8 @@ def mark_payment_failed_or_canceled(payment_intent_id: str) -> None:
             row = cur.fetchone()
             if not row:
                 return
-            payment_id = row[0]
             # Revert invoice statuses
-            cur.execute("SELECT invoice_id, previous_status FROM payment_invoices WHERE payment_id=%s", (payment_id,))
-            for inv_id, prev in cur.fetchall():
-                cur.execute("UPDATE invoices SET status=%s WHERE id=%s", (prev or 'ready_for_payment', inv_id))
-            cur.execute("UPDATE payments SET status='failed' WHERE id=%s", (payment_id,))
+            _release_payment(cur, row[0], "failed")
 
 
 def confirm_payment_intent(payment_intent_id: str) -> Dict[str, Any]:
@@ -0,0 +1,336 @@
+"""Many-to-many invoice/PO allocation against open PO balances.
+
+Unmatched invoices are grouped with open POs by vendor and currency. An invoice that
+quotes a PO number consumes part of that PO's remaining balance; otherwise the solver
+looks for a small set of POs whose remaining balances add up to the invoice amount
+within tolerance (bounded subset-sum, pair sums + bisect). Consumed balance is recorded
+in po_allocations and POs move to partially_received / closed. Amounts adding up is weak
+evidence on its own, so only a quoted PO billed in full is applied; the rest are stored as
+suggested allocations on needs_review invoices.
+"""
+import os
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from db import get_conn
+from db_events import notify
+from invoice_db import INVOICES_CHANNEL
+from line_matching import BILLED_STATUSES
+
+ALLOC_MAX_POS_PER_INVOICE = int(os.getenv("ALLOC_MAX_POS_PER_INVOICE", "3"))
+# Four-way combinations only for small groups; pair-of-pairs search is O(n^2 log n) per invoice
+ALLOC_FOUR_WAY_MAX_POS = int(os.getenv("ALLOC_FOUR_WAY_MAX_POS", "80"))
+ALLOC_TIME_BUDGET_SECONDS = float(os.getenv("ALLOC_TIME_BUDGET_SECONDS", "10"))
+
+_ALLOCATION_LOCK_KEY = 0x616c_6c6f_6361_74
+
+def _cents(value) -> int:
+    return int(round(float(value) * 100))
+
+def _tolerance_cents(amount_cents: int, amount_tolerance: float, percent_tolerance: float) -> int:
+    return max(_cents(amount_tolerance), int(abs(amount_cents) * percent_tolerance))
+
+class _PairIndex:
+    """All pair sums of a balance list, sorted, for O(log n) lookups of two-PO combinations."""
+
+    def __init__(self, balances: Sequence[int]):
+        pairs = [(balances[i] + balances[j], i, j) for i in range(len(balances)) for j in range(i + 1, len(balances))]
+        pairs.sort()
+        self.sums = [p[0] for p in pairs]
+        self.pairs = pairs
+
+    def within(self, lo: int, hi: int):
+        k = bisect_left(self.sums, lo)
+        while k < len(self.sums) and self.sums[k] <= hi:
+            yield self.pairs[k]
+            k += 1
+
+def find_po_subset(balances: Sequence[int], target: int, tolerance: int, usable: Sequence[bool],
+                   max_size: int = ALLOC_MAX_POS_PER_INVOICE, deadline: Optional[float] = None,
+                   pair_index: Optional[_PairIndex] = None) -> Optional[List[int]]:
+    """Indexes of at most max_size usable balances summing to target +/- tolerance.
+    Prefers fewer POs, then the smallest difference. Gives up (None) at the deadline.
+    """
+    n = len(balances)
+    lo, hi = target - tolerance, target + tolerance
+
+    # One PO
+    best = None
+    for i in range(n):
+        if usable[i] and lo <= balances[i] <= hi:
+            if best is None or abs(balances[i] - target) < best[1]:
+                best = ([i], abs(balances[i] - target))
+    if best or max_size < 2:
+        return best[0] if best else None
+
+    pairs = pair_index or _PairIndex(balances)
+    # Two POs
+    for total, i, j in pairs.within(lo, hi):
+        if usable[i] and usable[j] and (best is None or abs(total - target) < best[1]):
+            best = ([i, j], abs(total - target))
+    if best or max_size < 3:
+        return best[0] if best else None
+
+    # Three POs: one balance plus a pair
+    for i in range(n):
+        if deadline is not None and time.monotonic() > deadline:
+            return None
+        if not usable[i] or balances[i] > hi:
+            continue
+        for total, a, b in pairs.within(lo - balances[i], hi - balances[i]):
+            if a != i and b != i and usable[a] and usable[b]:
+                diff = abs(total + balances[i] - target)
+                if best is None or diff < best[1]:
+                    best = ([i, a, b], diff)
+    if best or max_size < 4 or n > ALLOC_FOUR_WAY_MAX_POS:
+        return best[0] if best else None
+
+    # Four POs: pair of pairs
+    for total, i, j in pairs.pairs:
+        if deadline is not None and time.monotonic() > deadline:
+            return None
+        if total > hi:
+            break
+        if not (usable[i] and usable[j]):
+            continue
+        for total2, a, b in pairs.within(lo - total, hi - total):
+            if len({i, j, a, b}) == 4 and usable[a] and usable[b]:
+                diff = abs(total + total2 - target)
+                if best is None or diff < best[1]:
+                    best = ([i, j, a, b], diff)
+    return best[0] if best else None
+
+def _load(cur):
+    """Open POs with remaining balance and unmatched invoices, grouped by (vendor, currency)."""
+    cur.execute(
+        """
+        WITH consumed AS (
+            SELECT po_id, SUM(amount) AS amount FROM po_allocations WHERE NOT suggested GROUP BY po_id
+            UNION ALL
+            -- Header matches made before allocations existed, or by match_invoice, also use up balance.
+            -- Only billing statuses count: a needs_review near-miss or vendor_mismatch invoice also
+            -- carries matched_po_id, but like a suggested allocation it consumes nothing.
+            SELECT i.matched_po_id, SUM(i.total_amount)
+            FROM invoices i
+            WHERE i.matched_po_id IS NOT NULL
+              AND i.status = ANY(%s)
+              AND NOT EXISTS (SELECT 1 FROM po_allocations a WHERE a.invoice_id = i.id AND NOT a.suggested)
+            GROUP BY i.matched_po_id
+        )
+        SELECT p.id, p.vendor_id, upper(coalesce(p.currency, 'USD')), p.po_number_norm,
+               p.total_amount - coalesce((SELECT SUM(c.amount) FROM consumed c WHERE c.po_id = p.id), 0)
+        FROM purchase_orders p
+        WHERE p.status IN ('open','partially_received')
+          AND p.vendor_id IS NOT NULL
+          AND p.total_amount IS NOT NULL
+        ORDER BY p.id
+        """,
+        (BILLED_STATUSES,)
+    )
+    groups: Dict[Tuple[str, str], Dict[str, List[Any]]] = {}
+    for po_id, vendor_id, currency, po_norm, remaining in cur.fetchall():
+        if remaining is None or remaining <= 0:
+            continue
+        g = groups.setdefault((str(vendor_id), currency), {"pos": [], "invoices": []})
+        g["pos"].append({"id": po_id, "norm": po_norm, "remaining": _cents(remaining)})
+    if not groups:
+        return groups
+    cur.execute(
+        """
+        SELECT id, vendor_id, upper(coalesce(currency, 'USD')), po_number_norm, total_amount
+        FROM invoices
+        WHERE status = 'unmatched'
+          AND vendor_id IS NOT NULL
+          AND total_amount > 0
+        ORDER BY created_at NULLS LAST, id
+        """
+    )
+    for inv_id, vendor_id, currency, po_norm, total in cur.fetchall():
+        g = groups.get((str(vendor_id), currency))
+        if g is not None:
+            g["invoices"].append({"id": inv_id, "norm": po_norm, "amount": _cents(total)})
+    return groups
+
+def _subset_confidence(amount: int, diff: int, size: int) -> float:
+    """Amount agreement (as in select_best_po) halved for every PO in the combination. Random balances
+    add up to almost any amount within tolerance, so a sum alone is never more than a suggestion."""
+    agreement = max(0.0, 1.0 - min(1.0, diff / max(100, abs(amount))))
+    return round(agreement * 0.5 ** size, 4)
+
+def _allocate_group(group: Dict[str, List[Any]], amount_tolerance: float, percent_tolerance: float,
+                    deadline: float) -> List[Tuple[Any, List[Tuple[Any, int]], str, float]]:
+    """[(invoice_id, [(po_id, cents), ...], status, confidence), ...] for the invoices this group can cover.
+    Only an invoice that quotes a PO and bills its whole remaining balance is matched_auto; partial
+    bills and subset-sum combinations are needs_review suggestions.
+    """
+    pos = group["pos"]
+    balances = [p["remaining"] for p in pos]
+    # A PO already billed or suggested this run drops out of subset search (pair sums are precomputed)
+    usable = [True] * len(pos)
+    by_norm: Dict[str, List[int]] = {}
+    for k, p in enumerate(pos):
+        if p["norm"]:
+            by_norm.setdefault(p["norm"], []).append(k)
+    pair_index = _PairIndex(balances) if ALLOC_MAX_POS_PER_INVOICE >= 2 and len(pos) >= 2 else None
+    results = []
+    for inv in group["invoices"]:
+        if time.monotonic() > deadline:
+            break
+        amount = inv["amount"]
+        tol = _tolerance_cents(amount, amount_tolerance, percent_tolerance)
+        # Quoted PO with enough balance left: bill against it (smallest sufficient balance first)
+        quoted = [k for k in by_norm.get(inv["norm"] or "", []) if balances[k] >= amount - tol]
+        if quoted:
+            k = min(quoted, key=lambda q: balances[q])
+            take = min(amount, balances[k])
+            diff = abs(balances[k] - amount)
+            usable[k] = False
+            if diff <= tol:
+                confidence = round(max(0.0, 1.0 - min(1.0, diff / max(100, abs(amount)))), 4)
+                results.append((inv["id"], [(pos[k]["id"], take)], "matched_auto", confidence))
+                balances[k] -= take
+            else:
+                # Part of the balance only; without a line check this is for a reviewer to confirm
+                results.append((inv["id"], [(pos[k]["id"], take)], "needs_review", round(0.5 * take / balances[k], 4)))
+            continue
+        subset = find_po_subset(balances, amount, tol, usable, deadline=deadline, pair_index=pair_index)
+        if not subset:
+            continue
+        diff = abs(sum(balances[k] for k in subset) - amount)
+        left = amount
+        parts = []
+        for k in sorted(subset, key=lambda q: -balances[q]):
+            take = min(left, balances[k])
+            if take <= 0:
+                continue
+            parts.append((pos[k]["id"], take))
+            # Suggestions consume nothing, but one run does not suggest the same PO twice
+            usable[k] = False
+            left -= take
+        results.append((inv["id"], parts, "needs_review", _subset_confidence(amount, diff, len(subset))))
+    return results
+
+def allocate_unmatched_invoices(amount_tolerance: float = 1.0, percent_tolerance: float = 0.02,
+                                time_budget_seconds: float = ALLOC_TIME_BUDGET_SECONDS) -> Dict[str, Any]:
+    """Allocate unmatched invoices to open PO balances, one transaction per run.
+    A quoted PO billed in full makes the invoice matched_auto and consumes the balance: the PO moves
+    to partially_received, or closed once its balance is within tolerance of zero. Everything else
+    becomes needs_review with suggested allocation rows that consume nothing.
+    Invoices whose status changed since the read are left alone, and so are their POs.
+    """
+    started = time.monotonic()
+    deadline = started + time_budget_seconds
+    summary: Dict[str, Any] = {"groups": 0, "invoices": 0, "allocated": 0, "suggested": 0, "allocations": 0, "skipped": False}
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (_ALLOCATION_LOCK_KEY,))
+            if not cur.fetchone()[0]:
+                summary["skipped"] = True
+                return summary
+            groups = _load(cur)
+            parts_by_invoice: Dict[Any, List[Tuple[Any, int]]] = {}
+            invoice_ids: List[Any] = []
+            po_ids: List[Any] = []
+            statuses: List[str] = []
+            confidences: List[float] = []
+            remaining: Dict[Any, int] = {}
+            for group in groups.values():
+                if not group["invoices"]:
+                    continue
+                summary["groups"] += 1
+                summary["invoices"] += len(group["invoices"])
+                for p in group["pos"]:
+                    remaining[p["id"]] = p["remaining"]
+                for inv_id, parts, status, confidence in _allocate_group(group, amount_tolerance, percent_tolerance, deadline):
+                    parts_by_invoice[inv_id] = parts
+                    invoice_ids.append(inv_id)
+                    po_ids.append(max(parts, key=lambda p: p[1])[0])
+                    statuses.append(status)
+                    confidences.append(confidence)
+            summary["timedOut"] = time.monotonic() > deadline
+            if invoice_ids:
+                # Claim the invoices first; one matched meanwhile (e.g. by rematch) keeps its match
+                cur.execute(
+                    """
+                    UPDATE invoices i
+                    SET matched_po_id = u.po_id, status = u.status, confidence = u.confidence
+                    FROM unnest(%s::uuid[], %s::uuid[], %s::text[], %s::float8[])
+                         AS u(invoice_id, po_id, status, confidence)
+                    WHERE i.id = u.invoice_id AND i.status = 'unmatched'
+                    RETURNING i.id, i.status
+                    """,
+                    (invoice_ids, po_ids, statuses, confidences)
+                )
+                applied = cur.fetchall()
+                rows = [
+                    (inv_id, po_id, cents / 100.0, status != "matched_auto")
+                    for inv_id, status in applied
+                    for po_id, cents in parts_by_invoice[inv_id]
+                ]
+                if rows:
+                    cur.executemany(
+                        """
+                        INSERT INTO po_allocations(invoice_id, po_id, amount, suggested)
+                        VALUES (%s, %s, %s, %s)
+                        ON CONFLICT (invoice_id, po_id) DO UPDATE SET amount = EXCLUDED.amount, suggested = EXCLUDED.suggested
+                        """,
+                        rows
+                    )
+                consumed: Dict[Any, int] = {}
+                for inv_id, status in applied:
+                    if status == "matched_auto":
+                        for po_id, cents in parts_by_invoice[inv_id]:
+                            consumed[po_id] = consumed.get(po_id, 0) + cents
+                close_cents = _cents(amount_tolerance)
+                closed = [po_id for po_id, cents in consumed.items() if remaining[po_id] - cents <= close_cents]
+                partial = [po_id for po_id, cents in consumed.items() if remaining[po_id] - cents > close_cents]
+                cur.execute("UPDATE purchase_orders SET status = 'closed' WHERE id = ANY(%s)", (closed,))
+                cur.execute(
+                    "UPDATE purchase_orders SET status = 'partially_received' WHERE id = ANY(%s) AND status = 'open'",
+                    (partial,)
+                )
+                summary["allocated"] = sum(1 for _inv, status in applied if status == "matched_auto")
+                summary["suggested"] = len(applied) - summary["allocated"]
+                summary["allocations"] = len(rows)
+                summary["posClosed"] = len(closed)
+                summary["posPartiallyReceived"] = len(partial)
+                if applied:
+                    notify(cur, INVOICES_CHANNEL, "")
+    summary["elapsedMs"] = round((time.monotonic() - started) * 1000, 1)
+    return summary
+
+def get_po_allocations(po_id: str) -> Dict[str, Any]:
+    """Allocated and suggested invoices and remaining balance for one PO (suggestions do not reduce it)."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT a.invoice_id, i.invoice_number, a.amount, a.created_at, a.suggested
+                FROM po_allocations a
+                JOIN invoices i ON i.id = a.invoice_id
+                WHERE a.po_id = %s
+                ORDER BY a.created_at, a.invoice_id
+                """,
+                (po_id,)
+            )
+            rows = cur.fetchall()
+            cur.execute("SELECT total_amount FROM purchase_orders WHERE id = %s", (po_id,))
+            po = cur.fetchone()
+    allocated = sum(float(r[2] or 0) for r in rows if not r[4])
+    total = float(po[0]) if po and po[0] is not None else 0.0
+    return {
+        "poId": po_id,
+        "totalAmount": total,
+        "allocatedAmount": round(allocated, 2),
+        "remainingAmount": round(total - allocated, 2),
+        "allocations": [
+            {
+                "invoiceId": str(r[0]),
+                "invoiceNumber": r[1] or "",
+                "amount": float(r[2]) if r[2] is not None else 0.0,
+                "createdAt": r[3].isoformat() if r[3] else None,
+                "suggested": bool(r[4]),
+            }
+            for r in rows
+        ],
+    }
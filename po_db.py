@@ -1,9 +1,20 @@
 from typing import Optional, Dict, Any, List
-from db import get_conn
+from db import get_conn, uuid_list
 
 
 def get_po_by_id(po_id: str) -> Optional[Dict[str, Any]]:
     """Fetch a purchase order by id with optional line items if available."""
+    pos = get_pos_by_ids([po_id])
+    return pos[0] if pos else None
+
+
+def get_pos_by_ids(po_ids: List[str]) -> List[Dict[str, Any]]:
+    """Fetch many purchase orders with their line items in two queries.
+    Returned in the order requested; unknown or malformed ids are skipped.
+    """
+    ids = uuid_list(po_ids)
+    if not ids:
+        return []
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute(
@@ -12,65 +23,63 @@ def get_po_by_id(po_id: str) -> Optional[Dict[str, Any]]:
                        shipping_method, shipping_terms, delivery_date_expected, payment_terms, currency,
                        subtotal_amount, tax_amount, shipping_amount, total_amount, status, created_at
                 FROM purchase_orders
-                WHERE id = %s
-                LIMIT 1
+                WHERE id = ANY(%s)
                 """,
-                (po_id,)
+                (ids,)
             )
-            row = cur.fetchone()
-            if not row:
-                return None
+            rows = cur.fetchall()
+            if not rows:
+                return []
 
-            result: Dict[str, Any] = {
-                "id": str(row[0]),
-                "poNumber": row[1] or "",
-                "vendorId": str(row[2]) if row[2] is not None else None,
-                "buyerCompanyName": row[3] or "",
-                "billToAddress": row[4] or "",
-                "shipToAddress": row[5] or "",
-                "shippingMethod": row[6] or "",
-                "shippingTerms": row[7] or "",
-                "deliveryDateExpected": row[8].isoformat() if row[8] else None,
-                "paymentTerms": row[9] or "",
-                "currency": row[10] or "USD",
-                "subtotalAmount": float(row[11]) if row[11] is not None else 0.0,
-                "taxAmount": float(row[12]) if row[12] is not None else 0.0,
-                "shippingAmount": float(row[13]) if row[13] is not None else 0.0,
-                "totalAmount": float(row[14]) if row[14] is not None else 0.0,
-                "status": row[15] or "",
-                "createdAt": row[16].isoformat() if row[16] else None,
-                "lines": []  # will populate below if table exists
-            }
+            by_id: Dict[str, Dict[str, Any]] = {}
+            for row in rows:
+                by_id[str(row[0])] = {
+                    "id": str(row[0]),
+                    "poNumber": row[1] or "",
+                    "vendorId": str(row[2]) if row[2] is not None else None,
+                    "buyerCompanyName": row[3] or "",
+                    "billToAddress": row[4] or "",
+                    "shipToAddress": row[5] or "",
+                    "shippingMethod": row[6] or "",
+                    "shippingTerms": row[7] or "",
+                    "deliveryDateExpected": row[8].isoformat() if row[8] else None,
+                    "paymentTerms": row[9] or "",
+                    "currency": row[10] or "USD",
+                    "subtotalAmount": float(row[11]) if row[11] is not None else 0.0,
+                    "taxAmount": float(row[12]) if row[12] is not None else 0.0,
+                    "shippingAmount": float(row[13]) if row[13] is not None else 0.0,
+                    "totalAmount": float(row[14]) if row[14] is not None else 0.0,
+                    "status": row[15] or "",
+                    "createdAt": row[16].isoformat() if row[16] else None,
+                    "lines": []  # will populate below if table exists
+                }
 
             # Load PO line items per schema: purchase_order_lines.po_id and quantity_ordered
             try:
                 cur.execute(
                     """
-                    SELECT line_number, sku, description, quantity_ordered, unit_of_measure,
+                    SELECT po_id, line_number, sku, description, quantity_ordered, unit_of_measure,
                            unit_price, line_total, tax_rate, tax_code
                     FROM purchase_order_lines
-                    WHERE po_id = %s
-                    ORDER BY COALESCE(line_number, 0)
+                    WHERE po_id = ANY(%s)
+                    ORDER BY po_id, COALESCE(line_number, 0)
                     """,
-                    (po_id,)
+                    ([r[0] for r in rows],)
                 )
-                rows = cur.fetchall()
-                lines: List[Dict[str, Any]] = []
-                for lr in rows:
-                    lines.append({
-                        "line_number": lr[0],
-                        "sku": lr[1],
-                        "description": lr[2],
-                        "quantity": float(lr[3]) if lr[3] is not None else None,
-                        "unit_of_measure": lr[4],
-                        "unit_price": float(lr[5]) if lr[5] is not None else None,
-                        "line_total": float(lr[6]) if lr[6] is not None else None,
-                        "tax_rate": float(lr[7]) if lr[7] is not None else None,
-                        "tax_code": lr[8],
+                for lr in cur.fetchall():
+                    by_id[str(lr[0])]["lines"].append({
+                        "line_number": lr[1],
+                        "sku": lr[2],
+                        "description": lr[3],
+                        "quantity": float(lr[4]) if lr[4] is not None else None,
+                        "unit_of_measure": lr[5],
+                        "unit_price": float(lr[6]) if lr[6] is not None else None,
+                        "line_total": float(lr[7]) if lr[7] is not None else None,
+                        "tax_rate": float(lr[8]) if lr[8] is not None else None,
+                        "tax_code": lr[9],
                     })
-                result["lines"] = lines
             except Exception:
                 # Table or columns may not exist; ignore silently
                 pass
 
-            return result
+    return [by_id[str(i)] for i in ids if str(i) in by_id]
@@ -0,0 +1,106 @@
+"""PO number normalization and near-miss lookup.
+
+normalize_po_number mirrors public.normalize_po_number (see the add_po_number_norm
+migration), which backs the generated po_number_norm columns on purchase_orders
+and invoices.
+"""
+import os
+import re
+from typing import Any, Dict, List, Optional
+from db import get_conn
+
+PO_FUZZY_MIN_CONFIDENCE = float(os.getenv("PO_FUZZY_MIN_CONFIDENCE", "0.75"))
+PO_FUZZY_CANDIDATES = int(os.getenv("PO_FUZZY_CANDIDATES", "5"))
+
+_NON_ALNUM = re.compile(r"[^A-Za-z0-9]")
+# Only a prefix followed by a digit: "NOV2025-01" and "POL-001" are numbers in their own right
+_PREFIX = re.compile(r"^(PURCHASEORDER|PO)?(NUMBER|NO|NR)?(?=[0-9])")
+
+def normalize_po_number(value: Optional[str]) -> Optional[str]:
+    """Strip punctuation, whitespace and a leading PO / PO No. prefix, fold case."""
+    compact = _NON_ALNUM.sub("", value or "").upper()
+    return _PREFIX.sub("", compact, count=1) or None
+
+def _edit_distance(a: str, b: str) -> int:
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+def po_number_confidence(a: Optional[str], b: Optional[str]) -> float:
+    """1.0 for equal normalized numbers, falling with edit distance relative to length."""
+    na, nb = normalize_po_number(a), normalize_po_number(b)
+    if not na or not nb:
+        return 0.0
+    return max(0.0, 1.0 - _edit_distance(na, nb) / max(len(na), len(nb)))
+
+def find_po_candidates(cur, po_number: Optional[str], limit: int = PO_FUZZY_CANDIDATES,
+                       min_confidence: float = PO_FUZZY_MIN_CONFIDENCE) -> List[Dict[str, Any]]:
+    """Open/partially_received POs ranked by closeness of their normalized PO number.
+    Exact normalized matches come first (confidence 1.0); otherwise the trigram index
+    supplies nearest neighbours, re-ranked by edit distance. Runs on the caller's cursor.
+    """
+    norm = normalize_po_number(po_number)
+    if not norm:
+        return []
+    cur.execute(
+        """
+        SELECT id, po_number, po_number_norm, total_amount, currency, vendor_id
+        FROM purchase_orders
+        WHERE po_number_norm = %s
+          AND status IN ('open','partially_received')
+        ORDER BY id
+        """,
+        (norm,)
+    )
+    rows = cur.fetchall()
+    if not rows:
+        cur.execute(
+            """
+            SELECT id, po_number, po_number_norm, total_amount, currency, vendor_id
+            FROM purchase_orders
+            WHERE status IN ('open','partially_received')
+              AND po_number_norm IS NOT NULL
+            ORDER BY po_number_norm <-> %s, id
+            LIMIT %s
+            """,
+            (norm, max(limit * 4, limit))
+        )
+        rows = cur.fetchall()
+    out = []
+    for po_id, po_num, po_norm, total, currency, vendor_id in rows:
+        confidence = po_number_confidence(norm, po_norm)
+        if confidence < min_confidence:
+            continue
+        out.append({
+            "poId": po_id,
+            "poNumber": po_num,
+            "confidence": round(confidence, 3),
+            "exact": po_norm == norm,
+            "totalAmount": total,
+            "currency": currency,
+            "vendorId": vendor_id,
+        })
+    out.sort(key=lambda c: (-c["confidence"], str(c["poId"])))
+    return out[:limit]
+
+def lookup_po_number(po_number: str, limit: int = PO_FUZZY_CANDIDATES) -> List[Dict[str, Any]]:
+    """find_po_candidates on its own connection, JSON-ready."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            candidates = find_po_candidates(cur, po_number, limit=limit, min_confidence=0.0)
+    return [
+        {
+            "id": str(c["poId"]),
+            "poNumber": c["poNumber"] or "",
+            "confidence": c["confidence"],
+            "exact": c["exact"],
+            "totalAmount": float(c["totalAmount"]) if c["totalAmount"] is not None else 0.0,
+            "currency": c["currency"] or "USD",
+            "vendorId": str(c["vendorId"]) if c["vendorId"] else None,
+        }
+        for c in candidates
+    ]
@@ -1,59 +1,334 @@
-from typing import Optional
+import os
+import threading
+import time
+from typing import Any,Dict,Iterable,List,Optional,Tuple
 from db import get_conn
+from db_events import notify,subscribe,start_listener
+from invoice_db import INVOICES_CHANNEL
+from po_lookup import find_po_candidates
+from line_matching import match_invoice_lines,match_lines,line_match_status,load_invoice_lines,load_po_lines,save_line_reports,load_billed_quantities,record_billed
 
-def match_invoice(invoice_id:str,amount_tolerance:float=1.0,percent_tolerance:float=0.02)->Optional[str]:
+REMATCH_INTERVAL_MINUTES=int(os.getenv("REMATCH_INTERVAL_MINUTES","15"))
+# Two schedulers (e.g. several app workers) must not rematch at the same time
+_REMATCH_LOCK_KEY=0x7265_6d61_7463_68
+
+# Fed by triggers on purchase_orders / purchase_order_lines (see the add_po_match_queue migration)
+PURCHASE_ORDERS_CHANNEL="purchase_orders_changed"
+PO_MATCH_QUEUE_BATCH=int(os.getenv("PO_MATCH_QUEUE_BATCH","100"))
+# Fallback poll for notifications missed while the listener was reconnecting
+PO_MATCH_POLL_SECONDS=float(os.getenv("PO_MATCH_POLL_SECONDS","30"))
+
+_po_wakeup=threading.Event()
+_po_worker:Optional[threading.Thread]=None
+_po_worker_lock=threading.Lock()
+
+# Open POs quoting an invoice's normalized PO number (also EXPLAINed by check_query_plans.py)
+_PO_CANDIDATES_SQL="""
+    select id,total_amount,currency,vendor_id
+    from purchase_orders
+    where po_number_norm=%s
+      and status in ('open','partially_received')
+    order by id
+"""
+
+def select_best_po(inv_total,inv_currency,inv_vendor_id,candidates:Iterable[Tuple[Any,Any,Any,Any]],amount_tolerance:float=1.0,percent_tolerance:float=0.02)->Optional[Tuple[Any,float]]:
+    """Pick the PO whose total is closest to the invoice total.
+    candidates are (po_id,po_total,po_currency,po_vendor_id) already filtered by PO number and status.
+    Currency and vendor must agree when both sides have one. The difference must be within
+    amount_tolerance or within percent_tolerance of the invoice total.
+    Returns (po_id,confidence) or None.
+    """
+    best_po_id=None
+    best_diff=None
+    for po_id,po_total,po_currency,po_vendor_id in candidates:
+        if po_total is None:
+            continue
+        if inv_currency and po_currency and inv_currency!=po_currency:
+            continue
+        if inv_vendor_id and po_vendor_id and inv_vendor_id!=po_vendor_id:
+            continue
+        diff=abs(float(inv_total)-float(po_total))
+        if best_diff is None or diff<best_diff:
+            best_diff=diff
+            best_po_id=po_id
+    if best_po_id is None or best_diff is None:
+        return None
+    if best_diff>amount_tolerance and best_diff>abs(float(inv_total))*percent_tolerance:
+        return None
+    confidence=max(0.0,1.0-min(1.0,best_diff/max(1.0,abs(float(inv_total)))))
+    return best_po_id,confidence
+
+def _fuzzy_po_match(cur,inv_po_number,inv_total,inv_currency,inv_vendor_id,amount_tolerance:float,percent_tolerance:float)->Optional[Tuple[Any,float]]:
+    """Closest near-miss PO number whose total also agrees. Confidence combines both."""
+    if inv_total is None:
+        return None
+    for cand in find_po_candidates(cur,inv_po_number):
+        if cand["exact"]:
+            continue
+        best=select_best_po(inv_total,inv_currency,inv_vendor_id,[(cand["poId"],cand["totalAmount"],cand["currency"],cand["vendorId"])],amount_tolerance,percent_tolerance)
+        if best is not None:
+            return best[0],round(best[1]*cand["confidence"],4)
+    return None
+
+def match_invoice(invoice_id:str,amount_tolerance:float=1.0,percent_tolerance:float=0.02,expected_status:Optional[str]=None)->Optional[str]:
     with get_conn() as conn:
         with conn.cursor() as cur:
+            return _match_invoice(cur,invoice_id,amount_tolerance,percent_tolerance,expected_status)
+
+def _match_invoice(cur,invoice_id,amount_tolerance:float=1.0,percent_tolerance:float=0.02,expected_status:Optional[str]=None)->Optional[str]:
+    """Match one invoice and write the result. The row is locked for the rest of the transaction;
+    with expected_status, an invoice that another path (allocation, bulk rematch) has moved on
+    since the caller selected it is left alone.
+    """
+    cur.execute(
+        """
+        select id,po_number,total_amount,currency,vendor_id,status,po_number_norm,duplicate_of
+        from invoices
+        where id=%s
+        for update
+        """,
+        (invoice_id,)
+    )
+    row=cur.fetchone()
+    if not row:
+        return None
+    inv_id,inv_po_number,inv_total,inv_currency,inv_vendor_id,inv_status,inv_po_norm,inv_duplicate_of=row
+    if expected_status is not None and inv_status!=expected_status:
+        return None
+    # Suspected duplicates stay in needs_review until a reviewer clears them
+    if inv_status=="vendor_mismatch" or inv_duplicate_of is not None:
+        return None
+    best=None
+    if inv_po_norm and inv_total is not None:
+        cur.execute(_PO_CANDIDATES_SQL,(inv_po_norm,))
+        best=select_best_po(inv_total,inv_currency,inv_vendor_id,cur.fetchall(),amount_tolerance,percent_tolerance)
+    if best is not None:
+        best_po_id,confidence=best
+        status="matched_auto"
+    else:
+        # Totals differ (partial shipment, split invoice): fall back to line-level matching
+        line_match=match_invoice_lines(cur,inv_id,inv_po_number,inv_currency,inv_vendor_id)
+        if line_match is not None:
+            best_po_id,status,confidence=line_match
+        else:
+            # OCR'd PO number may be a near miss; suggest the PO but leave it for a reviewer
+            fuzzy=_fuzzy_po_match(cur,inv_po_number,inv_total,inv_currency,inv_vendor_id,amount_tolerance,percent_tolerance)
+            if fuzzy is None:
+                return None
+            best_po_id,confidence=fuzzy
+            status="needs_review"
+    cur.execute(
+        """
+        update invoices
+        set matched_po_id=%s,status=%s,confidence=%s
+        where id=%s
+        """,
+        (best_po_id,status,confidence,invoice_id)
+    )
+    return str(best_po_id)
+
+def rematch_unmatched_invoices(amount_tolerance:float=1.0,percent_tolerance:float=0.02)->Dict[str,Any]:
+    """Match every unmatched invoice against open/partially_received POs in one pass.
+    Loads both sides once, indexes POs by normalized PO number in memory, applies the same rules as
+    match_invoice (header totals, then line level for invoices whose totals do not line up)
+    and writes all matches with a single UPDATE ... FROM unnest(...).
+    Invoices whose status changed since the read are left alone.
+    """
+    started=time.monotonic()
+    summary:Dict[str,Any]={"invoices":0,"purchaseOrders":0,"matched":0,"skipped":False}
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("select pg_try_advisory_xact_lock(%s)",(_REMATCH_LOCK_KEY,))
+            if not cur.fetchone()[0]:
+                summary["skipped"]=True
+                return summary
             cur.execute(
                 """
-                select id,po_number,total_amount,currency,vendor_id,status
-                from invoices
-                where id=%s
-                """,
-                (invoice_id,)
+                select id,po_number_norm,total_amount,currency,vendor_id
+                from purchase_orders
+                where status in ('open','partially_received')
+                  and po_number_norm is not null
+                  and total_amount is not null
+                order by id
+                """
             )
-            row=cur.fetchone()
-            if not row:
-                return None
-            inv_id,inv_po_number,inv_total,inv_currency,inv_vendor_id,inv_status=row
-            if inv_status=="vendor_mismatch":
-                return None
-            if not inv_po_number or inv_total is None:
-                return None
+            pos_by_number:Dict[str,List[Tuple[Any,Any,Any,Any]]]={}
+            po_count=0
+            for po_id,po_number,po_total,po_currency,po_vendor_id in cur:
+                pos_by_number.setdefault(po_number,[]).append((po_id,po_total,po_currency,po_vendor_id))
+                po_count+=1
+            summary["purchaseOrders"]=po_count
+            if not pos_by_number:
+                summary["elapsedMs"]=round((time.monotonic()-started)*1000,1)
+                return summary
+
             cur.execute(
                 """
-                select id,total_amount,currency,vendor_id
-                from purchase_orders
-                where po_number=%s
-                  and status in ('open','partially_received')
-                """,
-                (inv_po_number,)
+                select id,po_number_norm,po_number,total_amount,currency,vendor_id
+                from invoices
+                where status='unmatched'
+                  and po_number_norm is not null
+                  and total_amount is not null
+                """
             )
-            candidates=cur.fetchall()
-            best_po_id=None
-            best_diff=None
-            for po_id,po_total,po_currency,po_vendor_id in candidates:
-                if po_total is None:
-                    continue
-                if inv_currency and po_currency and inv_currency!=po_currency:
+            invoice_ids:List[Any]=[]
+            po_ids:List[Any]=[]
+            statuses:List[str]=[]
+            confidences:List[float]=[]
+            leftovers:List[Tuple[Any,Any,Any,Any,Any]]=[]
+            inv_count=0
+            for inv_id,inv_po_norm,inv_po_number,inv_total,inv_currency,inv_vendor_id in cur:
+                inv_count+=1
+                candidates=pos_by_number.get(inv_po_norm)
+                if not candidates:
                     continue
-                if inv_vendor_id and po_vendor_id and inv_vendor_id!=po_vendor_id:
+                best=select_best_po(inv_total,inv_currency,inv_vendor_id,candidates,amount_tolerance,percent_tolerance)
+                if best is None:
+                    leftovers.append((inv_id,inv_po_norm,inv_po_number,inv_currency,inv_vendor_id))
                     continue
-                diff=abs(float(inv_total)-float(po_total))
-                if best_diff is None or diff<best_diff:
-                    best_diff=diff
-                    best_po_id=po_id
-            if best_po_id is None or best_diff is None:
-                return None
-            if best_diff>amount_tolerance and best_diff>abs(float(inv_total))*percent_tolerance:
-                return None
-            confidence=max(0.0,1.0-min(1.0,best_diff/max(1.0,abs(float(inv_total)))))
+                invoice_ids.append(inv_id)
+                po_ids.append(best[0])
+                statuses.append("matched_auto")
+                confidences.append(best[1])
+            summary["invoices"]=inv_count
+
+            # Totals did not line up: try line-level matching against the same candidate POs
+            summary["lineMatched"]=0
+            if leftovers:
+                inv_lines=load_invoice_lines(cur,[l[0] for l in leftovers])
+                wanted={po[0] for l in leftovers if str(l[0]) in inv_lines for po in pos_by_number[l[1]]}
+                po_lines=load_po_lines(cur,sorted(wanted,key=str)) if wanted else {}
+                # Quantities earlier invoices billed; grows as this pass matches invoices
+                billed=load_billed_quantities(cur,sorted(wanted,key=str),[l[0] for l in leftovers]) if wanted else {}
+                reports:Dict[str,List[Dict[str,Any]]]={}
+                for inv_id,inv_po_norm,inv_po_number,inv_currency,inv_vendor_id in leftovers:
+                    lines=inv_lines.get(str(inv_id))
+                    if not lines:
+                        continue
+                    candidate_lines=[
+                        pl
+                        for po_id,_total,po_currency,po_vendor_id in pos_by_number[inv_po_norm]
+                        if not (inv_currency and po_currency and inv_currency!=po_currency)
+                        and not (inv_vendor_id and po_vendor_id and inv_vendor_id!=po_vendor_id)
+                        for pl in po_lines.get(str(po_id),[])
+                    ]
+                    if not candidate_lines:
+                        continue
+                    for line in lines:
+                        line["po_number"]=line.get("po_number") or inv_po_number
+                    result=match_lines(lines,candidate_lines,billed)
+                    reports[str(inv_id)]=result["lines"]
+                    status=line_match_status(result)
+                    if status is None:
+                        continue
+                    record_billed(billed,result["lines"])
+                    invoice_ids.append(inv_id)
+                    po_ids.append(result["poId"])
+                    statuses.append(status)
+                    confidences.append(result["confidence"])
+                    summary["lineMatched"]+=1
+                save_line_reports(cur,reports)
+
+            if invoice_ids:
+                cur.execute(
+                    """
+                    update invoices i
+                    set matched_po_id=u.po_id,status=u.status,confidence=u.confidence
+                    from unnest(%s::uuid[],%s::uuid[],%s::text[],%s::float8[]) as u(invoice_id,po_id,status,confidence)
+                    where i.id=u.invoice_id
+                      and i.status='unmatched'
+                    """,
+                    (invoice_ids,po_ids,statuses,confidences)
+                )
+                summary["matched"]=cur.rowcount or 0
+                if summary["matched"]:
+                    notify(cur,INVOICES_CHANNEL,"")
+    summary["elapsedMs"]=round((time.monotonic()-started)*1000,1)
+    return summary
+
+def process_po_match_queue(batch_size:int=PO_MATCH_QUEUE_BATCH,amount_tolerance:float=1.0,percent_tolerance:float=0.02)->Dict[str,Any]:
+    """Claim up to batch_size queued PO changes and run match_invoice for the unmatched invoices they
+    could affect: same normalized PO number (header / line match) or a trigram-similar one (near-miss
+    PO number, through idx_invoices_unmatched_po_number_norm_trgm). Work is proportional to the
+    change, not to the backlog of unmatched invoices.
+    Concurrent workers skip each other's claims; a failed invoice is rolled back alone.
+    """
+    started=time.monotonic()
+    summary:Dict[str,Any]={"purchaseOrders":0,"invoices":0,"matched":0,"failed":0}
+    with get_conn() as conn:
+        with conn.cursor() as cur:
             cur.execute(
                 """
-                update invoices
-                set matched_po_id=%s,status='matched_auto',confidence=%s
-                where id=%s
+                delete from po_match_queue
+                where po_id in (
+                  select po_id from po_match_queue
+                  order by enqueued_at
+                  limit %s
+                  for update skip locked
+                )
+                returning po_id
                 """,
-                (best_po_id,confidence,invoice_id)
+                (batch_size,)
             )
-            return str(best_po_id)
+            po_ids=[r[0] for r in cur.fetchall()]
+            summary["purchaseOrders"]=len(po_ids)
+            if not po_ids:
+                return summary
+            cur.execute(
+                """
+                select i.id
+                from purchase_orders p
+                join invoices i on i.po_number_norm=p.po_number_norm
+                where p.id=any(%s)
+                  and p.status in ('open','partially_received')
+                  and i.status='unmatched'
+                  and i.duplicate_of is null
+                union
+                select i.id
+                from purchase_orders p
+                join invoices i on i.po_number_norm %% p.po_number_norm
+                where p.id=any(%s)
+                  and p.status in ('open','partially_received')
+                  and i.status='unmatched'
+                  and i.duplicate_of is null
+                  and i.po_number_norm is not null
+                """,
+                (po_ids,po_ids)
+            )
+            invoice_ids=[r[0] for r in cur.fetchall()]
+            summary["invoices"]=len(invoice_ids)
+            for inv_id in invoice_ids:
+                try:
+                    with conn.transaction():
+                        if _match_invoice(cur,inv_id,amount_tolerance,percent_tolerance,"unmatched"):
+                            summary["matched"]+=1
+                except Exception:
+                    summary["failed"]+=1
+            if summary["matched"]:
+                notify(cur,INVOICES_CHANNEL,"")
+    summary["elapsedMs"]=round((time.monotonic()-started)*1000,1)
+    return summary
+
+def _po_match_loop()->None:
+    while True:
+        _po_wakeup.clear()
+        try:
+            summary=process_po_match_queue()
+        except Exception:
+            summary=None
+        # A full batch means more may be queued; keep draining
+        if summary and summary["purchaseOrders"]>=PO_MATCH_QUEUE_BATCH:
+            continue
+        _po_wakeup.wait(PO_MATCH_POLL_SECONDS)
+
+def start_po_match_worker()->None:
+    """Start the thread that matches invoices as POs are inserted or updated (idempotent)."""
+    global _po_worker
+    with _po_worker_lock:
+        if _po_worker is not None:
+            return
+        # Also fires with None on listener reconnect, which is when notifications may have been missed
+        subscribe(PURCHASE_ORDERS_CHANNEL,lambda _payload:_po_wakeup.set())
+        start_listener()
+        _po_worker=threading.Thread(target=_po_match_loop,name="po-match",daemon=True)
+        _po_worker.start()
@@ -0,0 +1,41 @@
+"""Recompute invoice_daily_rollup from invoices (backfill or repair after manual edits).
+
+    python rebuild_invoice_rollup.py                 # everything
+    python rebuild_invoice_rollup.py --since 2025-11-01
+"""
+import argparse
+import datetime
+from typing import Dict, Optional
+from db import get_conn
+
+def rebuild_invoice_daily_rollup(since: Optional[datetime.date] = None) -> Dict[str, int]:
+    """Replace rollup rows for days >= `since` (all days when None). Returns row counts."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            # Waits out in-flight invoice writes and holds new ones at their rollup trigger,
+            # so their deltas land on top of the rebuilt rows rather than being lost.
+            cur.execute("LOCK TABLE invoice_daily_rollup IN EXCLUSIVE MODE")
+            cur.execute(
+                "DELETE FROM invoice_daily_rollup WHERE %s::date IS NULL OR day >= %s::date",
+                (since, since)
+            )
+            deleted = cur.rowcount
+            cur.execute(
+                """
+                INSERT INTO invoice_daily_rollup(day, vendor_id, invoice_count, total_amount, matched_count)
+                SELECT created_at::date, vendor_id, COUNT(*), COALESCE(SUM(total_amount), 0),
+                       COUNT(*) FILTER (WHERE status = 'matched_auto')
+                FROM invoices
+                WHERE created_at IS NOT NULL AND (%s::date IS NULL OR created_at >= %s::date)
+                GROUP BY created_at::date, vendor_id
+                """,
+                (since, since)
+            )
+            inserted = cur.rowcount
+    return {"deletedRows": deleted, "insertedRows": inserted}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--since", type=datetime.date.fromisoformat, default=None, help="YYYY-MM-DD (rollup day)")
+    args = parser.parse_args()
+    print(rebuild_invoice_daily_rollup(args.since))
@@ -0,0 +1,62 @@
+"""Re-run the extract stage for stored invoices with the current InvoiceExtract schema.
+
+Only invoices still in the exception queue are refreshed. Reads each invoice's
+.parse.json sidecar, so only extract calls are spent:
+    python reextract_invoices.py --since 2025-11-01
+"""
+import argparse
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+from db import get_conn
+from ocr_landingai import extract_invoice_fields, parse_sidecar_path
+from invoice_db import refresh_invoice_fields, REEXTRACTABLE_STATUSES
+from po_matching import match_invoice
+from ade_client import ADE_MAX_IN_FLIGHT
+
+def _reextract_one(invoice_id: str, file_path: str, status: Optional[str]) -> str:
+    parse_path = parse_sidecar_path(file_path)
+    if not parse_path.exists():
+        return "missingParse"
+    try:
+        fields_path = extract_invoice_fields(str(parse_path), file_path)
+        if not fields_path or not refresh_invoice_fields(invoice_id, fields_path):
+            return "failed"
+        # New PO number or totals may now match; matched invoices are left alone
+        if status == "unmatched" and match_invoice(invoice_id, expected_status="unmatched"):
+            return "rematched"
+        return "reextracted"
+    except Exception:
+        return "failed"
+
+def reextract_invoices_since(since: datetime.date, limit: Optional[int] = None) -> Dict[str, int]:
+    """Re-extract every exception-queue invoice created on or after `since`. Matched, payable and paid
+    invoices are not touched. Returns counts by outcome."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT id, file_path, status
+                FROM invoices
+                WHERE created_at >= %s AND file_path IS NOT NULL
+                  AND status = ANY(%s)
+                ORDER BY created_at, id
+                LIMIT %s
+                """,
+                (since, list(REEXTRACTABLE_STATUSES), limit)
+            )
+            rows = cur.fetchall()
+    summary = {"invoices": len(rows), "reextracted": 0, "rematched": 0, "missingParse": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=max(1, ADE_MAX_IN_FLIGHT)) as pool:
+        outcomes = pool.map(lambda r: _reextract_one(str(r[0]), r[1], r[2]), rows)
+        for outcome in outcomes:
+            summary[outcome] += 1
+    summary["reextracted"] += summary["rematched"]
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--since", required=True, type=datetime.date.fromisoformat, help="YYYY-MM-DD (invoice created_at)")
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+    print(reextract_invoices_since(args.since, args.limit))
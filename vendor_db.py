@@ -1,16 +1,17 @@
 import os
+import threading
 from typing import Optional, Dict, Any, List
-from dotenv import load_dotenv
-import psycopg
+from db import get_conn
+from db_events import notify, subscribe, start_listener, is_listening
+from ttl_cache import TTLCache
+from vendor_index import VENDORS_CHANNEL, invalidate as invalidate_vendor_index
 
-load_dotenv()
+VENDOR_DETAIL_CHANNEL = "vendor_detail_changed"
+VENDOR_DETAIL_CACHE_TTL_SECONDS = float(os.getenv("VENDOR_DETAIL_CACHE_TTL_SECONDS", "300"))
 
-DB_URL=os.getenv("DATABASE_URL")
-
-def get_conn():
-    if not DB_URL:
-        raise RuntimeError("DATABASE_URL not set")
-    return psycopg.connect(DB_URL)
+_vendor_detail_cache = TTLCache(VENDOR_DETAIL_CACHE_TTL_SECONDS, maxsize=1024)
+_vendor_detail_lock = threading.Lock()
+_vendor_detail_generation = 0
 
 def get_vendors():
     with get_conn() as conn:
@@ -19,7 +20,7 @@ def get_vendors():
             return cur.fetchall()
 
 def get_all_vendors_detailed():
-    """Get all vendors with counts of open POs and recent invoices"""
+    """Get all vendors with counts of open POs and recent invoices (from vendor_activity)"""
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("""
@@ -28,22 +29,11 @@ def get_all_vendors_detailed():
                     v.name,
                     v.tax_id,
                     v.contact_info,
-                    COALESCE(po_count.count, 0) as open_pos,
-                    COALESCE(invoice_count.count, 0) as invoices_30d,
-                    CASE WHEN COALESCE(invoice_count.count, 0) > 0 THEN 'active' ELSE 'inactive' END as status
+                    COALESCE(va.open_po_count, 0) as open_pos,
+                    COALESCE(va.invoices_30d, 0) as invoices_30d,
+                    CASE WHEN COALESCE(va.invoices_30d, 0) > 0 THEN 'active' ELSE 'inactive' END as status
                 FROM vendors v
-                LEFT JOIN (
-                    SELECT vendor_id, COUNT(*) as count
-                    FROM purchase_orders
-                    WHERE status IN ('open', 'partially_received')
-                    GROUP BY vendor_id
-                ) po_count ON v.id = po_count.vendor_id
-                LEFT JOIN (
-                    SELECT vendor_id, COUNT(*) as count
-                    FROM invoices
-                    WHERE created_at >= CURRENT_DATE - INTERVAL '30 days'
-                    GROUP BY vendor_id
-                ) invoice_count ON v.id = invoice_count.vendor_id
+                LEFT JOIN vendor_activity va ON va.vendor_id = v.id
                 ORDER BY v.name
             """)
 
@@ -65,149 +55,159 @@ def get_vendor_stats():
     """Get summary statistics about vendors"""
     with get_conn() as conn:
         with conn.cursor() as cur:
-            # Total vendors
-            cur.execute("SELECT COUNT(*) FROM vendors")
-            total = cur.fetchone()[0]
-
-            # Active vendors (had invoices in last 30 days)
-            cur.execute("""
-                SELECT COUNT(DISTINCT vendor_id)
-                FROM invoices
-                WHERE created_at >= CURRENT_DATE - INTERVAL '30 days'
-                AND vendor_id IS NOT NULL
-            """)
-            active = cur.fetchone()[0]
-
-            # Vendors with invoices in last 30 days
             cur.execute("""
-                SELECT COUNT(DISTINCT vendor_id)
-                FROM invoices
-                WHERE created_at >= CURRENT_DATE - INTERVAL '30 days'
-                AND vendor_id IS NOT NULL
+                SELECT
+                    (SELECT COUNT(*) FROM vendors),
+                    (SELECT COUNT(*) FROM vendor_activity WHERE invoices_30d > 0)
             """)
-            with_invoices = cur.fetchone()[0]
+            total, active = cur.fetchone()
 
+            # Active means "had invoices in the last 30 days", so both figures are the same count
             return {
                 'totalVendors': total,
                 'activeVendors': active,
-                'vendorsWithInvoices30d': with_invoices
+                'vendorsWithInvoices30d': active
             }
 
+def advance_vendor_activity_window() -> Dict[str, Any]:
+    """Slide vendor_activity's 30-day window to today (nightly). Only invoices that left the window
+    are read, so the lock is held briefly."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            # Same lock as the full rebuild: in-flight deltas land before or after the shift, never during
+            cur.execute("LOCK TABLE vendor_activity IN EXCLUSIVE MODE")
+            cur.execute("SELECT vendor_activity_advance_window()")
+            vendors = cur.fetchone()[0]
+            if vendors:
+                notify(cur, VENDOR_DETAIL_CHANNEL, "")
+    return {'vendors': vendors}
+
+def recompute_vendor_activity() -> Dict[str, Any]:
+    """Rebuild vendor_activity from invoices and purchase_orders (manual repair). Scans both tables
+    while invoice and PO writers wait at their triggers, so it is not scheduled."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            # Waits out in-flight writes and holds new ones at their trigger, so their deltas
+            # land on top of the rebuilt rows rather than being lost.
+            cur.execute("LOCK TABLE vendor_activity IN EXCLUSIVE MODE")
+            cur.execute("SELECT vendor_activity_recompute()")
+            vendors = cur.fetchone()[0]
+            notify(cur, VENDOR_DETAIL_CHANNEL, "")
+    return {'vendors': vendors}
+
+def _invalidate_vendor_detail(payload: Optional[str]) -> None:
+    """Drop one vendor's cached detail, or all of them (empty payload, vendors table change, reconnect)."""
+    global _vendor_detail_generation
+    with _vendor_detail_lock:
+        _vendor_detail_generation += 1
+    _vendor_detail_cache.invalidate(payload or None)
+
+subscribe(VENDOR_DETAIL_CHANNEL, _invalidate_vendor_detail)
+subscribe(VENDORS_CHANNEL, lambda _payload: _invalidate_vendor_detail(None))
+
+# One row per vendor: counters plus the 50 latest invoices and POs as JSON (also EXPLAINed by check_query_plans.py)
+_VENDOR_DETAIL_SQL = """
+    SELECT
+        v.id, v.name, v.tax_id, v.contact_info, v.address,
+        COALESCE(va.open_po_count, 0),
+        COALESCE(va.invoices_30d, 0),
+        COALESCE(va.amount_30d, 0),
+        (SELECT COALESCE(json_agg(json_build_object(
+                    'id', i.id::text,
+                    'date', COALESCE(to_char(i.invoice_date, 'YYYY-MM-DD'), ''),
+                    'amount', COALESCE(i.total_amount, 0)::float8,
+                    'status', COALESCE(i.status, 'unmatched'),
+                    'invoiceNumber', COALESCE(i.invoice_number, ''),
+                    'poNumber', COALESCE(i.po_number, '')
+                ) ORDER BY i.invoice_date DESC NULLS LAST, i.id DESC), '[]'::json)
+         FROM (
+             SELECT id, invoice_date, total_amount, status, invoice_number, po_number
+             FROM invoices
+             WHERE vendor_id = v.id
+             ORDER BY invoice_date DESC NULLS LAST, id DESC
+             LIMIT 50
+         ) i) AS invoices,
+        (SELECT COALESCE(json_agg(json_build_object(
+                    'id', p.id::text,
+                    'poNumber', COALESCE(p.po_number, ''),
+                    'totalAmount', COALESCE(p.total_amount, 0)::float8,
+                    'currency', COALESCE(p.currency, 'USD'),
+                    'status', COALESCE(p.status, '')
+                ) ORDER BY p.created_at DESC NULLS LAST, p.id DESC), '[]'::json)
+         FROM (
+             SELECT id, po_number, total_amount, currency, status, created_at
+             FROM purchase_orders
+             WHERE vendor_id = v.id
+             ORDER BY created_at DESC NULLS LAST, id DESC
+             LIMIT 50
+         ) p) AS purchase_orders
+    FROM vendors v
+    LEFT JOIN vendor_activity va ON va.vendor_id = v.id
+    WHERE v.id = %s
+"""
+
+# /api/vendors/<id>/mentions search, newest first
+VENDOR_PO_MENTIONS_SQL = """
+    SELECT id, po_number, total_amount, currency
+    FROM purchase_orders
+    WHERE vendor_id=%s AND (%s='' OR po_number ILIKE %s)
+    ORDER BY created_at DESC NULLS LAST, id DESC
+    LIMIT %s
+"""
+VENDOR_INVOICE_MENTIONS_SQL = """
+    SELECT id, invoice_number, total_amount, currency, invoice_date
+    FROM invoices
+    WHERE vendor_id=%s AND (%s='' OR invoice_number ILIKE %s)
+    ORDER BY created_at DESC NULLS LAST, id DESC
+    LIMIT %s
+"""
+
 def get_vendor_by_id_detailed(vendor_id):
-    """Get detailed vendor information including stats and recent activity"""
+    """Get detailed vendor information including stats and recent activity.
+    One round trip: counters come from vendor_activity, Postgres builds the invoice / PO lists with json_agg.
+    Cached per vendor; triggers on invoices and purchase_orders NOTIFY the vendor id on change.
+    """
+    start_listener()
+    key = str(vendor_id)
+    # Without the LISTEN connection there is nothing to invalidate the cache; read through
+    if is_listening():
+        cached = _vendor_detail_cache.get(key)
+        if cached is not None:
+            return dict(cached)
+    with _vendor_detail_lock:
+        generation = _vendor_detail_generation
+
     with get_conn() as conn:
         with conn.cursor() as cur:
-            # Get vendor basic info
-            cur.execute("""
-                SELECT id, name, tax_id, contact_info, address
-                FROM vendors
-                WHERE id = %s
-            """, (vendor_id,))
+            cur.execute(_VENDOR_DETAIL_SQL, (vendor_id,))
 
             vendor_row = cur.fetchone()
             if not vendor_row:
                 return None
 
-            # Get open POs count
-            cur.execute("""
-                SELECT COUNT(*)
-                FROM purchase_orders
-                WHERE vendor_id = %s
-                AND status IN ('open', 'partially_received')
-            """, (vendor_id,))
-            open_pos = cur.fetchone()[0]
-
-            # Get invoices last 30 days count
-            cur.execute("""
-                SELECT COUNT(*)
-                FROM invoices
-                WHERE vendor_id = %s
-                AND created_at >= CURRENT_DATE - INTERVAL '30 days'
-            """, (vendor_id,))
-            invoices_30d = cur.fetchone()[0]
-
-            # Get total amount last 30 days
-            cur.execute("""
-                SELECT COALESCE(SUM(total_amount), 0)
-                FROM invoices
-                WHERE vendor_id = %s
-                AND created_at >= CURRENT_DATE - INTERVAL '30 days'
-            """, (vendor_id,))
-            total_amount = float(cur.fetchone()[0])
-
-            # Get recent invoices (summary, last 3)
-            cur.execute("""
-                SELECT invoice_date, total_amount, status
-                FROM invoices
-                WHERE vendor_id = %s
-                ORDER BY invoice_date DESC NULLS LAST, id DESC
-                LIMIT 3
-            """, (vendor_id,))
-            recent_rows = cur.fetchall()
-
-            recent_invoices = []
-            for row in recent_rows:
-                recent_invoices.append({
-                    'date': row[0].isoformat() if row[0] else '',
-                    'amount': float(row[1]) if row[1] else 0.0,
-                    'status': row[2] or 'unmatched'
-                })
-
-            # Full invoice list for this vendor (with ids)
-            cur.execute("""
-                SELECT id, invoice_date, total_amount, status, invoice_number, po_number
-                FROM invoices
-                WHERE vendor_id = %s
-                ORDER BY invoice_date DESC NULLS LAST, id DESC
-                LIMIT 50
-            """, (vendor_id,))
-            invoice_rows = cur.fetchall()
-            invoices = []
-            for row in invoice_rows:
-                inv_date = row[1]
-                invoices.append({
-                    'id': str(row[0]),
-                    'date': inv_date.isoformat() if inv_date else '',
-                    'amount': float(row[2]) if row[2] else 0.0,
-                    'status': row[3] or 'unmatched',
-                    'invoiceNumber': row[4] or '',
-                    'poNumber': row[5] or ''
-                })
-
-            # Purchase orders for this vendor
-            cur.execute("""
-                SELECT id, po_number, total_amount, currency, status, created_at
-                FROM purchase_orders
-                WHERE vendor_id = %s
-                ORDER BY created_at DESC NULLS LAST, id DESC
-                LIMIT 50
-            """, (vendor_id,))
-            po_rows = cur.fetchall()
-            purchase_orders = []
-            for row in po_rows:
-                purchase_orders.append({
-                    'id': str(row[0]),
-                    'poNumber': row[1] or '',
-                    'totalAmount': float(row[2]) if row[2] else 0.0,
-                    'currency': row[3] or 'USD',
-                    'status': row[4] or ''
-                })
-
-            return {
-                'id': str(vendor_row[0]),
-                'name': vendor_row[1] or 'Unknown Vendor',
-                'taxId': vendor_row[2] or '',
-                'contact': vendor_row[3] or '',
-                'address': vendor_row[4] or '',
-                'phone': '+1 (555) 123-4567',  # Mock for now
-                'openPos': open_pos,
-                'invoices30d': invoices_30d,
-                'totalAmount30d': total_amount,
-                'status': 'active' if invoices_30d > 0 else 'inactive',
-                'recentInvoices': recent_invoices,
-                'invoices': invoices,
-                'purchaseOrders': purchase_orders
-            }
+    invoices = vendor_row[8] or []
+    invoices_30d = vendor_row[6]
+    detail = {
+        'id': str(vendor_row[0]),
+        'name': vendor_row[1] or 'Unknown Vendor',
+        'taxId': vendor_row[2] or '',
+        'contact': vendor_row[3] or '',
+        'address': vendor_row[4] or '',
+        'phone': '+1 (555) 123-4567',  # Mock for now
+        'openPos': vendor_row[5],
+        'invoices30d': invoices_30d,
+        'totalAmount30d': float(vendor_row[7]),
+        'status': 'active' if invoices_30d > 0 else 'inactive',
+        # Same ordering as the invoice list, so the summary is just its head
+        'recentInvoices': [{'date': inv['date'], 'amount': inv['amount'], 'status': inv['status']} for inv in invoices[:3]],
+        'invoices': invoices,
+        'purchaseOrders': vendor_row[9] or []
+    }
+    with _vendor_detail_lock:
+        # An invalidation that raced with this read would leave a stale entry behind
+        if generation == _vendor_detail_generation:
+            _vendor_detail_cache.set(key, detail)
+    return dict(detail)
 
 def create_vendor(name: str, tax_id: Optional[str] = None, contact_info: Optional[str] = None, address: Optional[str] = None) -> Dict[str, Any]:
     if not name or not name.strip():
@@ -223,83 +223,12 @@ def create_vendor(name: str, tax_id: Optional[str] = None, contact_info: Optiona
                 (name.strip(), tax_id, contact_info, address)
             )
             row = cur.fetchone()
-            return {
-                'id': str(row[0]),
-                'name': row[1] or '',
-                'taxId': row[2] or '',
-                'contact': row[3] or '',
-                'address': row[4] or '',
-            }
-
-def delete_vendor(vendor_id: str) -> Dict[str, Any]:
-    """Delete vendor and related data (invoices, invoice_lines, PO lines, POs, payment links).
-    Uses subqueries instead of array parameters to ensure proper deletion.
-    Returns a summary of deleted counts.
-    """
-    summary = {
-        'paymentLinksDeleted': 0,
-        'invoiceLinesDeleted': 0,
-        'invoicesDeleted': 0,
-        'poLinesDeleted': 0,
-        'purchaseOrdersDeleted': 0,
-        'vendorsDeleted': 0,
+            notify(cur, VENDORS_CHANNEL, str(row[0]))
+    invalidate_vendor_index()
+    return {
+        'id': str(row[0]),
+        'name': row[1] or '',
+        'taxId': row[2] or '',
+        'contact': row[3] or '',
+        'address': row[4] or '',
     }
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            # Delete payment links tied to this vendor's invoices
-            try:
-                cur.execute(
-                    """
-                    DELETE FROM payment_invoices
-                    WHERE invoice_id IN (
-                        SELECT id FROM invoices WHERE vendor_id = %s
-                    )
-                    """,
-                    (vendor_id,)
-                )
-                summary['paymentLinksDeleted'] = cur.rowcount or 0
-            except Exception:
-                # table may not exist yet
-                pass
-
-            # Delete invoice lines for this vendor's invoices
-            try:
-                cur.execute(
-                    """
-                    DELETE FROM invoice_lines
-                    WHERE invoice_id IN (
-                        SELECT id FROM invoices WHERE vendor_id = %s
-                    )
-                    """,
-                    (vendor_id,)
-                )
-                summary['invoiceLinesDeleted'] = cur.rowcount or 0
-            except Exception:
-                pass
-
-            # Delete invoices for this vendor
-            cur.execute("DELETE FROM invoices WHERE vendor_id=%s", (vendor_id,))
-            summary['invoicesDeleted'] = cur.rowcount or 0
-
-            # Delete PO lines and POs for this vendor (if tables exist)
-            try:
-                cur.execute(
-                    """
-                    DELETE FROM purchase_order_lines
-                    WHERE po_id IN (
-                        SELECT id FROM purchase_orders WHERE vendor_id = %s
-                    )
-                    """,
-                    (vendor_id,)
-                )
-                summary['poLinesDeleted'] = cur.rowcount or 0
-                cur.execute("DELETE FROM purchase_orders WHERE vendor_id=%s", (vendor_id,))
-                summary['purchaseOrdersDeleted'] = cur.rowcount or 0
-            except Exception:
-                pass
-
-            # Finally delete vendor
-            cur.execute("DELETE FROM vendors WHERE id=%s", (vendor_id,))
-            summary['vendorsDeleted'] = cur.rowcount or 0
-
-    return summary
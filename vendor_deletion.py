@@ -0,0 +1,233 @@
+"""Background, batched vendor deletion.
+
+DELETE /api/vendors/<id> queues a job; a worker thread removes the vendor's payment links,
+invoice lines, invoices, PO lines and POs in batches of VENDOR_DELETE_BATCH_SIZE rows, one
+transaction per batch, then the vendor itself. Jobs are leased like OCR jobs, so one
+interrupted by a crash is picked up again and continues with whatever rows remain.
+"""
+import os
+import socket
+import threading
+from typing import Any, Dict, Optional
+from db import get_conn
+from db_events import notify
+from vendor_index import VENDORS_CHANNEL, invalidate as invalidate_vendor_index
+
+VENDOR_DELETE_BATCH_SIZE = int(os.getenv("VENDOR_DELETE_BATCH_SIZE", "5000"))
+VENDOR_DELETE_POLL_SECONDS = float(os.getenv("VENDOR_DELETE_POLL_SECONDS", "5"))
+VENDOR_DELETE_LEASE_SECONDS = int(os.getenv("VENDOR_DELETE_LEASE_SECONDS", "300"))
+VENDOR_DELETE_MAX_ATTEMPTS = int(os.getenv("VENDOR_DELETE_MAX_ATTEMPTS", "5"))
+
+_wakeup = threading.Event()
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+
+# (stage, counter column, DELETE for one batch of the vendor's rows). Children go before parents;
+# lines are picked by ctid so a batch is bounded by line count, not invoice count.
+_STAGES = (
+    ("invoice_lines", "invoice_lines_deleted", """
+        DELETE FROM invoice_lines
+        WHERE ctid = ANY(ARRAY(
+            SELECT l.ctid FROM invoice_lines l
+            JOIN invoices i ON i.id = l.invoice_id
+            WHERE i.vendor_id = %s
+            LIMIT %s
+        ))
+    """),
+    # payment_invoices restricts invoice deletes, so this stage clears the batch's links first
+    ("invoices", "invoices_deleted", """
+        DELETE FROM invoices WHERE id = ANY(%s)
+    """),
+    ("po_lines", "po_lines_deleted", """
+        DELETE FROM purchase_order_lines
+        WHERE ctid = ANY(ARRAY(
+            SELECT l.ctid FROM purchase_order_lines l
+            JOIN purchase_orders p ON p.id = l.po_id
+            WHERE p.vendor_id = %s
+            LIMIT %s
+        ))
+    """),
+    ("purchase_orders", "purchase_orders_deleted", """
+        DELETE FROM purchase_orders
+        WHERE id = ANY(ARRAY(SELECT id FROM purchase_orders WHERE vendor_id = %s LIMIT %s))
+    """),
+)
+
+# The invoices stage locks its batch first, so the payment links and the invoices deleted match
+_INVOICE_BATCH_SQL = "SELECT id FROM invoices WHERE vendor_id = %s LIMIT %s FOR UPDATE"
+
+def _job_dict(row) -> Dict[str, Any]:
+    return {
+        "id": str(row[0]),
+        "vendorId": str(row[1]),
+        "status": row[2],
+        "stage": row[3],
+        "deleted": {
+            "paymentLinksDeleted": row[4],
+            "invoiceLinesDeleted": row[5],
+            "invoicesDeleted": row[6],
+            "poLinesDeleted": row[7],
+            "purchaseOrdersDeleted": row[8],
+            "vendorsDeleted": row[9],
+        },
+        "attempts": row[10],
+        "lastError": row[11],
+        "createdAt": row[12].isoformat() if row[12] else None,
+        "updatedAt": row[13].isoformat() if row[13] else None,
+        "finishedAt": row[14].isoformat() if row[14] else None,
+    }
+
+_JOB_COLUMNS = """
+    id, vendor_id, status, stage,
+    payment_links_deleted, invoice_lines_deleted, invoices_deleted,
+    po_lines_deleted, purchase_orders_deleted, vendors_deleted,
+    attempts, last_error, created_at, updated_at, finished_at
+"""
+
+def enqueue_vendor_deletion(vendor_id: str) -> Dict[str, Any]:
+    """Queue deletion of a vendor and its records. Returns the job (the live one if already queued)."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM vendors WHERE id = %s", (vendor_id,))
+            if cur.fetchone() is None:
+                raise ValueError("Vendor not found")
+            cur.execute(
+                f"""
+                INSERT INTO vendor_deletion_jobs(vendor_id) VALUES (%s)
+                ON CONFLICT (vendor_id) WHERE status IN ('queued','running') DO NOTHING
+                RETURNING {_JOB_COLUMNS}
+                """,
+                (vendor_id,)
+            )
+            row = cur.fetchone()
+            if row is None:
+                cur.execute(
+                    f"SELECT {_JOB_COLUMNS} FROM vendor_deletion_jobs "
+                    "WHERE vendor_id = %s AND status IN ('queued','running')",
+                    (vendor_id,)
+                )
+                row = cur.fetchone()
+    _wakeup.set()
+    return _job_dict(row)
+
+def get_vendor_deletion_job(job_id: str) -> Optional[Dict[str, Any]]:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT {_JOB_COLUMNS} FROM vendor_deletion_jobs WHERE id = %s", (job_id,))
+            row = cur.fetchone()
+    return _job_dict(row) if row else None
+
+def claim_vendor_deletion_job(worker_name: str) -> Optional[Dict[str, Any]]:
+    """Lease the oldest queued job, or a running one whose worker stopped renewing its lease."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                UPDATE vendor_deletion_jobs
+                SET status = 'running', locked_by = %s, locked_at = now(),
+                    attempts = attempts + 1, updated_at = now()
+                WHERE id = (
+                    SELECT id FROM vendor_deletion_jobs
+                    WHERE status IN ('queued','running')
+                      AND (locked_at IS NULL OR locked_at < now() - make_interval(secs => %s))
+                    ORDER BY created_at
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING {_JOB_COLUMNS}
+                """,
+                (worker_name, VENDOR_DELETE_LEASE_SECONDS)
+            )
+            row = cur.fetchone()
+    return _job_dict(row) if row else None
+
+def _delete_batch(job_id: str, vendor_id: str, stage: str, column: str, sql: str, batch_size: int) -> int:
+    """Delete one batch and record it on the job in the same transaction; renews the lease."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            links = 0
+            if stage == "invoices":
+                cur.execute(_INVOICE_BATCH_SQL, (vendor_id, batch_size))
+                ids = [r[0] for r in cur.fetchall()]
+                cur.execute("DELETE FROM payment_invoices WHERE invoice_id = ANY(%s)", (ids,))
+                links = cur.rowcount or 0
+                cur.execute(sql, (ids,))
+            else:
+                cur.execute(sql, (vendor_id, batch_size))
+            deleted = cur.rowcount or 0
+            cur.execute(
+                f"""
+                UPDATE vendor_deletion_jobs
+                SET stage = %s, {column} = {column} + %s,
+                    payment_links_deleted = payment_links_deleted + %s,
+                    locked_at = now(), updated_at = now()
+                WHERE id = %s
+                """,
+                (stage, deleted, links, job_id)
+            )
+    return deleted
+
+def process_vendor_deletion_job(job: Dict[str, Any], batch_size: int = VENDOR_DELETE_BATCH_SIZE) -> None:
+    """Run every stage until it finds no rows, then delete the vendor and close the job.
+    Stages are re-run from the top on resume; finished ones cost one empty batch.
+    """
+    job_id, vendor_id = job["id"], job["vendorId"]
+    try:
+        for stage, column, sql in _STAGES:
+            while _delete_batch(job_id, vendor_id, stage, column, sql, batch_size) >= batch_size:
+                pass
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM vendors WHERE id = %s", (vendor_id,))
+                vendors_deleted = cur.rowcount or 0
+                cur.execute(
+                    """
+                    UPDATE vendor_deletion_jobs
+                    SET status = 'done', stage = 'vendor', vendors_deleted = %s, last_error = NULL,
+                        locked_by = NULL, locked_at = NULL, updated_at = now(), finished_at = now()
+                    WHERE id = %s
+                    """,
+                    (vendors_deleted, job_id)
+                )
+                notify(cur, VENDORS_CHANNEL, str(vendor_id))
+        invalidate_vendor_index()
+    except Exception as e:
+        # Retry with the rows still left, up to the attempt limit. locked_at stays set, so the
+        # lease doubles as the retry delay instead of the worker spinning on a persistent error.
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE vendor_deletion_jobs
+                    SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'queued' END,
+                        last_error = %s, locked_by = NULL, locked_at = now(), updated_at = now(),
+                        finished_at = CASE WHEN attempts >= %s THEN now() END
+                    WHERE id = %s
+                    """,
+                    (VENDOR_DELETE_MAX_ATTEMPTS, str(e)[:2000], VENDOR_DELETE_MAX_ATTEMPTS, job_id)
+                )
+
+def _worker_loop(worker_name: str) -> None:
+    while True:
+        try:
+            job = claim_vendor_deletion_job(worker_name)
+        except Exception:
+            job = None
+        if job is None:
+            _wakeup.wait(VENDOR_DELETE_POLL_SECONDS)
+            _wakeup.clear()
+            continue
+        try:
+            process_vendor_deletion_job(job)
+        except Exception:
+            # Recording the failure hit a DB error too; the lease expires and the job is retried
+            pass
+
+def start_vendor_deletion_worker() -> None:
+    """Start this process's vendor deletion worker thread (idempotent)."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            name = f"{socket.gethostname()}:{os.getpid()}:vendor-delete"
+            _worker = threading.Thread(target=_worker_loop, args=(name,), name=name, daemon=True)
+            _worker.start()
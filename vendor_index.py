@@ -0,0 +1,94 @@
+import os
+import re
+import time
+import threading
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+from db import get_conn
+from db_events import subscribe, start_listener, is_listening
+
+load_dotenv()
+
+VENDORS_CHANNEL = "vendors_changed"
+# Only used while the LISTEN connection is down; otherwise the index lives until a NOTIFY
+VENDOR_INDEX_MAX_AGE_SECONDS = float(os.getenv("VENDOR_INDEX_MAX_AGE_SECONDS", "300"))
+
+_lock = threading.Lock()
+_by_tax_id: Dict[str, str] = {}
+_by_name: Dict[str, str] = {}
+_by_id: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+_loaded_at: Optional[float] = None
+_generation = 0
+
+def normalize_tax_id(value) -> str:
+    return re.sub(r"[\s\-./]", "", str(value or "")).upper()
+
+def normalize_vendor_name(value) -> str:
+    return " ".join(str(value or "").lower().split())
+
+def invalidate(_payload: Optional[str] = None) -> None:
+    global _loaded_at, _generation
+    with _lock:
+        _loaded_at = None
+        _generation += 1
+
+subscribe(VENDORS_CHANNEL, invalidate)
+
+def _load() -> None:
+    global _by_tax_id, _by_name, _by_id, _loaded_at
+    with _lock:
+        generation = _generation
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, name, tax_id FROM vendors ORDER BY id")
+            rows = cur.fetchall()
+    by_tax_id: Dict[str, str] = {}
+    by_name: Dict[str, str] = {}
+    by_id: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+    for vid, name, tax_id in rows:
+        vid = str(vid)
+        by_id[vid] = (name, tax_id)
+        if tax_id and normalize_tax_id(tax_id):
+            by_tax_id.setdefault(normalize_tax_id(tax_id), vid)
+        if name and normalize_vendor_name(name):
+            by_name.setdefault(normalize_vendor_name(name), vid)
+    with _lock:
+        _by_tax_id, _by_name, _by_id = by_tax_id, by_name, by_id
+        # An invalidation that raced with this load leaves the index marked stale
+        _loaded_at = time.monotonic() if generation == _generation else None
+
+def _ensure_loaded() -> None:
+    start_listener()
+    with _lock:
+        loaded_at = _loaded_at
+    stale = loaded_at is None or (
+        not is_listening() and time.monotonic() - loaded_at > VENDOR_INDEX_MAX_AGE_SECONDS
+    )
+    if stale:
+        _load()
+
+def resolve_vendor_id(tax_id: Optional[str], name: Optional[str]) -> Optional[str]:
+    """Vendor id by normalized tax ID, then by normalized name. No query once the index is loaded."""
+    _ensure_loaded()
+    with _lock:
+        if tax_id:
+            vid = _by_tax_id.get(normalize_tax_id(tax_id))
+            if vid:
+                return vid
+        if name:
+            return _by_name.get(normalize_vendor_name(name))
+    return None
+
+def get_vendor_identity(vendor_id: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """(name, tax_id) for a vendor id, or None if the index does not know it."""
+    _ensure_loaded()
+    with _lock:
+        return _by_id.get(str(vendor_id))
+
+def get_vendor_index_stats() -> Dict[str, object]:
+    with _lock:
+        return {
+            "vendors": len(_by_id),
+            "loaded": _loaded_at is not None,
+            "listening": is_listening(),
+        }
@@ -0,0 +1,251 @@
+"""Fuzzy vendor matching for invoices whose supplier does not resolve exactly.
+
+Names are normalized (accents, punctuation, "&", legal suffixes such as Corp./Ltd/GmbH)
+and indexed by character trigram; tax IDs by normalized value and by digits only (so a
+country prefix or separators do not matter). A lookup walks only the rarest postings of
+the query's trigrams and scores a short list exactly, which keeps it well under a
+millisecond on a 50k-vendor master. Like vendor_index, the index lives per process and
+is dropped on NOTIFY vendors_changed.
+"""
+import heapq
+import os
+import re
+import time
+import threading
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+from db import get_conn
+from db_events import subscribe, start_listener, is_listening, notify
+from vendor_index import VENDORS_CHANNEL, normalize_tax_id, VENDOR_INDEX_MAX_AGE_SECONDS
+from invoice_fingerprint import refingerprint_invoices
+
+VENDOR_FUZZY_MIN_SCORE = float(os.getenv("VENDOR_FUZZY_MIN_SCORE", "0.5"))
+# At or above this score a candidate is assigned without review (ingest and bulk re-resolve)
+VENDOR_FUZZY_AUTO_SCORE = float(os.getenv("VENDOR_FUZZY_AUTO_SCORE", "0.9"))
+# Posting entries walked per lookup; rarest trigrams first
+VENDOR_FUZZY_POSTINGS_BUDGET = int(os.getenv("VENDOR_FUZZY_POSTINGS_BUDGET", "1000"))
+VENDOR_FUZZY_SHORTLIST = int(os.getenv("VENDOR_FUZZY_SHORTLIST", "50"))
+
+_INVOICE_VENDOR_LOCK_KEY = 0x7665_6e64_6f72_73
+
+_LEGAL_SUFFIXES = {
+    "inc", "incorporated", "corp", "corporation", "co", "company", "ltd", "limited",
+    "llc", "llp", "lp", "plc", "gmbh", "mbh", "ag", "kg", "sa", "sas", "sarl", "srl",
+    "spa", "bv", "nv", "oy", "ab", "pty", "pte", "kk", "sl",
+}
+_DOTTED_INITIALS = re.compile(r"\b[a-z](?:\.[a-z])+\.?")
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+_DIGITS = re.compile(r"\D")
+
+def _ascii_lower(value) -> str:
+    return unicodedata.normalize("NFKD", str(value or "")).encode("ascii", "ignore").decode("ascii").lower()
+
+def normalize_company_name(value) -> str:
+    """"ACME Corp." and "Acme Corporation Ltd" both become "acme"."""
+    s = _ascii_lower(value).replace("&", " and ")
+    s = _DOTTED_INITIALS.sub(lambda m: m.group(0).replace(".", ""), s)
+    tokens = _NON_ALNUM.sub(" ", s).split()
+    core = list(tokens)
+    if core and core[0] == "the":
+        core.pop(0)
+    while core and core[-1] in _LEGAL_SUFFIXES:
+        core.pop()
+    # A name that is nothing but suffixes ("The Company") keeps its tokens
+    return " ".join(core or tokens)
+
+def _trigrams(key: str) -> Set[str]:
+    padded = f" {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _address_tokens(value) -> Set[str]:
+    return set(_NON_ALNUM.sub(" ", _ascii_lower(value)).split())
+
+def _tax_digits(value) -> str:
+    digits = _DIGITS.sub("", str(value or ""))
+    return digits if len(digits) >= 6 else ""
+
+class VendorMatcher:
+    """Immutable trigram / tax ID index over (vendor_id, name, tax_id, address) rows."""
+
+    def __init__(self, rows: Sequence[Tuple[Any, Optional[str], Optional[str], Optional[str]]]):
+        self.names: List[str] = []
+        self.ids: List[str] = []
+        self.grams: List[Set[str]] = []
+        self.gram_counts: List[int] = []
+        self.addresses: List[Set[str]] = []
+        self.postings: Dict[str, List[int]] = {}
+        self.by_tax_id: Dict[str, int] = {}
+        self.by_tax_digits: Dict[str, int] = {}
+        for vendor_id, name, tax_id, address in rows:
+            k = len(self.ids)
+            self.ids.append(str(vendor_id))
+            self.names.append(name or "")
+            grams = _trigrams(normalize_company_name(name)) if name else set()
+            self.grams.append(grams)
+            self.gram_counts.append(len(grams))
+            self.addresses.append(_address_tokens(address))
+            for g in grams:
+                self.postings.setdefault(g, []).append(k)
+            if tax_id and normalize_tax_id(tax_id):
+                self.by_tax_id.setdefault(normalize_tax_id(tax_id), k)
+            if _tax_digits(tax_id):
+                self.by_tax_digits.setdefault(_tax_digits(tax_id), k)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _candidate(self, k: int, score: float, matched_on: str) -> Dict[str, Any]:
+        return {"vendorId": self.ids[k], "name": self.names[k], "score": round(min(1.0, score), 4), "matchedOn": matched_on}
+
+    def candidates(self, name: Optional[str] = None, tax_id: Optional[str] = None, address: Optional[str] = None,
+                   limit: int = 5, min_score: float = VENDOR_FUZZY_MIN_SCORE) -> List[Dict[str, Any]]:
+        """Scored candidates, best first. A tax ID hit scores 1.0 (0.98 on digits only); names score
+        by trigram Dice coefficient of their normalized form, plus up to 0.1 for address overlap."""
+        scored: Dict[int, Tuple[float, str]] = {}
+        if tax_id:
+            k = self.by_tax_id.get(normalize_tax_id(tax_id))
+            if k is not None:
+                scored[k] = (1.0, "taxId")
+            else:
+                k = self.by_tax_digits.get(_tax_digits(tax_id))
+                if k is not None:
+                    scored[k] = (0.98, "taxId")
+        key = normalize_company_name(name) if name else ""
+        if key:
+            query = _trigrams(key)
+            counts: Counter = Counter()
+            budget = VENDOR_FUZZY_POSTINGS_BUDGET
+            # Rare trigrams discriminate best and have short postings; stop once the budget is spent
+            for g in sorted(query, key=lambda g: len(self.postings.get(g, ()))):
+                posting = self.postings.get(g)
+                if not posting:
+                    continue
+                if budget <= 0:
+                    break
+                counts.update(posting)
+                budget -= len(posting)
+            query_address = _address_tokens(address) if address else set()
+            # Shortlist on the Dice estimate from the walked postings; shorter names win ties on count
+            q = len(query)
+            shortlist = heapq.nlargest(
+                VENDOR_FUZZY_SHORTLIST, counts.items(), key=lambda kc: kc[1] / (q + self.gram_counts[kc[0]])
+            )
+            for k, _ in shortlist:
+                grams = self.grams[k]
+                score = 2.0 * len(query & grams) / (len(query) + len(grams))
+                if query_address and self.addresses[k]:
+                    overlap = len(query_address & self.addresses[k]) / len(query_address | self.addresses[k])
+                    score += 0.1 * overlap
+                if score > scored.get(k, (0.0, ""))[0]:
+                    scored[k] = (score, "name")
+        # On equal scores a tax ID hit ranks above a name hit
+        ranked = sorted(scored.items(), key=lambda item: (-item[1][0], item[1][1] != "taxId", self.names[item[0]]))
+        return [self._candidate(k, score, on) for k, (score, on) in ranked if score >= min_score][:limit]
+
+_lock = threading.Lock()
+_matcher: Optional[VendorMatcher] = None
+_loaded_at: Optional[float] = None
+_generation = 0
+
+def invalidate(_payload: Optional[str] = None) -> None:
+    global _loaded_at, _generation
+    with _lock:
+        _loaded_at = None
+        _generation += 1
+
+subscribe(VENDORS_CHANNEL, invalidate)
+
+def get_vendor_matcher() -> VendorMatcher:
+    """The process-wide matcher, (re)built on first use and after a vendors_changed NOTIFY."""
+    global _matcher, _loaded_at
+    start_listener()
+    with _lock:
+        matcher, loaded_at, generation = _matcher, _loaded_at, _generation
+    stale = matcher is None or loaded_at is None or (
+        not is_listening() and time.monotonic() - loaded_at > VENDOR_INDEX_MAX_AGE_SECONDS
+    )
+    if not stale:
+        return matcher
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, name, tax_id, address FROM vendors ORDER BY id")
+            matcher = VendorMatcher(cur.fetchall())
+    with _lock:
+        _matcher = matcher
+        # An invalidation that raced with this load leaves the index marked stale
+        _loaded_at = time.monotonic() if generation == _generation else None
+    return matcher
+
+def match_vendor(tax_id: Optional[str] = None, name: Optional[str] = None, address: Optional[str] = None,
+                 limit: int = 5) -> List[Dict[str, Any]]:
+    return get_vendor_matcher().candidates(name=name, tax_id=tax_id, address=address, limit=limit)
+
+def _unambiguous(found: List[Dict[str, Any]], min_score: float) -> Optional[str]:
+    """Best candidate's vendor id unless it is below min_score or tied with another on the same evidence."""
+    if not found or found[0]["score"] < min_score:
+        return None
+    if len(found) > 1 and found[1]["score"] >= found[0]["score"] and found[1]["matchedOn"] == found[0]["matchedOn"]:
+        return None
+    return found[0]["vendorId"]
+
+def auto_match_vendor_id(tax_id: Optional[str], name: Optional[str], address: Optional[str] = None) -> Optional[str]:
+    """Vendor id when the best candidate clears VENDOR_FUZZY_AUTO_SCORE unambiguously."""
+    return _unambiguous(match_vendor(tax_id=tax_id, name=name, address=address, limit=2), VENDOR_FUZZY_AUTO_SCORE)
+
+def resolve_unassigned_invoices(min_score: float = VENDOR_FUZZY_AUTO_SCORE) -> Dict[str, Any]:
+    """Re-resolve every invoice with vendor_id NULL against the vendor master in one pass.
+    Matches are written with a single UPDATE ... FROM unnest(...); rows assigned meanwhile are left alone.
+    """
+    # invoice_db resolves vendors through this module at ingest
+    from invoice_db import INVOICES_CHANNEL
+    started = time.monotonic()
+    summary: Dict[str, Any] = {"invoices": 0, "resolved": 0, "duplicates": 0, "skipped": False}
+    matcher = get_vendor_matcher()
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (_INVOICE_VENDOR_LOCK_KEY,))
+            if not cur.fetchone()[0]:
+                summary["skipped"] = True
+                return summary
+            cur.execute(
+                """
+                SELECT id, supplier_tax_id, supplier_name, supplier_address
+                FROM invoices
+                WHERE vendor_id IS NULL
+                """
+            )
+            invoice_ids: List[Any] = []
+            vendor_ids: List[str] = []
+            # Suppliers repeat across invoices; score each distinct one once
+            memo: Dict[Tuple[Any, Any, Any], Optional[str]] = {}
+            for inv_id, tax_id, name, address in cur.fetchall():
+                summary["invoices"] += 1
+                key = (tax_id, name, address)
+                if key not in memo:
+                    found = matcher.candidates(name=name, tax_id=tax_id, address=address, limit=2, min_score=min_score)
+                    memo[key] = _unambiguous(found, min_score)
+                if memo[key]:
+                    invoice_ids.append(inv_id)
+                    vendor_ids.append(memo[key])
+            if invoice_ids:
+                cur.execute(
+                    """
+                    UPDATE invoices i
+                    SET vendor_id = u.vendor_id
+                    FROM unnest(%s::uuid[], %s::uuid[]) AS u(invoice_id, vendor_id)
+                    WHERE i.id = u.invoice_id
+                      AND i.vendor_id IS NULL
+                    RETURNING i.id
+                    """,
+                    (invoice_ids, vendor_ids)
+                )
+                resolved = [r[0] for r in cur.fetchall()]
+                summary["resolved"] = len(resolved)
+                # Duplicate detection is scoped by vendor; a copy ingested without the tax ID
+                # meets its original only now
+                summary["duplicates"] = len(refingerprint_invoices(cur, resolved))
+                if resolved:
+                    notify(cur, INVOICES_CHANNEL, "")
+    summary["elapsedMs"] = round((time.monotonic() - started) * 1000, 1)
+    return summary